@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""Measure how long each stage of registers.py takes, and how much memory it
+needs, on the real register descriptions in xml/ and on synthetic ones that
+are 10, 100 and 1000 times the size of xml/dm_registers.xml. Results are
+written as JSON, which can be compared against a saved baseline with
+--compare."""
+
+import sys
+import os
+import copy
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree
+
+import registers
+
+BENCHMARK_FORMAT = "riscv-debug-benchmark"
+BENCHMARK_VERSION = 1
+
+DEFAULT_SCALES = ( 10, 100, 1000 )
+
+# registers.xml files that the Makefile generates Scala for.
+CHISEL_FILES = ( "dm_registers", "abstract_commands" )
+
+def clear_caches():
+    """Forget everything registers.py has memoized, so that every repeat
+    measures a cold run of the stages."""
+    for function in ( registers.cached_simplify, registers.bit_expression,
+            registers.bit_difference, registers.compare_bits ):
+        function.cache_clear()
+
+def write_latex( fd, model ):
+    if not model.skip_index:
+        registers.print_latex_index( fd, model )
+    registers.print_latex_custom( fd, model )
+
+def check( model ):
+    for r in model.registers:
+        r.check()
+
+def stages( path, chisel ):
+    """Return a list of ( name, function ) for every stage run on path. Each
+    function takes the model returned by the first one (parse_xml)."""
+    writers = [
+        ( "write_definitions", registers.write_definitions ),
+        ( "write_cheader", registers.write_cheader ),
+        ( "write_latex", write_latex ),
+        ( "write_ctable", registers.write_ctable ),
+        ( "write_pytable", registers.write_pytable ),
+        ( "write_compiled", registers.write_compiled ) ]
+    if chisel:
+        writers.append( ( "write_chisel", registers.write_chisel ) )
+    result = [ ( "parse_xml", lambda model: registers.parse_xml( path ) ),
+            ( "check", check ) ]
+    for name, writer in writers:
+        result.append( ( name, lambda model, writer=writer:
+            writer( registers.Output(), model ) ) )
+    return result
+
+def run_stages( path, chisel, repeat ):
+    """Return a dictionary mapping stage name to the fastest time in seconds
+    over repeat cold runs, and the peak memory in bytes allocated during that
+    stage. For parse_xml, retained_bytes is the memory still used afterwards,
+    which is mostly the model itself."""
+    results = {}
+    for i in range( repeat ):
+        clear_caches()
+        model = None
+        for name, function in stages( path, chisel ):
+            start = time.perf_counter()
+            value = function( model )
+            seconds = time.perf_counter() - start
+            if model is None:
+                model = value
+            if name not in results or seconds < results[ name ][ "seconds" ]:
+                results[ name ] = { "seconds": seconds }
+
+    # Tracing allocations slows everything down a lot, so peak memory is
+    # measured in a separate run.
+    clear_caches()
+    model = None
+    tracemalloc.start()
+    try:
+        for name, function in stages( path, chisel ):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[ 0 ]
+            value = function( model )
+            current, peak = tracemalloc.get_traced_memory()
+            results[ name ][ "peak_bytes" ] = peak - before
+            if name == "parse_xml":
+                results[ name ][ "retained_bytes" ] = current - before
+            if model is None:
+                model = value
+    finally:
+        tracemalloc.stop()
+    return results, model
+
+def describe( path, model ):
+    fields = sum( len( r.fields ) for r in model.registers )
+    values = sum( len( f.values ) for r in model.registers for f in r.fields )
+    return {
+        "path": path,
+        "bytes": os.path.getsize( path ),
+        "registers": len( model.registers ),
+        "fields": fields,
+        "values": values
+    }
+
+def synthetic_register( index ):
+    """Return a register with symbolic XLEN fields and a field with many
+    enumerated values, like the trigger registers in hwbp_registers.xml."""
+    register = xml.etree.ElementTree.Element( "register", {
+        "name": "Synthetic Trigger %d" % index,
+        "short": "synthtrigger%d" % index,
+        "address": "0x%x" % ( index * 0x100 + 0x80 ) } )
+    register.text = "Synthetic register %d with XLEN dependent fields." % index
+    register.tail = "\n"
+    for name, bits, access in (
+            ( "type", "XLEN-1:XLEN-4", "WARL" ),
+            ( "dmode", "XLEN-5", "R/W" ),
+            ( "maskmax", "XLEN-6:22", "R" ),
+            ( "0", "21:20", "R" ),
+            ( "action", "19:12", "WARL" ),
+            ( "match", "11:0", "WARL" ) ):
+        field = xml.etree.ElementTree.SubElement( register, "field", {
+            "name": name, "bits": bits, "access": access, "reset": "0" } )
+        field.text = "Synthetic field %s." % name
+        field.tail = "\n"
+    for v in range( 64 ):
+        value = xml.etree.ElementTree.SubElement( field, "value", {
+            "v": str( v ), "name": "match%d" % v } )
+        value.text = "Match value %d." % v
+        value.tail = "\n"
+    return register
+
+def write_synthetic( path, scale, template ):
+    """Write an XML file to path with scale copies of every register in the
+    template XML file, plus one synthetic register per copy."""
+    root = xml.etree.ElementTree.parse( template ).getroot()
+    originals = root.findall( "register" )
+    for r in originals:
+        root.remove( r )
+    root.set( "name", "%s x%d" % ( root.get( "name" ), scale ) )
+    for c in range( scale ):
+        for r in originals:
+            r = copy.deepcopy( r )
+            r.set( "name", "%s %d" % ( r.get( "name" ), c ) )
+            if r.get( "short" ):
+                r.set( "short", "%s%d" % ( r.get( "short" ), c ) )
+            if r.get( "address" ):
+                r.set( "address", "0x%x" % ( c * 0x100 +
+                    int( r.get( "address" ), 0 ) ) )
+            root.append( r )
+        root.append( synthetic_register( c ) )
+    xml.etree.ElementTree.ElementTree( root ).write( path )
+
+def benchmark( inputs, repeat ):
+    results = {}
+    for name, path, chisel in inputs:
+        sys.stderr.write( "%s...\n" % name )
+        stages, model = run_stages( path, chisel, repeat )
+        results[ name ] = describe( path, model )
+        results[ name ][ "stages" ] = stages
+    return results
+
+# ( key, scale, unit, label ) of every measurement that is compared.
+METRICS = (
+    ( "seconds", 1000, "ms", "time" ),
+    ( "peak_bytes", 1 / 1024, "KiB", "memory" ),
+    ( "retained_bytes", 1 / 1024, "KiB", "model size" ) )
+
+# Differences smaller than this are never reported as regressions, since they
+# are mostly noise.
+NOISE = { "seconds": 0.002, "peak_bytes": 16384, "retained_bytes": 16384 }
+
+def compare( baseline, current, threshold ):
+    """Print a table comparing current results against baseline. Return the
+    number of measurements that got more than threshold times slower or
+    bigger."""
+    regressions = 0
+    sys.stdout.write( "%-24s %-18s" % ( "input", "stage" ) )
+    for key, scale, unit, label in METRICS:
+        sys.stdout.write( " %10s %10s %6s" % ( "base " + unit, unit, "ratio" ) )
+    sys.stdout.write( "\n" )
+    for name, result in current[ "inputs" ].items():
+        old = baseline[ "inputs" ].get( name )
+        if old is None:
+            continue
+        for stage, measured in result[ "stages" ].items():
+            previous = old[ "stages" ].get( stage )
+            if previous is None:
+                continue
+            line = "%-24s %-18s" % ( name, stage )
+            flags = []
+            for key, scale, unit, label in METRICS:
+                if key not in measured or key not in previous:
+                    line += " %10s %10s %6s" % ( "", "", "" )
+                    continue
+                ratio = measured[ key ] / max( previous[ key ], 1e-9 )
+                line += " %10.2f %10.2f %6.2f" % ( previous[ key ] * scale,
+                        measured[ key ] * scale, ratio )
+                if ratio > threshold and \
+                        measured[ key ] - previous[ key ] > NOISE[ key ]:
+                    flags.append( label )
+            regressions += len( flags )
+            if flags:
+                line += "  REGRESSION (%s)" % ", ".join( flags )
+            sys.stdout.write( line.rstrip() + "\n" )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'path', nargs='*',
+            help='XML register files to measure. Defaults to xml/*.xml.' )
+    parser.add_argument( '--scale', type=int, action='append',
+            help='Also measure a synthetic file this many times the size of '
+            'xml/dm_registers.xml. Defaults to %s.' %
+            ", ".join( map( str, DEFAULT_SCALES ) ) )
+    parser.add_argument( '--repeat', type=int, default=3,
+            help='Report the fastest of this many runs of each stage.' )
+    parser.add_argument( '--synthetic-dir',
+            help='Keep the synthetic XML files in this directory.' )
+    parser.add_argument( '--output', '-o',
+            help='Write the results to the named file instead of stdout.' )
+    parser.add_argument( '--compare', metavar='BASELINE',
+            help='Compare the results against a file written by --output, '
+            'and exit with status 1 if anything regressed.' )
+    parser.add_argument( '--threshold', type=float, default=1.25,
+            help='With --compare, report stages that are more than this many '
+            'times slower or bigger than the baseline.' )
+    parsed = parser.parse_args()
+
+    directory = os.path.dirname( os.path.abspath( __file__ ) )
+    paths = parsed.path or sorted(
+            os.path.join( directory, "xml", name )
+            for name in os.listdir( os.path.join( directory, "xml" ) )
+            if name.endswith( ".xml" ) )
+    scales = parsed.scale or DEFAULT_SCALES
+
+    with tempfile.TemporaryDirectory() as temporary:
+        synthetic = parsed.synthetic_dir or temporary
+        inputs = []
+        for path in paths:
+            name = os.path.splitext( os.path.basename( path ) )[0]
+            inputs.append( ( name, path, name in CHISEL_FILES ) )
+        for scale in scales:
+            path = os.path.join( synthetic, "synthetic_x%d.xml" % scale )
+            write_synthetic( path, scale,
+                    os.path.join( directory, "xml", "dm_registers.xml" ) )
+            # The synthetic registers have symbolic fields, which
+            # write_chisel doesn't support.
+            inputs.append( ( "synthetic_x%d" % scale, path, False ) )
+        results = {
+            "format": BENCHMARK_FORMAT,
+            "version": BENCHMARK_VERSION,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": parsed.repeat,
+            "inputs": benchmark( inputs, parsed.repeat )
+        }
+
+    text = json.dumps( results, indent=2, sort_keys=True ) + "\n"
+    if parsed.output:
+        registers.write_if_changed( parsed.output, text )
+    elif not parsed.compare:
+        sys.stdout.write( text )
+
+    if parsed.compare:
+        with open( parsed.compare ) as fd:
+            baseline = json.load( fd )
+        assert baseline.get( "format" ) == BENCHMARK_FORMAT and \
+                baseline.get( "version" ) == BENCHMARK_VERSION, \
+                "%s is not a benchmark result" % parsed.compare
+        if compare( baseline, results, parsed.threshold ):
+            return 1
+
+if __name__ == "__main__":
+    sys.exit( main() )
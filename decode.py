@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""Decode captured raw register values (e.g. from dmstatus, abstractcs, sbcs,
+dmcontrol or tdata1) into their fields, using the register descriptions in
+xml/. Decoding is done with vectorized mask and shift operations in NumPy, so
+millions of samples can be handled per second."""
+
+import sys
+import argparse
+import numpy
+
+from registers import read_registers, symbol_values, find_register
+
+def unsigned_type( bits ):
+    """Return the smallest NumPy unsigned integer type that holds bits bits."""
+    for t in ( numpy.uint8, numpy.uint16, numpy.uint32, numpy.uint64 ):
+        if bits <= numpy.iinfo( t ).bits:
+            return t
+    raise ValueError( "Can't decode values of more than 64 bits" )
+
+class DecodedField( object ):
+    def __init__( self, field, offset, length ):
+        self.name = field.name
+        self.offset = offset
+        self.length = length
+        self.mask = ( 1 << length ) - 1
+        self.type = unsigned_type( length )
+
+        # Enumerated values, as sorted intervals so that names can be looked up
+        # with a single searchsorted().
+        intervals = []
+        for v in field.values:
+            if v.range:
+                intervals.append(( int( v.low, 0 ), int( v.high, 0 ), v.name ))
+            else:
+                intervals.append(( int( v.value, 0 ), int( v.value, 0 ), v.name ))
+        intervals.sort()
+        self.lows = numpy.array( [ i[0] for i in intervals ], dtype=numpy.uint64 )
+        self.highs = numpy.array( [ i[1] for i in intervals ], dtype=numpy.uint64 )
+        self.names = numpy.array( [ i[2] for i in intervals ] + [ "" ] )
+        # Small fields get a table with the index into names of every possible
+        # value.
+        self.table = None
+        if len( self.lows ) and length <= 16:
+            self.table = self.name_indices( numpy.arange( 1 << length,
+                dtype=numpy.uint64 ) )
+
+    def value_names( self, values ):
+        """Return an array with the Value name of each of values, or "" where a
+        value has no name."""
+        if not len( self.lows ):
+            return numpy.full( values.shape, "", dtype=self.names.dtype )
+        if self.table is not None:
+            return self.names[ self.table[ values ] ]
+        return self.names[ self.name_indices( values.astype( numpy.uint64 ) ) ]
+
+    def name_indices( self, values ):
+        """Return the index into self.names of each of values (uint64)."""
+        position = numpy.searchsorted( self.lows, values, side="right" )
+        position = position.astype( numpy.intp ) - 1
+        valid = position >= 0
+        clipped = numpy.where( valid, position, 0 )
+        valid &= values <= self.highs[ clipped ]
+        # The extra "" at the end of self.names is used for invalid values.
+        return numpy.where( valid, clipped, len( self.lows ) )
+
+class Decoder( object ):
+    """Decodes raw values of one register. Symbolic bit positions (XLEN-1 etc.)
+    are resolved for the given xlen, by instantiating the register (see
+    Register.instantiate())."""
+    def __init__( self, register, xlen=None ):
+        if xlen:
+            register = register.instantiate( symbol_values( xlen ) )
+        self.register = register
+        self.fields = []
+        width = 0
+        for f in register.fields:
+            high = f.highBitValue
+            low = f.lowBitValue
+            if high is None or low is None:
+                raise ValueError( "%s in %s has symbolic bits %s:%s; specify "
+                        "an XLEN" % ( f, register, f.highBit, f.lowBit ) )
+            width = max( width, high + 1 )
+            if f.name != "0" and high >= low:
+                self.fields.append( DecodedField( f, low, high + 1 - low ) )
+        self.width = width
+        self.type = unsigned_type( width )
+
+    def enumerated( self ):
+        return [ f for f in self.fields if len( f.lows ) ]
+
+    def dtype( self, names=False ):
+        columns = [ ( f.name, f.type ) for f in self.fields ]
+        if names:
+            columns += [ ( f.name + "_name", f.names.dtype )
+                    for f in self.enumerated() ]
+        return numpy.dtype( columns )
+
+    def decode( self, raw, names=False ):
+        """Decode raw, which is a NumPy array or anything numpy.asarray()
+        accepts (including buffers), into a structured array with one column
+        per field. If names is set, there is also a column FIELD_name for each
+        field that has enumerated values, holding the name of the value."""
+        # Work in the narrowest type that holds the register, which means less
+        # memory traffic for 32-bit registers.
+        raw = numpy.asarray( raw ).astype( self.type, copy=False )
+        result = numpy.empty( raw.shape, dtype=self.dtype( names ) )
+        for f in self.fields:
+            result[ f.name ] = ( raw >> self.type( f.offset ) ) & \
+                    self.type( f.mask )
+        if names:
+            for f in self.enumerated():
+                result[ f.name + "_name" ] = f.value_names( result[ f.name ] )
+        return result
+
+# Value of each byte in a hex capture: the digit value, WHITESPACE or X, and
+# INVALID for anything else.
+WHITESPACE = 16
+X = 17
+INVALID = 255
+HEX_DIGITS = numpy.full( 256, INVALID, dtype=numpy.uint8 )
+for i, c in enumerate( b"0123456789abcdef" ):
+    HEX_DIGITS[ c ] = i
+    HEX_DIGITS[ ord( chr( c ).upper() ) ] = i
+for c in b" \t\r\n\v\f":
+    HEX_DIGITS[ c ] = WHITESPACE
+HEX_DIGITS[ ord( "x" ) ] = HEX_DIGITS[ ord( "X" ) ] = X
+
+def parse_hex( data ):
+    """Return the whitespace-separated hex numbers (with or without 0x) in the
+    bytes data as a uint64 array. Every byte is looked up in one operation,
+    and the digits of each number are combined with one reduceat()."""
+    digits = HEX_DIGITS[ numpy.frombuffer( data, dtype=numpy.uint8 ) ]
+    x = numpy.flatnonzero( digits == X )
+    if len( x ):
+        # A 0x prefix has to start a number, and be followed by a digit.
+        before = digits[ numpy.maximum( x - 2, 0 ) ]
+        after = digits[ numpy.minimum( x + 1, len( digits ) - 1 ) ]
+        good = ( x >= 1 ) & ( digits[ x - 1 ] == 0 ) & \
+                ( ( x < 2 ) | ( before == WHITESPACE ) ) & \
+                ( x + 1 < len( digits ) ) & ( after < 16 )
+        if not good.all():
+            raise ValueError( "misplaced x at offset %d" % x[ ~good ][0] )
+        digits[ x - 1 ] = digits[ x ] = WHITESPACE
+    invalid = numpy.flatnonzero( digits == INVALID )
+    if len( invalid ):
+        raise ValueError( "%r at offset %d isn't a hex digit" % (
+            data[ invalid[0] : invalid[0] + 1 ], invalid[0] ) )
+
+    position = numpy.flatnonzero( digits < 16 )
+    if not len( position ):
+        return numpy.zeros( 0, dtype=numpy.uint64 )
+    starts = numpy.flatnonzero( numpy.diff( position, prepend=-2 ) != 1 )
+    lengths = numpy.diff( starts, append=len( position ) )
+    if lengths.max() > 16:
+        raise ValueError( "hex number at offset %d has more than 16 digits" %
+                position[ starts[ lengths.argmax() ] ] )
+    # How many digits follow each digit in its number.
+    shift = numpy.repeat( starts + lengths, lengths ) - 1 - \
+            numpy.arange( len( position ) )
+    values = digits[ position ].astype( numpy.uint64 ) << \
+            ( shift.astype( numpy.uint64 ) * numpy.uint64( 4 ) )
+    return numpy.bitwise_or.reduceat( values, starts )
+
+def decimal_digits( column ):
+    """Return column (unsigned integers) as a matrix with a row of ASCII
+    decimal digits per value, where leading zeros are 0 bytes instead."""
+    column = column.astype( numpy.uint64 )[ :, None ]
+    width = len( str( int( column.max() ) ) ) if len( column ) else 1
+    powers = numpy.uint64( 10 ) ** numpy.arange( width - 1, -1, -1,
+            dtype=numpy.uint64 )
+    digits = ( column // powers ) % numpy.uint64( 10 ) + numpy.uint64( 48 )
+    significant = ( column >= powers ) | ( powers == 1 )
+    return numpy.where( significant, digits, 0 ).astype( numpy.uint8 )
+
+def write_columns( fd, decoded, rows=1 << 16 ):
+    """Write decoded (as returned by Decoder.decode()) to the binary file fd as
+    text: a header line with the column names, and a line of values per
+    element. Each column of a block of rows is converted to digits (or
+    names) in one operation, and the columns are laid out next to each other
+    in a byte matrix, whose padding is then dropped."""
+    names = decoded.dtype.names
+    fd.write( ( " ".join( names ) + "\n" ).encode() )
+    for start in range( 0, len( decoded ), rows ):
+        block = decoded[ start : start + rows ]
+        separator = numpy.full( ( len( block ), 1 ), ord( " " ),
+                dtype=numpy.uint8 )
+        parts = []
+        for name in names:
+            column = block[ name ]
+            if column.dtype.kind == "u":
+                parts.append( decimal_digits( column ) )
+            else:
+                # Value names are ASCII, so each UCS-4 character is one byte.
+                characters = numpy.ascontiguousarray( column ).view(
+                        numpy.uint32 ).reshape( len( block ), -1 )
+                assert not len( characters ) or characters.max() < 128
+                parts.append( characters.astype( numpy.uint8 ) )
+            parts.append( separator )
+        parts[ -1 ] = numpy.full_like( separator, ord( "\n" ) )
+        matrix = numpy.concatenate( parts, axis=1 )
+        fd.write( matrix[ matrix != 0 ].tobytes() )
+
+def read_capture( path, format, width ):
+    """Return the raw values in the capture file at path as a uint64 array.
+    Binary captures are little-endian words of width bits, rounded up to a
+    whole number of bytes. Hex captures contain whitespace-separated hex
+    numbers, with or without 0x."""
+    if format == "bin":
+        itemsize = numpy.dtype( unsigned_type( width ) ).itemsize
+        dtype = numpy.dtype( unsigned_type( width ) ).newbyteorder( "<" )
+        data = numpy.fromfile( path, dtype=numpy.uint8 )
+        data = data[ : len( data ) - len( data ) % itemsize ]
+        return data.view( dtype ).astype( numpy.uint64 )
+    blocks = []
+    rest = b""
+    with open( path, "rb" ) as fd:
+        while True:
+            data = fd.read( 1 << 24 )
+            if not data:
+                break
+            # Don't split a number between two blocks.
+            data = rest + data
+            end = max( data.rfind( c ) for c in b" \t\r\n\v\f" ) + 1
+            blocks.append( parse_hex( data[ :end ] ) )
+            rest = data[ end: ]
+    blocks.append( parse_hex( rest ) )
+    return numpy.concatenate( blocks )
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'xml', help='XML register file (or compiled model).' )
+    parser.add_argument( 'register', help='Name of the register to decode.' )
+    parser.add_argument( 'capture', help='File containing the raw values.' )
+    parser.add_argument( '--format', choices=( 'hex', 'bin' ), default='hex',
+            help='Format of the capture file.' )
+    parser.add_argument( '--xlen', type=int,
+            help='XLEN used to resolve symbolic bit positions.' )
+    parser.add_argument( '--names', action='store_true',
+            help='Also print the names of enumerated values.' )
+    parsed = parser.parse_args()
+
+    decoder = Decoder( find_register( read_registers( parsed.xml ),
+        parsed.register ), parsed.xlen )
+    decoded = decoder.decode( read_capture( parsed.capture, parsed.format,
+        decoder.width ), parsed.names )
+
+    write_columns( sys.stdout.buffer, decoded )
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,749 @@
+#!/usr/bin/env python3
+
+"""A Debug Module and JTAG DTM that run on the host, so that the throughput of
+a debugger's DMI sequences can be measured and regression tested without any
+hardware. The DM registers come from xml/dm_registers.xml: every field behaves
+as its access type (R, R/W, R/W1C, W1, WARL, WARZ) says, and starts out at its
+reset value. dtmcs, dmi and the IR come from xml/jtag_registers.xml. There is
+one hart, which starts out halted, with GPRs, CSRs and a block of RAM that the
+system bus can access too.
+
+DMI operations can be run in batches from Python with DebugModule.batch(), or
+the DTM can be driven over TCP with OpenOCD's remote_bitbang protocol."""
+
+import sys
+import time
+import socket
+import argparse
+
+from registers import find_register
+from scancost import add_config_arguments, config_from_arguments, read_xml, \
+        CMDTYPES, EBREAK
+
+# Fields with these access types keep what is written to them. WARZ fields
+# (like command) read 0, but the DM still needs to know what was written.
+STORED = ( "R/W", "WARL", "WARZ" )
+# Fields with these access types read back their value. W1 and WARZ fields
+# always read 0.
+READABLE = ( "R", "R/W", "R/W1C", "WARL" )
+# Writing 1 to a bit of these clears it.
+CLEARED = ( "R/W1C", )
+
+GPR_REGNO = 0x1000
+CSR_REGNOS = range( 0x1000 )
+
+def field_mask( f ):
+    return ( ( 1 << ( f.highBitValue + 1 - f.lowBitValue ) ) - 1 ) << \
+            f.lowBitValue
+
+def reset_value( f, presets ):
+    """Return the reset value of f. Preset fields are looked up by name in
+    presets. Fields without a reset value (like "-") start at 0."""
+    if f.reset is None:
+        return 0
+    if f.reset.lower() == "preset":
+        return presets.get( f.name, 0 )
+    try:
+        return int( f.reset, 0 )
+    except ValueError:
+        return 0
+
+class Layout( object ):
+    """How a register responds to accesses, from the access types of its
+    fields. Registers without fields (like data1) are 32 bits of R/W."""
+    def __init__( self, register, presets ):
+        self.register = register
+        self.fields = {}
+        self.readMask = 0
+        self.storeMask = 0
+        self.clearMask = 0
+        self.reset = 0
+        if not register.fields:
+            self.readMask = self.storeMask = 0xffffffff
+        for f in register.fields:
+            if f.name == "0":
+                continue
+            mask = field_mask( f )
+            self.fields[ f.name ] = ( f.lowBitValue, mask )
+            if f.access in READABLE:
+                self.readMask |= mask
+            if f.access in STORED:
+                self.storeMask |= mask
+            if f.access in CLEARED:
+                self.clearMask |= mask
+            self.reset |= ( reset_value( f, presets ) << f.lowBitValue ) & mask
+
+    def write( self, old, value ):
+        """Return the value of the register after value was written to it,
+        when it was old."""
+        new = ( old & ~self.storeMask ) | ( value & self.storeMask )
+        return new & ~( value & self.clearMask )
+
+    def get( self, value, name ):
+        low, mask = self.fields[ name ]
+        return ( value & mask ) >> low
+
+    def set( self, value, name, fieldValue ):
+        low, mask = self.fields[ name ]
+        return ( value & ~mask ) | ( ( fieldValue << low ) & mask )
+
+def value_codes( register, name ):
+    """Return a dictionary mapping the name of every Value of field name in
+    register to its value."""
+    field = [ f for f in register.fields if f.name == name ][0]
+    return dict( ( v.name, int( v.value, 0 ) ) for v in field.values
+            if not v.duplicate )
+
+def presets( config ):
+    """Return the value of every Preset field for config."""
+    result = {
+        "authenticated": 1,
+        "impebreak": int( config.impebreak ),
+        "progbufsize": config.progbufsize,
+        "datacount": config.datacount,
+        "sbasize": config.sbasize,
+        "idle": config.idle,
+        "abits": config.abits
+    }
+    for width in ( 8, 16, 32, 64, 128 ):
+        result[ "sbaccess%d" % width ] = int( width in config.sbaccess )
+    return result
+
+class CommandError( Exception ):
+    """An abstract command failed. The argument is the name of the cmderr
+    value."""
+    pass
+
+class BusError( Exception ):
+    """A memory access failed. The argument is the name of the sberror
+    value."""
+    pass
+
+class Memory( object ):
+    def __init__( self, base, size ):
+        self.base = base
+        self.data = bytearray( size )
+
+    def offset( self, address, width ):
+        if address % width:
+            raise BusError( "alignment" )
+        offset = address - self.base
+        if offset < 0 or offset + width > len( self.data ):
+            raise BusError( "address" )
+        return offset
+
+    def read( self, address, width ):
+        offset = self.offset( address, width )
+        return int.from_bytes( self.data[ offset:offset + width ], "little" )
+
+    def write( self, address, width, value ):
+        offset = self.offset( address, width )
+        self.data[ offset:offset + width ] = ( value &
+                ( ( 1 << ( 8 * width ) ) - 1 ) ).to_bytes( width, "little" )
+
+def sign_extend( value, bits ):
+    value &= ( 1 << bits ) - 1
+    if value >> ( bits - 1 ):
+        value -= 1 << bits
+    return value
+
+class Hart( object ):
+    def __init__( self, xlen, memory ):
+        self.xlen = xlen
+        self.mask = ( 1 << xlen ) - 1
+        self.memory = memory
+        self.halted = True
+        self.resumeack = False
+        self.gprs = [ 0 ] * 32
+        self.csrs = {}
+
+    def read_register( self, regno ):
+        if GPR_REGNO <= regno < GPR_REGNO + 32:
+            return self.gprs[ regno - GPR_REGNO ]
+        if regno in CSR_REGNOS:
+            return self.csrs.get( regno, 0 )
+        raise CommandError( "exception" )
+
+    def write_register( self, regno, value ):
+        value &= self.mask
+        if GPR_REGNO < regno < GPR_REGNO + 32:
+            self.gprs[ regno - GPR_REGNO ] = value
+        elif regno in CSR_REGNOS:
+            self.csrs[ regno ] = value
+        elif regno != GPR_REGNO:
+            raise CommandError( "exception" )
+
+    def execute( self, program, impebreak ):
+        """Run program (a list of instructions) until it executes ebreak.
+        Only loads, stores, addi and ebreak are supported, which is all a
+        debugger needs to access memory."""
+        pc = 0
+        while True:
+            if pc == len( program ):
+                if impebreak:
+                    return
+                raise CommandError( "exception" )
+            instruction = program[ pc ]
+            if instruction == EBREAK:
+                return
+            opcode = instruction & 0x7f
+            rd = ( instruction >> 7 ) & 0x1f
+            funct3 = ( instruction >> 12 ) & 7
+            rs1 = ( instruction >> 15 ) & 0x1f
+            rs2 = ( instruction >> 20 ) & 0x1f
+            immediate = sign_extend( instruction >> 20, 12 )
+            try:
+                if opcode == 0x03:
+                    width = 1 << ( funct3 & 3 )
+                    value = self.memory.read( ( self.gprs[ rs1 ] +
+                        immediate ) & self.mask, width )
+                    if not funct3 & 4:
+                        value = sign_extend( value, 8 * width )
+                    self.write_register( GPR_REGNO + rd, value )
+                elif opcode == 0x23:
+                    immediate = sign_extend( ( ( instruction >> 25 ) << 5 ) |
+                            rd, 12 )
+                    self.memory.write( ( self.gprs[ rs1 ] + immediate ) &
+                            self.mask, 1 << funct3, self.gprs[ rs2 ] )
+                elif opcode == 0x13 and funct3 == 0:
+                    self.write_register( GPR_REGNO + rd,
+                            self.gprs[ rs1 ] + immediate )
+                else:
+                    raise CommandError( "exception" )
+            except BusError:
+                raise CommandError( "exception" )
+            pc += 1
+
+class DebugModule( object ):
+    """The Debug Module registers in dm_registers.xml, and what accessing them
+    does to the hart and the system bus. Time is counted in TCK cycles (see
+    tick()). Abstract commands and system bus accesses take effect
+    immediately, but stay busy for config.commandIdle and config.busIdle
+    cycles."""
+    def __init__( self, dm, commands, config, memoryBase=0x80000000,
+            memorySize=1 << 20 ):
+        self.config = config
+        values = presets( config )
+        self.layouts = {}
+        self.addresses = {}
+        for r in dm.registers:
+            address = int( r.address, 0 )
+            self.layouts[ address ] = Layout( r, values )
+            self.addresses[ r.short ] = address
+        self.commands = dict( ( r.name, Layout( r, {} ) )
+                for r in commands.registers )
+        self.cmderrs = value_codes( find_register( dm, "abstractcs" ),
+                "cmderr" )
+        self.sberrors = value_codes( find_register( dm, "sbcs" ), "sberror" )
+
+        self.memory = Memory( memoryBase, memorySize )
+        self.hart = Hart( config.xlen, self.memory )
+        self.argumentWords = max( 1, config.xlen // 32 )
+        self.now = 0
+        self.reset()
+
+        self.readUpdates = {
+            "dmstatus": self.update_dmstatus,
+            "haltsum0": self.update_haltsum0,
+            "abstractcs": self.update_abstractcs,
+            "sbcs": self.update_sbcs
+        }
+        self.writeHandlers = {
+            "dmcontrol": self.write_dmcontrol,
+            "command": lambda value: self.execute_command(),
+            "abstractauto": self.write_abstractauto,
+            "sbcs": self.write_sbcs,
+            "sbaddress0": self.write_sbaddress0,
+            "sbdata0": lambda value: self.bus_access( True )
+        }
+        self.abstractRegisters = set( [ "command", "abstractcs",
+            "abstractauto" ] )
+        self.autoexec = {}
+        for i in range( 12 ):
+            self.abstractRegisters.add( "data%d" % i )
+            self.autoexec[ "data%d" % i ] = ( "autoexecdata", i )
+        for i in range( 16 ):
+            self.abstractRegisters.add( "progbuf%d" % i )
+            self.autoexec[ "progbuf%d" % i ] = ( "autoexecprogbuf", i )
+
+    def reset( self ):
+        """Put every DM register back to its reset value, like clearing
+        dmactive does."""
+        self.values = dict( ( address, layout.reset )
+                for address, layout in self.layouts.items() )
+        self.commandBusyUntil = 0
+        self.busBusyUntil = 0
+
+    def tick( self, cycles ):
+        self.now += cycles
+
+    def get( self, name, field ):
+        address = self.addresses[ name ]
+        return self.layouts[ address ].get( self.values[ address ], field )
+
+    def set( self, name, field, value ):
+        address = self.addresses[ name ]
+        self.values[ address ] = self.layouts[ address ].set(
+                self.values[ address ], field, value )
+
+    def read( self, address ):
+        """Do a DMI read of address, and return the value."""
+        layout = self.layouts.get( address )
+        if layout is None:
+            return 0
+        name = layout.register.short
+        if name in self.autoexec and self.abstract_busy():
+            return 0
+        update = self.readUpdates.get( name )
+        if update:
+            update()
+        value = self.values[ address ] & layout.readMask
+        if name == "sbdata0" and self.get( "sbcs", "sbreadondata" ):
+            self.bus_access( False )
+        self.autoexecute( name )
+        return value
+
+    def write( self, address, value ):
+        """Do a DMI write of value to address."""
+        layout = self.layouts.get( address )
+        if layout is None:
+            return
+        name = layout.register.short
+        if name != "dmcontrol" and not self.get( "dmcontrol", "dmactive" ):
+            return
+        if name in self.abstractRegisters and self.abstract_busy():
+            return
+        self.values[ address ] = layout.write( self.values[ address ], value )
+        handler = self.writeHandlers.get( name )
+        if handler:
+            handler( value )
+        self.autoexecute( name )
+
+    def batch( self, operations, cycles=0 ):
+        """Run operations, a sequence of ( op, address, data ) where op is the
+        value of dmi.op (1 for read, 2 for write, 0 for nop), and return the
+        data read by each of them (0 for writes and nops). Time moves on by
+        cycles after every operation."""
+        result = []
+        read = self.read
+        write = self.write
+        tick = self.tick
+        for op, address, data in operations:
+            if op == 1:
+                result.append( read( address ) )
+            else:
+                if op == 2:
+                    write( address, data )
+                result.append( 0 )
+            if cycles:
+                tick( cycles )
+        return result
+
+    # Abstract commands.
+
+    def abstract_busy( self ):
+        """Return whether an abstract command is still running. If it is,
+        cmderr is set to busy, since the access that asked is an error."""
+        if self.now >= self.commandBusyUntil:
+            return False
+        self.set_cmderr( "busy" )
+        return True
+
+    def set_cmderr( self, name ):
+        if not self.get( "abstractcs", "cmderr" ):
+            self.set( "abstractcs", "cmderr", self.cmderrs[ name ] )
+
+    def autoexecute( self, name ):
+        """Execute command again if name (a data or progbuf register) has its
+        abstractauto bit set."""
+        bit = self.autoexec.get( name )
+        if bit and ( self.get( "abstractauto", bit[0] ) >> bit[1] ) & 1:
+            self.execute_command()
+
+    def argument( self, index ):
+        """Return arg<index> from the data registers."""
+        value = 0
+        for w in range( self.argumentWords ):
+            address = self.addresses[ "data%d" % ( index *
+                self.argumentWords + w ) ]
+            value |= self.values[ address ] << ( 32 * w )
+        return value
+
+    def set_argument( self, index, value ):
+        for w in range( self.argumentWords ):
+            address = self.addresses[ "data%d" % ( index *
+                self.argumentWords + w ) ]
+            self.values[ address ] = ( value >> ( 32 * w ) ) & 0xffffffff
+
+    def execute_command( self ):
+        if self.get( "abstractcs", "cmderr" ):
+            return
+        address = self.addresses[ "command" ]
+        command = self.values[ address ]
+        cmdtype = self.layouts[ address ].get( command, "cmdtype" )
+        try:
+            if cmdtype == CMDTYPES[ "Access Register" ]:
+                self.access_register( command )
+            elif cmdtype == CMDTYPES[ "Access Memory" ] and \
+                    self.config.accessMemory:
+                self.access_memory( command )
+            else:
+                raise CommandError( "not supported" )
+        except CommandError as e:
+            self.set_cmderr( e.args[0] )
+        self.commandBusyUntil = self.now + self.config.commandIdle
+
+    def check_arguments( self, count, bits ):
+        if bits > self.config.xlen or \
+                count * self.argumentWords > self.config.datacount:
+            raise CommandError( "not supported" )
+
+    def access_register( self, command ):
+        layout = self.commands[ "Access Register" ]
+        if layout.get( command, "transfer" ):
+            self.check_arguments( 1, 8 << layout.get( command, "aarsize" ) )
+            if not self.hart.halted:
+                raise CommandError( "halt/resume" )
+            regno = layout.get( command, "regno" )
+            if layout.get( command, "write" ):
+                self.hart.write_register( regno, self.argument( 0 ) )
+            else:
+                self.set_argument( 0, self.hart.read_register( regno ) )
+        if layout.get( command, "aarpostincrement" ):
+            self.values[ self.addresses[ "command" ] ] = layout.set( command,
+                    "regno", layout.get( command, "regno" ) + 1 )
+        if layout.get( command, "postexec" ):
+            if not self.hart.halted:
+                raise CommandError( "halt/resume" )
+            program = [ self.values[ self.addresses[ "progbuf%d" % i ] ]
+                    for i in range( self.config.progbufsize ) ]
+            self.hart.execute( program, self.config.impebreak )
+
+    def access_memory( self, command ):
+        layout = self.commands[ "Access Memory" ]
+        width = 1 << layout.get( command, "aamsize" )
+        self.check_arguments( 2, 8 * width )
+        postincrement = layout.get( command, "aampostincrement" )
+        if postincrement and not self.config.aampostincrement:
+            raise CommandError( "not supported" )
+        address = self.argument( 1 )
+        try:
+            if layout.get( command, "write" ):
+                self.memory.write( address, width, self.argument( 0 ) )
+            else:
+                self.set_argument( 0, self.memory.read( address, width ) )
+        except BusError:
+            raise CommandError( "bus" )
+        if postincrement:
+            self.set_argument( 1, ( address + width ) & self.hart.mask )
+
+    # Registers whose value depends on the state of the hart or the DM.
+
+    def update_dmstatus( self ):
+        halted = int( self.hart.halted )
+        for name, value in ( ( "allhalted", halted ), ( "anyhalted", halted ),
+                ( "allrunning", 1 - halted ), ( "anyrunning", 1 - halted ),
+                ( "allresumeack", int( self.hart.resumeack ) ),
+                ( "anyresumeack", int( self.hart.resumeack ) ) ):
+            self.set( "dmstatus", name, value )
+
+    def update_haltsum0( self ):
+        self.values[ self.addresses[ "haltsum0" ] ] = int( self.hart.halted )
+
+    def update_abstractcs( self ):
+        self.set( "abstractcs", "busy",
+                int( self.now < self.commandBusyUntil ) )
+
+    def update_sbcs( self ):
+        self.set( "sbcs", "sbbusy", int( self.now < self.busBusyUntil ) )
+
+    def write_dmcontrol( self, value ):
+        layout = self.layouts[ self.addresses[ "dmcontrol" ] ]
+        if not layout.get( value, "dmactive" ):
+            self.reset()
+            return
+        # There is only one hart, no hart array and no hart reset.
+        for name in ( "hartsello", "hartselhi", "hasel", "hartreset" ):
+            self.set( "dmcontrol", name, 0 )
+        if layout.get( value, "haltreq" ):
+            self.hart.halted = True
+            self.hart.resumeack = False
+        elif layout.get( value, "resumereq" ):
+            self.hart.halted = False
+            self.hart.resumeack = True
+
+    def write_abstractauto( self, value ):
+        config = self.config
+        if not config.autoexec:
+            self.values[ self.addresses[ "abstractauto" ] ] = 0
+            return
+        self.set( "abstractauto", "autoexecdata",
+                self.get( "abstractauto", "autoexecdata" ) &
+                ( ( 1 << config.datacount ) - 1 ) )
+        self.set( "abstractauto", "autoexecprogbuf",
+                self.get( "abstractauto", "autoexecprogbuf" ) &
+                ( ( 1 << config.progbufsize ) - 1 ) )
+
+    # System Bus Access.
+
+    def write_sbcs( self, value ):
+        if not self.config.sbautoincrement:
+            self.set( "sbcs", "sbautoincrement", 0 )
+
+    def write_sbaddress0( self, value ):
+        if self.get( "sbcs", "sbreadonaddr" ):
+            self.bus_access( False )
+
+    def bus_words( self, prefix, bits ):
+        return [ self.addresses[ "%s%d" % ( prefix, w ) ]
+                for w in range( max( 1, ( bits + 31 ) // 32 ) ) ]
+
+    def bus_access( self, write ):
+        if not self.config.sbasize:
+            return
+        if self.now < self.busBusyUntil:
+            self.set( "sbcs", "sbbusyerror", 1 )
+            return
+        if self.get( "sbcs", "sberror" ) or self.get( "sbcs", "sbbusyerror" ):
+            return
+        width = 1 << self.get( "sbcs", "sbaccess" )
+        addresses = self.bus_words( "sbaddress", self.config.sbasize )
+        address = 0
+        for w, a in enumerate( addresses ):
+            address |= self.values[ a ] << ( 32 * w )
+        data = self.bus_words( "sbdata", 8 * width )
+        try:
+            if not 8 * width in self.config.sbaccess:
+                raise BusError( "size" )
+            if write:
+                value = 0
+                for w, a in enumerate( data ):
+                    value |= self.values[ a ] << ( 32 * w )
+                self.memory.write( address, width, value )
+            else:
+                value = self.memory.read( address, width )
+                for w, a in enumerate( data ):
+                    self.values[ a ] = ( value >> ( 32 * w ) ) & 0xffffffff
+        except BusError as e:
+            self.set( "sbcs", "sberror", self.sberrors[ e.args[0] ] )
+            return
+        if self.get( "sbcs", "sbautoincrement" ):
+            address += width
+            for w, a in enumerate( addresses ):
+                self.values[ a ] = ( address >> ( 32 * w ) ) & 0xffffffff
+        self.busBusyUntil = self.now + self.config.busIdle
+
+# The JTAG TAP state machine: the next state for TMS=0 and for TMS=1.
+TAP_STATES = {
+    "Test-Logic-Reset": ( "Run-Test/Idle", "Test-Logic-Reset" ),
+    "Run-Test/Idle": ( "Run-Test/Idle", "Select-DR-Scan" ),
+    "Select-DR-Scan": ( "Capture-DR", "Select-IR-Scan" ),
+    "Capture-DR": ( "Shift-DR", "Exit1-DR" ),
+    "Shift-DR": ( "Shift-DR", "Exit1-DR" ),
+    "Exit1-DR": ( "Pause-DR", "Update-DR" ),
+    "Pause-DR": ( "Pause-DR", "Exit2-DR" ),
+    "Exit2-DR": ( "Shift-DR", "Update-DR" ),
+    "Update-DR": ( "Run-Test/Idle", "Select-DR-Scan" ),
+    "Select-IR-Scan": ( "Capture-IR", "Test-Logic-Reset" ),
+    "Capture-IR": ( "Shift-IR", "Exit1-IR" ),
+    "Shift-IR": ( "Shift-IR", "Exit1-IR" ),
+    "Exit1-IR": ( "Pause-IR", "Update-IR" ),
+    "Pause-IR": ( "Pause-IR", "Exit2-IR" ),
+    "Exit2-IR": ( "Shift-IR", "Update-IR" ),
+    "Update-IR": ( "Run-Test/Idle", "Select-DR-Scan" )
+}
+
+class Dtm( object ):
+    """A JTAG DTM in front of a DebugModule, with the instructions and DR
+    layouts in jtag_registers.xml. Every DMI operation keeps the DMI busy for
+    dmiCycles TCK cycles."""
+    def __init__( self, module, jtag, config, idcode=1, dmiCycles=0 ):
+        self.module = module
+        self.idcode = idcode
+        self.dmiCycles = dmiCycles
+        values = presets( config )
+        self.dtmcs = Layout( find_register( jtag, "dtmcs" ), values )
+        self.dmi = Layout( find_register( jtag, "dmi" ).instantiate(
+            { "abits": config.abits } ), values )
+        self.ops = value_codes( self.dmi.register, "op" )
+        self.statuses = dict( ( v.name, int( v.value, 0 ) )
+                for f in self.dmi.register.fields if f.name == "op"
+                for v in f.values if v.duplicate )
+        self.irLength = max( int( r.address, 0 ) for r in jtag.registers
+                ).bit_length()
+        self.instructions = dict( ( int( r.address, 0 ), r.short or r.name )
+                for r in jtag.registers )
+        self.widths = {
+            "IDCODE": 32,
+            "dtmcs": max( f.highBitValue for f in self.dtmcs.register.fields
+                ) + 1,
+            "dmi": max( f.highBitValue for f in self.dmi.register.fields ) + 1
+        }
+        self.instruction = dict( ( name, address ) for address, name in
+                self.instructions.items() )
+        self.reset()
+        self.cycles = 0
+        self.statistics = dict( scans=0, reads=0, writes=0, busy=0 )
+
+    def reset( self ):
+        self.state = "Test-Logic-Reset"
+        self.ir = self.instruction[ "IDCODE" ]
+        self.shift = 0
+        self.length = 0
+        self.sticky = 0
+        self.busyUntil = 0
+        self.result = 0
+        self.lastAddress = 0
+
+    def selected( self ):
+        return self.instructions.get( self.ir, "BYPASS" )
+
+    def tdo( self ):
+        return self.shift & 1
+
+    def capture_dr( self ):
+        name = self.selected()
+        self.length = self.widths.get( name, 1 )
+        if name == "IDCODE":
+            self.shift = self.idcode
+        elif name == "dtmcs":
+            self.shift = self.dtmcs.set( self.dtmcs.reset, "dmistat",
+                    self.sticky )
+        elif name == "dmi":
+            self.statistics[ "scans" ] += 1
+            if self.cycles < self.busyUntil and not self.sticky:
+                self.sticky = self.statuses[ "busy" ]
+                self.statistics[ "busy" ] += 1
+            value = self.dmi.set( 0, "address", self.lastAddress )
+            value = self.dmi.set( value, "data", self.result )
+            self.shift = self.dmi.set( value, "op", self.sticky )
+        else:
+            self.shift = 0
+
+    def update_dr( self ):
+        name = self.selected()
+        if name == "dtmcs":
+            if self.dtmcs.get( self.shift, "dmireset" ):
+                self.sticky = 0
+            if self.dtmcs.get( self.shift, "dmihardreset" ):
+                self.sticky = 0
+                self.busyUntil = 0
+        elif name == "dmi" and not self.sticky:
+            op = self.dmi.get( self.shift, "op" )
+            address = self.dmi.get( self.shift, "address" )
+            if op == self.ops[ "read" ]:
+                self.result = self.module.read( address )
+                self.statistics[ "reads" ] += 1
+            elif op == self.ops[ "write" ]:
+                self.module.write( address,
+                        self.dmi.get( self.shift, "data" ) )
+                self.result = 0
+                self.statistics[ "writes" ] += 1
+            else:
+                return
+            self.lastAddress = address
+            self.busyUntil = self.cycles + self.dmiCycles
+
+    def clock( self, tms, tdi ):
+        """Handle a rising edge of TCK."""
+        state = self.state
+        if state == "Capture-DR":
+            self.capture_dr()
+        elif state == "Capture-IR":
+            # The two least significant bits must be 01.
+            self.shift = 1
+            self.length = self.irLength
+        elif state in ( "Shift-DR", "Shift-IR" ):
+            self.shift = ( self.shift >> 1 ) | ( tdi << ( self.length - 1 ) )
+        self.state = TAP_STATES[ state ][ tms ]
+        if self.state == "Update-DR":
+            self.update_dr()
+        elif self.state == "Update-IR":
+            self.ir = self.shift
+        elif self.state == "Test-Logic-Reset":
+            self.ir = self.instruction[ "IDCODE" ]
+        self.cycles += 1
+        self.module.tick( 1 )
+
+def serve_connection( dtm, connection ):
+    """Handle remote_bitbang commands from connection until it closes or
+    sends Q."""
+    tck = 0
+    while True:
+        data = connection.recv( 65536 )
+        if not data:
+            return
+        output = bytearray()
+        for c in data:
+            if 0x30 <= c <= 0x37:
+                # '0' + ( tck << 2 | tms << 1 | tdi )
+                bits = c - 0x30
+                if bits & 4 and not tck:
+                    dtm.clock( ( bits >> 1 ) & 1, bits & 1 )
+                tck = bits & 4
+            elif c == 0x52:
+                # 'R': read TDO.
+                output.append( 0x30 + dtm.tdo() )
+            elif 0x72 <= c <= 0x75:
+                # 'r' to 'u': set TRST and SRST. Only TRST matters here.
+                if ( c - 0x72 ) & 2:
+                    dtm.reset()
+            elif c == 0x51:
+                # 'Q': quit.
+                if output:
+                    connection.sendall( output )
+                return
+            # 'B' and 'b' (blink) and anything else are ignored.
+        if output:
+            connection.sendall( output )
+
+def serve( dtm, host, port ):
+    """Accept remote_bitbang connections on host:port, one at a time, and
+    report how much DMI traffic each one caused."""
+    listener = socket.create_server( ( host, port ) )
+    sys.stderr.write( "Listening for remote_bitbang on %s:%d\n" % ( host,
+        port ) )
+    while True:
+        connection, peer = listener.accept()
+        start = time.perf_counter()
+        cycles = dtm.cycles
+        statistics = dict( dtm.statistics )
+        with connection:
+            serve_connection( dtm, connection )
+        seconds = time.perf_counter() - start
+        delta = dict( ( name, dtm.statistics[ name ] - statistics[ name ] )
+                for name in statistics )
+        sys.stderr.write( "%s: %d DMI scans (%d reads, %d writes, %d busy), "
+                "%d TCK cycles in %.3f s\n" % ( peer[0], delta[ "scans" ],
+                    delta[ "reads" ], delta[ "writes" ], delta[ "busy" ],
+                    dtm.cycles - cycles, seconds ) )
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( '--host', default='localhost',
+            help='Address to listen on.' )
+    parser.add_argument( '--port', type=int, default=9824,
+            help='TCP port to listen on for remote_bitbang connections.' )
+    parser.add_argument( '--memory-base', type=lambda x: int( x, 0 ),
+            default=0x80000000, help='Address of the RAM.' )
+    parser.add_argument( '--memory-size', type=lambda x: int( x, 0 ),
+            default=1 << 20, help='Size of the RAM in bytes.' )
+    parser.add_argument( '--dmi-cycles', type=int, default=0,
+            help='TCK cycles every DMI operation takes. Scans before that '
+            'see busy.' )
+    parser.add_argument( '--idcode', type=lambda x: int( x, 0 ), default=1 )
+    add_config_arguments( parser )
+    parsed = parser.parse_args()
+
+    config = config_from_arguments( parsed )
+    dm, commands, jtag = read_xml( parsed )
+    module = DebugModule( dm, commands, config, parsed.memory_base,
+            parsed.memory_size )
+    dtm = Dtm( module, jtag, config, parsed.idcode, parsed.dmi_cycles )
+    try:
+        serve( dtm, parsed.host, parsed.port )
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    sys.exit( main() )
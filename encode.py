@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""Encode arrays of field values into raw register values: abstract commands
+(Access Register, Quick Access, Access Memory) from xml/abstract_commands.xml,
+dmi scans from xml/jtag_registers.xml, or any other register in xml/. This is
+the reverse of decode.py. Whole arrays are encoded at once with NumPy, every
+field is range checked in one operation, and the result can be packed into a
+single buffer that is ready to be shifted out by a JTAG adapter."""
+
+import sys
+import argparse
+import numpy
+
+from registers import read_registers, symbol_values
+from decode import unsigned_type, find_register
+from scancost import CMDTYPES
+
+class EncodedField( object ):
+    def __init__( self, field, offset, length ):
+        self.name = field.name
+        self.offset = offset
+        self.length = length
+        self.maximum = ( 1 << length ) - 1
+        self.names = dict( ( v.name, int( v.value, 0 ) ) for v in field.values
+                if not v.range and not v.duplicate )
+
+    def values( self, column ):
+        """Return column (anything numpy.asarray() accepts) as uint64, with
+        the names of enumerated values replaced by their values. Raise
+        ValueError if any of them doesn't fit in the field."""
+        column = numpy.asarray( column )
+        if column.dtype.kind in "US":
+            names, inverse = numpy.unique( column, return_inverse=True )
+            unknown = [ n for n in names.tolist() if n not in self.names ]
+            if unknown:
+                raise ValueError( "%s has no value called %s" % ( self.name,
+                    ", ".join( repr( n ) for n in unknown ) ) )
+            codes = numpy.array( [ self.names[ n ] for n in names.tolist() ],
+                    dtype=numpy.uint64 )
+            return codes[ inverse ].reshape( column.shape )
+        if column.dtype.kind == "i":
+            negative = numpy.flatnonzero( column < 0 )
+            if len( negative ):
+                raise ValueError( "%d values of %s are negative (the first is "
+                        "at index %d)" % ( len( negative ), self.name,
+                            negative[0] ) )
+        elif column.dtype.kind not in "ub":
+            raise ValueError( "%s must be integers, not %s" % ( self.name,
+                column.dtype ) )
+        column = column.astype( numpy.uint64 )
+        large = numpy.flatnonzero( column > numpy.uint64( self.maximum ) )
+        if len( large ):
+            raise ValueError( "%d values of %s don't fit in %d bits (the "
+                    "first is %d at index %d)" % ( len( large ), self.name,
+                        self.length, column.flat[ large[0] ], large[0] ) )
+        return column
+
+class Encoder( object ):
+    """Encodes arrays of field values into raw values of one register.
+    Symbolic bit positions are resolved for the given xlen and abits (see
+    Register.instantiate()). defaults gives the value of fields that aren't
+    passed to encode(), which are 0 otherwise."""
+    def __init__( self, register, xlen=None, abits=None, defaults=None ):
+        values = {}
+        if xlen:
+            values.update( symbol_values( xlen ) )
+        if abits is not None:
+            values[ "abits" ] = abits
+        if values:
+            register = register.instantiate( values )
+        self.register = register
+        self.fields = {}
+        width = 0
+        for f in register.fields:
+            high = f.highBitValue
+            low = f.lowBitValue
+            if high is None or low is None:
+                raise ValueError( "%s in %s has symbolic bits %s:%s; specify "
+                        "an XLEN" % ( f, register, f.highBit, f.lowBit ) )
+            width = max( width, high + 1 )
+            if f.name != "0" and high >= low:
+                self.fields[ f.name ] = EncodedField( f, low, high + 1 - low )
+        self.width = width
+        self.type = unsigned_type( width )
+        self.bytes = ( width + 7 ) // 8
+        self.defaults = defaults or {}
+
+    def encode( self, columns=None, **fields ):
+        """Return an array of raw register values. Each field is given as an
+        array (or a single value, which is used for every element) of
+        integers or value names, either in columns (a dictionary, or a
+        structured array like Decoder.decode() returns) or as a keyword
+        argument. Field names that aren't identifiers (like target-specific)
+        can be passed with _ in place of -."""
+        given = dict( self.defaults )
+        if columns is not None:
+            names = getattr( columns.dtype, "names", None ) \
+                    if hasattr( columns, "dtype" ) else list( columns )
+            for name in names:
+                if name.endswith( "_name" ) and not name in self.fields:
+                    # Added by Decoder.decode( names=True ).
+                    continue
+                given[ name ] = columns[ name ]
+        for name, column in fields.items():
+            if not name in self.fields:
+                name = name.replace( "_", "-" )
+            given[ name ] = column
+
+        unknown = [ name for name in given if not name in self.fields ]
+        if unknown:
+            raise ValueError( "%s has no field %s" % ( self.register,
+                ", ".join( unknown ) ) )
+        values = [ ( self.fields[ name ],
+            self.fields[ name ].values( column ) )
+            for name, column in given.items() ]
+        shape = numpy.broadcast_shapes( *[ v.shape for f, v in values ] ) \
+                if values else ()
+        result = numpy.zeros( shape, dtype=self.type )
+        for field, value in values:
+            result |= ( value << numpy.uint64( field.offset ) ).astype(
+                    self.type )
+        return result
+
+    def pack( self, raw ):
+        """Return raw (as returned by encode()) as a single bytes object, with
+        every value as self.bytes little-endian bytes. That is the order in
+        which the bits are shifted into a JTAG data register."""
+        raw = numpy.ascontiguousarray( raw, dtype=numpy.dtype(
+            self.type ).newbyteorder( "<" ) ).reshape( -1 )
+        return raw.view( numpy.uint8 ).reshape( len( raw ), -1 )[
+                :, :self.bytes ].tobytes()
+
+def command_encoder( commands, name, xlen=None ):
+    """Return an Encoder for the abstract command called name in commands (the
+    Registers in abstract_commands.xml), with cmdtype filled in."""
+    return Encoder( find_register( commands, name ), xlen,
+            defaults={ "cmdtype": CMDTYPES[ name ] } )
+
+def dmi_encoder( jtag, abits ):
+    """Return an Encoder for scans of dmi (in jtag_registers.xml) when the DM
+    has abits address bits."""
+    return Encoder( find_register( jtag, "dmi" ), abits=abits )
+
+def read_columns( path ):
+    """Read a text file with a header line of field names, and a row of
+    whitespace-separated values per register value, like decode.py prints.
+    Values are integers (decimal, or hex with 0x) or value names. Return a
+    dictionary mapping field name to an array of values."""
+    with open( path ) as fd:
+        lines = [ line.split() for line in fd if line.strip() ]
+    header = lines[0]
+    columns = dict( ( name, [] ) for name in header )
+    for row in lines[1:]:
+        assert len( row ) == len( header ), \
+                "%s: expected %d values, got %r" % ( path, len( header ), row )
+        for name, text in zip( header, row ):
+            columns[ name ].append( text )
+    result = {}
+    for name, texts in columns.items():
+        try:
+            result[ name ] = numpy.array( [ int( t, 0 ) for t in texts ],
+                    dtype=numpy.int64 )
+        except ValueError:
+            result[ name ] = numpy.array( texts )
+    return result
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'xml', help='XML register file (or compiled model).' )
+    parser.add_argument( 'register', help='Name of the register (or abstract '
+            'command) to encode.' )
+    parser.add_argument( 'input', help='File with a header line of field '
+            'names, and a line of values per register value.' )
+    parser.add_argument( '--format', choices=( 'hex', 'bin' ), default='hex',
+            help='Write one hex value per line, or the packed bytes.' )
+    parser.add_argument( '--output', '-o',
+            help='Write to the named file instead of stdout.' )
+    parser.add_argument( '--xlen', type=int,
+            help='XLEN used to resolve symbolic bit positions.' )
+    parser.add_argument( '--abits', type=int,
+            help='Number of DM address bits, for dmi.' )
+    parsed = parser.parse_args()
+
+    registers = read_registers( parsed.xml )
+    register = find_register( registers, parsed.register )
+    defaults = None
+    if register.name in CMDTYPES:
+        defaults = { "cmdtype": CMDTYPES[ register.name ] }
+    encoder = Encoder( register, parsed.xlen, parsed.abits, defaults )
+    raw = encoder.encode( read_columns( parsed.input ) )
+
+    if parsed.format == "bin":
+        data = encoder.pack( raw )
+    else:
+        digits = ( encoder.width + 3 ) // 4
+        data = "".join( "%0*x\n" % ( digits, value )
+                for value in raw.tolist() ).encode()
+    if parsed.output:
+        with open( parsed.output, "wb" ) as fd:
+            fd.write( data )
+    else:
+        sys.stdout.buffer.write( data )
+
+if __name__ == "__main__":
+    sys.exit( main() )
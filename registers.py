@@ -1,16 +1,94 @@
 #!/usr/bin/env python3
 
+import time
+startTime = time.perf_counter()
+
 import sys
+import os
+import io
+import contextlib
+import hashlib
+import json
 import xml.etree.ElementTree
 import argparse
-import sympy
-from sympy.functions.elementary.miscellaneous import Max
 import math
 import re
 import collections
-from functools import cmp_to_key
+import bisect
+import itertools
+from functools import cmp_to_key, lru_cache
+
+# sympy is by far the most expensive thing to import, and most register files
+# never need it. It is imported by import_sympy() the first time a symbolic
+# expression has to be handled.
+sympy = None
+sympyImportTime = None
+
+def import_sympy():
+    global sympy, sympyImportTime
+    if sympy is None:
+        start = time.perf_counter()
+        import sympy as module
+        sympy = module
+        sympyImportTime = time.perf_counter() - start
+    return sympy
+
+# Profiling. Every object in profileHooks is told when a stage (parse_xml, each
+# output), a register within a stage, and every call to simplify() begins and
+# ends. When there are no hooks this costs next to nothing.
+profileHooks = []
+
+class ProfileHook( object ):
+    """Base class for objects in profileHooks."""
+    def begin( self, name, category ):
+        """Called when a span (category "stage" or "register") starts."""
+        pass
+
+    def end( self, name, category ):
+        """Called when the most recently begun span ends."""
+        pass
+
+    def simplified( self, caller, expression, seconds, cached ):
+        """Called after simplify( expression ) was called from caller (a
+        function name), which took seconds. cached is set if the result came
+        from the cache instead of sympy."""
+        pass
+
+class ProfileSpan( object ):
+    def __init__( self, name, category ):
+        self.name = name
+        self.category = category
+
+    def __enter__( self ):
+        for hook in profileHooks:
+            hook.begin( self.name, self.category )
+        return self
+
+    def __exit__( self, *exception ):
+        for hook in reversed( profileHooks ):
+            hook.end( self.name, self.category )
+        return False
+
+noSpan = contextlib.nullcontext()
+
+def profile_span( name, category="stage" ):
+    """Return a context manager that reports a span to profileHooks."""
+    if not profileHooks:
+        return noSpan
+    return ProfileSpan( name, category )
+
+def intern( text ):
+    """Return sys.intern( text ), or None if text is None. Names, bit
+    positions, access types and reset values repeat a lot, so all the fields
+    of a big register file share a handful of strings."""
+    if text is None:
+        return None
+    return sys.intern( text )
 
 class Registers( object ):
+    __slots__ = ( "name", "label", "prefix", "description", "skip_index",
+            "skip_access", "skip_reset", "depth", "registers", "identifiers" )
+
     def __init__( self, name, label, prefix, description, skip_index,
             skip_access, skip_reset, depth ):
         self.name = name
@@ -22,23 +100,264 @@ class Registers( object ):
         self.skip_reset = skip_reset
         self.depth = depth
         self.registers = []
+        self.identifiers = Identifiers( self.prefix )
 
     def add_register( self, register ):
         self.registers.append( register )
 
-def sympy_compare_lowBit( a, b ):
-    if sympy.simplify("(%s) > (%s)" % ( a.lowBit, b.lowBit )) == True:
+    def instantiate( self, values ):
+        """Return a copy of these registers with every bit position evaluated
+        with values (e.g. symbol_values( 64 )), so no backend needs to do
+        any symbolic math (see Register.instantiate())."""
+        result = Registers( self.name, self.label, self.prefix,
+                self.description, self.skip_index, self.skip_access,
+                self.skip_reset, self.depth )
+        for r in self.registers:
+            result.add_register( r.instantiate( values ) )
+        return result
+
+@lru_cache( maxsize=None )
+def cached_simplify( expression ):
+    """Return sympy.simplify( expression ).
+
+    The same handful of bit expressions (XLEN-1, DXLEN-1, small integers) show
+    up over and over again, so every distinct expression (string or sympy
+    object) is only simplified once per process."""
+    return import_sympy().simplify( expression )
+
+# Functions that only pass expressions on to simplify(). Calls are attributed to
+# whoever called these.
+SIMPLIFY_HELPERS = frozenset(( "bit_expression", "bit_difference",
+    "compare_bits" ))
+
+def simplify( expression ):
+    if not profileHooks:
+        return cached_simplify( expression )
+    frame = sys._getframe( 1 )
+    while frame.f_back and frame.f_code.co_name in SIMPLIFY_HELPERS:
+        frame = frame.f_back
+    caller = getattr( frame.f_code, "co_qualname", frame.f_code.co_name )
+    misses = cached_simplify.cache_info().misses
+    start = time.perf_counter()
+    result = cached_simplify( expression )
+    seconds = time.perf_counter() - start
+    cached = cached_simplify.cache_info().misses == misses
+    for hook in profileHooks:
+        hook.simplified( caller, expression, seconds, cached )
+    return result
+
+# Symbols that Linear knows about. Expressions using anything else are left to
+# sympy.
+LINEAR_SYMBOLS = ( "XLEN", "DXLEN", "abits" )
+
+class Linear( object ):
+    """coefficient * symbol + constant, for at most one symbol.
+
+    Nearly every bit position in the XML is either a plain integer or something
+    like XLEN-4, and doing arithmetic on those natively is much faster than
+    going through sympy. Results that can't be represented (e.g. XLEN-DXLEN)
+    are returned as sympy expressions instead."""
+    __slots__ = ( "constant", "coefficient", "symbol" )
+
+    def __init__( self, constant, coefficient=0, symbol=None ):
+        if not coefficient:
+            symbol = None
+        self.constant = constant
+        self.coefficient = coefficient if symbol else 0
+        self.symbol = symbol
+
+    def is_constant( self ):
+        return self.symbol is None
+
+    def atoms( self ):
+        if self.symbol:
+            return { self.symbol }
+        return set()
+
+    def to_sympy( self ):
+        import_sympy()
+        result = sympy.Integer( self.constant )
+        if self.symbol:
+            result += self.coefficient * sympy.Symbol( self.symbol )
+        return result
+
+    def _combine( self, other, sign ):
+        if isinstance( other, int ):
+            other = Linear( other )
+        if not isinstance( other, Linear ):
+            return self.to_sympy() + sign * other
+        if self.symbol and other.symbol and self.symbol != other.symbol:
+            return self.to_sympy() + sign * other.to_sympy()
+        return Linear( self.constant + sign * other.constant,
+                self.coefficient + sign * other.coefficient,
+                self.symbol or other.symbol )
+
+    def __add__( self, other ):
+        return self._combine( other, 1 )
+
+    def __sub__( self, other ):
+        return self._combine( other, -1 )
+
+    def __radd__( self, other ):
+        return self + other
+
+    def __rsub__( self, other ):
+        return -self + other
+
+    def __neg__( self ):
+        return Linear( -self.constant, -self.coefficient, self.symbol )
+
+    def __int__( self ):
+        if self.symbol:
+            raise TypeError( "Cannot convert %s to int" % self )
+        return self.constant
+
+    __index__ = __int__
+
+    def __eq__( self, other ):
+        if isinstance( other, int ):
+            other = Linear( other )
+        if not isinstance( other, Linear ):
+            return NotImplemented
+        return ( self.constant, self.coefficient, self.symbol ) == \
+                ( other.constant, other.coefficient, other.symbol )
+
+    def __hash__( self ):
+        if self.symbol:
+            return hash(( self.constant, self.coefficient, self.symbol ))
+        return hash( self.constant )
+
+    def __str__( self ):
+        """Format the expression the same way sympy would."""
+        if not self.symbol:
+            return str( self.constant )
+        if self.coefficient == 1:
+            term = self.symbol
+        elif self.coefficient == -1:
+            term = "-" + self.symbol
+        else:
+            term = "%d*%s" % ( self.coefficient, self.symbol )
+        if self.constant == 0:
+            return term
+        if self.coefficient < 0 and self.constant > 0:
+            return "%d - %s" % ( self.constant, term[1:] )
+        if self.constant > 0:
+            return "%s + %d" % ( term, self.constant )
+        return "%s - %d" % ( term, -self.constant )
+
+    def __repr__( self ):
+        return "Linear(%s)" % self
+
+linearTerm = re.compile( r"\s*([+-])\s*(?:(\d+)\s*\*\s*)?(\d+|[A-Za-z_]\w*)\s*" )
+
+def parse_linear( text ):
+    """Return text as a Linear, or None if it isn't a simple affine expression
+    in one of LINEAR_SYMBOLS."""
+    text = text.strip()
+    if not text.startswith( ( "+", "-" ) ):
+        text = "+" + text
+    result = Linear( 0 )
+    position = 0
+    while position < len( text ):
+        match = linearTerm.match( text, position )
+        if not match:
+            return None
+        sign, factor, atom = match.groups()
+        if atom.isdigit():
+            if factor:
+                term = Linear( int( factor ) * int( atom ) )
+            else:
+                term = Linear( int( atom ) )
+        elif atom in LINEAR_SYMBOLS:
+            term = Linear( 0, int( factor or 1 ), atom )
+        else:
+            return None
+        if sign == "-":
+            result = result - term
+        else:
+            result = result + term
+        if not isinstance( result, Linear ):
+            return None
+        position = match.end()
+    return result
+
+@lru_cache( maxsize=None )
+def bit_expression( text ):
+    """Return the expression for a bit position (or similar text), as a Linear
+    if possible and as a sympy expression otherwise."""
+    result = parse_linear( text )
+    if result is None:
+        result = simplify( text )
+    return result
+
+def to_sympy( expression ):
+    if isinstance( expression, Linear ):
+        return expression.to_sympy()
+    return expression
+
+@lru_cache( maxsize=None )
+def bit_difference( a, b ):
+    """Return a - b, where a and b are bit position strings."""
+    x = bit_expression( a )
+    y = bit_expression( b )
+    if isinstance( x, Linear ) and isinstance( y, Linear ):
+        delta = x - y
+        if isinstance( delta, Linear ):
+            return delta
+    return simplify( "(%s) - (%s)" % ( a, b ) )
+
+@lru_cache( maxsize=None )
+def compare_bits( a, b ):
+    delta = bit_difference( a, b )
+    if isinstance( delta, Linear ):
+        if delta.is_constant():
+            return ( delta.constant > 0 ) - ( delta.constant < 0 )
+        return 0
+    if simplify( "(%s) > (%s)" % ( a, b ) ) == True:
         return 1
-    if sympy.simplify("(%s) < (%s)" % ( a.lowBit, b.lowBit )) == True:
+    if simplify( "(%s) < (%s)" % ( a, b ) ) == True:
         return -1
     return 0
 
+def sympy_compare_lowBit( a, b ):
+    return compare_bits( a.lowBit, b.lowBit )
+
+# Symbolic bit positions are checked by instantiating them at each of these.
+XLENS = ( 32, 64, 128 )
+
+def symbol_values( xlen ):
+    """Return the value of every symbol in LINEAR_SYMBOLS for the given XLEN."""
+    return { "XLEN": xlen, "DXLEN": xlen, "abits": 7 }
+
+def evaluate( expression, values ):
+    """Return expression as an int, with values (a dictionary) substituted for
+    its symbols. Return None if that doesn't result in a number."""
+    if isinstance( expression, Linear ):
+        if expression.is_constant():
+            return expression.constant
+        if expression.symbol in values:
+            return expression.constant + \
+                    expression.coefficient * values[ expression.symbol ]
+        return None
+    try:
+        return int( expression.subs( values ) )
+    except ( TypeError, AttributeError ):
+        return None
+
+def bit_range( high, low ):
+    if high == low:
+        return "bit %d" % high
+    return "bits %d:%d" % ( high, low )
+
 class Register( object ):
+    __slots__ = ( "name", "short", "description", "address", "sdesc",
+            "define", "fields", "label" )
+
     def __init__( self, name, short, description, address, sdesc, define ):
         self.name = name
-        self.short = short
+        self.short = intern( short )
         self.description = description
-        self.address = address
+        self.address = intern( address )
         self.sdesc = sdesc
         self.define = define
         self.fields = []
@@ -46,33 +365,161 @@ class Register( object ):
         self.label = ( short or name ).lower() # TODO: replace spaces etc.
 
     def add_field( self, field ):
+        """Add field. sort_fields() must be called once all fields have been
+        added."""
         self.fields.append( field )
-        self.fields.sort( key=cmp_to_key(sympy_compare_lowBit), reverse=True )
+
+    def sort_fields( self ):
+        """Sort the fields from the highest bits to the lowest. Fields whose
+        relative order can't be determined keep the order they were added
+        in."""
+        values = symbol_values( max( XLENS ) )
+        lowBits = [ f.lowBitValue if f.lowBitValue is not None else
+                evaluate( bit_expression( f.lowBit ), values )
+                for f in self.fields ]
+        if None in lowBits:
+            self.fields.sort( key=cmp_to_key(sympy_compare_lowBit), reverse=True )
+        else:
+            order = dict( zip( map( id, self.fields ), lowBits ) )
+            self.fields.sort( key=lambda f: order[ id( f ) ], reverse=True )
+
+    def symbolic( self ):
+        return any( f.lowBitValue is None or f.highBitValue is None
+                for f in self.fields )
+
+    def evaluated_layout( self, values ):
+        """Return [ ( field, high bit, low bit ) ] from high to low, with every
+        bit position evaluated with values, or None if some symbol in them has
+        no value. Fields that can't exist with these values are left out: a
+        field that would be less than 0 bits wide (like the reserved field
+        between maskmax and sizehi in mcontrol at XLEN=32) is squeezed out by
+        the fields above it, and so are the fields below it that lie entirely
+        within the bits of the fields above (sizehi). Fields that end up
+        exactly 0 bits wide are kept."""
+        layout = []
+        bottom = None
+        for f in self.fields:
+            high = evaluate( bit_expression( f.highBit ), values )
+            low = evaluate( bit_expression( f.lowBit ), values )
+            if high is None or low is None:
+                return None
+            if high < low - 1:
+                if layout:
+                    bottom = layout[ -1 ][ 2 ]
+                continue
+            if not bottom is None and low >= bottom:
+                continue
+            layout.append(( f, high, low ))
+        return layout
+
+    def instantiate( self, values ):
+        """Return a copy of this register with every bit position evaluated
+        with values. Fields that can't exist with these values (see
+        evaluated_layout()) or that end up 0 bits wide are left out. Raise an
+        AssertionError naming the fields if the rest don't fit together."""
+        if not self.symbolic():
+            return self
+        layout = self.evaluated_layout( values )
+        assert not layout is None, "%s: can't evaluate its bits with %s" % (
+                self, values )
+        problems = []
+        self.check_layout( layout, " with %s" % ", ".join( "%s=%s" % item
+            for item in sorted( values.items() ) ), problems )
+        assert not problems, "\n".join( problems )
+        register = Register( self.name, self.short, self.description,
+                self.address, self.sdesc, self.define )
+        register.fields = [ f.with_bits( high, low )
+                for f, high, low in layout if high >= low ]
+        return register
 
     def check( self ):
+        """Raise an AssertionError listing every problem found by
+        layout_problems()."""
+        problems = self.layout_problems()
+        assert not problems, "\n".join( problems )
+
+    def layout_problems( self ):
+        """Check that the (sorted) fields cover every bit from the top one down
+        to 0, without overlapping. Symbolic bit positions are checked by
+        instantiating them at each of XLENS. Return a list of all the problems
+        that were found."""
+        problems = []
+        if not self.symbolic():
+            self.check_layout( [ ( f, f.highBitValue, f.lowBitValue )
+                for f in self.fields ], "", problems )
+            return problems
+
+        instances = [ ( " at XLEN=%d" % xlen, symbol_values( xlen ) )
+                for xlen in XLENS ]
+
+        for where, values in instances:
+            layout = self.evaluated_layout( values )
+            if layout is None:
+                # Some symbol we don't have a value for.
+                self.check_symbolic( problems )
+                break
+            self.check_layout( layout, where, problems )
+        return problems
+
+    def check_layout( self, layout, where, problems ):
+        """Append to problems a description of each gap, overlap and
+        out-of-range field in layout, which is a list of ( field, high bit, low
+        bit ) sorted from high to low."""
+        previous = None
+        for f, high, low in layout:
+            empty = where and high == low - 1
+            if low < 0 or ( high < low and not empty ):
+                problems.append( "%s: %s has out of range bits %d:%d%s" % (
+                    self, f, high, low, where ) )
+            if empty:
+                continue
+            if not previous is None:
+                p, pLow = previous
+                if high >= pLow:
+                    problems.append( "%s: %s (bits %d:%d) overlaps %s%s" % (
+                        self, f, high, low, p, where ) )
+                elif high < pLow - 1:
+                    problems.append( "%s: nothing defines %s between %s and "
+                            "%s%s" % ( self, bit_range( pLow - 1, high + 1 ),
+                                p, f, where ) )
+            previous = f, low
+        if previous and previous[1] > 0:
+            problems.append( "%s: nothing defines %s below %s%s" % (
+                self, bit_range( previous[1] - 1, 0 ), previous[0], where ) )
+
+    def check_symbolic( self, problems ):
+        """Check the fields without knowing the value of every symbol, using
+        sympy. Only problems that hold for every value are found."""
         previous = None
         for f in self.fields:
             if not previous is None:
-                expression = "(%s) > (%s)" % ( previous, f.highBit )
-                result = sympy.simplify( expression )
-                if type( result ) == bool:
-                    assert result, "%s in %s of %s" % ( expression, f, self )
-
                 expression = "(%s) - (%s)" % ( previous, f.highBit )
-                delta = sympy.simplify( expression )
+                delta = bit_difference( previous, f.highBit )
                 try:
                     delta = int( delta )
-                    assert delta == 1, \
-                            "%s doesn't have all bits defined above %s (%s)" % ( self, f, expression )
                 except TypeError:
                     pass
+                else:
+                    if delta <= 0:
+                        problems.append( "%s: %s overlaps the field above it "
+                                "(%s)" % ( self, f, expression ) )
+                    elif delta != 1:
+                        problems.append( "%s doesn't have all bits defined "
+                                "above %s (%s)" % ( self, f, expression ) )
             previous = f.lowBit
-        assert previous is None or int( previous ) == 0, \
-                "%s isn't defined down to 0 (%r)" % ( self, previous )
+        try:
+            if not previous is None and int( bit_expression( previous ) ) != 0:
+                problems.append( "%s isn't defined down to 0 (%r)" % (
+                    self, previous ) )
+        except TypeError:
+            problems.append( "%s isn't defined down to 0 (%r)" % (
+                self, previous ) )
 
     def width( self ):
         if self.fields:
-            return Max(*(f.highBit for f in self.fields))
+            if not any( f.highBitValue is None for f in self.fields ):
+                return max( f.highBitValue for f in self.fields )
+            return import_sympy().Max(*(f.highBit for f in self.fields))
         else:
             return 0
 
@@ -80,15 +527,20 @@ class Register( object ):
         return self.name
 
 class Value( object ):
-    def __init__( self, element ):
-        self.value = element.get( 'v' )
-        self.range = element.get( 'range' )
+    __slots__ = ( "value", "range", "low", "high", "text", "tail", "name",
+            "duplicate" )
+
+    def __init__( self, value, range, text, tail, name, duplicate ):
+        self.value = intern( value )
+        self.range = range
         if self.range:
-            self.low, self.high = self.range.split( ":" )
-        self.text = element.text.strip()
-        self.tail = element.tail.strip()
-        self.name = element.get( "name" )
-        self.duplicate = element.get( "duplicate" )
+            self.low, self.high = map( intern, self.range.split( ":" ) )
+        else:
+            self.low = self.high = None
+        self.text = text
+        self.tail = tail
+        self.name = intern( name )
+        self.duplicate = duplicate
 
     def to_latex( self ):
         result = []
@@ -100,9 +552,15 @@ class Value( object ):
             result.append( self.tail )
         return "\n".join( result )
 
-    def to_c_definitions( self, prefix ):
+    def c_names( self, name ):
+        """Return the names of the C #defines for this value, given the name
+        of the value itself (see Identifiers.c_value())."""
+        if self.range:
+            return [ "%s_LOW" % name, "%s_HIGH" % name ]
+        return [ name ]
+
+    def to_c_definitions( self, name ):
         result = []
-        name = "%s_%s" % ( prefix, toCIdentifier( self.name.upper() ))
         result.append(( "comment", "%s: %s" % ( self.name, self.text )))
         if self.range:
             result.append(( "%s_LOW" % name, self.low ))
@@ -113,28 +571,56 @@ class Value( object ):
             result.append(( "comment", self.tail ))
         return result
 
+def unique( items ):
+    """Return True if there are no duplicates in items."""
+    seen = set()
+    for item in items:
+        if item in seen:
+            return False
+        seen.add( item )
+    return True
+
 class Field( object ):
+    """lowBitValue and highBitValue are the bit positions as ints, or None if
+    they are symbolic. bitValues gives them when they are already known, so
+    the bit positions don't have to be parsed."""
+    __slots__ = ( "name", "lowBit", "highBit", "lowBitValue", "highBitValue",
+            "reset", "access", "description", "sdesc", "define", "values" )
+
     def __init__( self, name, lowBit, highBit, reset, access, description,
-            sdesc, define, values ):
-        self.name = name
-        self.lowBit = lowBit
-        self.highBit = highBit
-        self.reset = reset
-        self.access = access
+            sdesc, define, values, bitValues=None ):
+        self.name = intern( name )
+        self.lowBit = intern( lowBit )
+        self.highBit = intern( highBit )
+        if bitValues:
+            self.lowBitValue, self.highBitValue = bitValues
+        else:
+            self.lowBitValue = constant_value( bit_expression( lowBit ) )
+            self.highBitValue = constant_value( bit_expression( highBit ) )
+        self.reset = intern( reset )
+        self.access = intern( access )
         self.description = description
+        self.sdesc = sdesc
         self.define = define
-        self.values = values
+        self.values = tuple( values )
 
-        name_counts = collections.Counter( v.name for v in values if not v.duplicate )
-        assert all( v == 1 for v in name_counts.values() ), \
+        assert unique( v.name for v in values if not v.duplicate ), \
             "Duplicate field name in field %s" % self.name
 
-        value_counts = collections.Counter( v.value for v in values if not v.duplicate )
-        assert all( v == 1 for v in value_counts.values() ), \
+        assert unique( v.value for v in values if not v.duplicate ), \
             "Duplicate field value in field %s" % self.name
 
     def length( self ):
-        return sympy.simplify( "1 + (%s) - (%s)" % ( self.highBit, self.lowBit ) )
+        delta = bit_difference( self.highBit, self.lowBit )
+        if isinstance( delta, Linear ):
+            return delta + 1
+        return simplify( "1 + (%s) - (%s)" % ( self.highBit, self.lowBit ) )
+
+    def with_bits( self, high, low ):
+        """Return a copy of this field at bits high:low (ints)."""
+        return Field( self.name, str( low ), str( high ), self.reset,
+                self.access, self.description, self.sdesc, self.define,
+                self.values )
 
     def columnWidth( self ):
         text = str( self.length() )
@@ -165,19 +651,24 @@ def parse_bits( field ):
     else:
         assert False, text
 
-def parse_xml( path ):
-    e = xml.etree.ElementTree.parse( path ).getroot()
+def parse_registers( e ):
+    """Return a Registers for the root element e, without any registers."""
     if e.text:
         description = e.text.strip()
     else:
         description = ""
-    registers = Registers( e.get( 'name' ), e.get( 'label' ),
+    return Registers( e.get( 'name' ), e.get( 'label' ),
             e.get( 'prefix' ), description,
             int( e.get( 'skip_index', 0 ) ),
             int( e.get( 'skip_access', 0 ) ),
             int( e.get( 'skip_reset', 0 ) ),
             int( e.get( 'depth', 1 )))
-    for r in e.findall( 'register' ):
+
+def parse_register( r ):
+    """Return a Register for the <register> element r, with its fields sorted,
+    and a list of the problems with its layout."""
+    with profile_span( ( r.get( 'short' ) or r.get( 'name' ) ).lower(),
+            "register" ):
         name = r.get( 'name' )
         short = r.get( 'short' )
         if r.text:
@@ -199,74 +690,476 @@ def parse_xml( path ):
                 define = int( f.get( 'define', '0' ) )
             else:
                 define = int( f.get( 'define', '1' ) )
-            values = [ Value( v ) for v in f.findall( 'value' ) ]
+            values = [ Value( v.get( 'v' ), v.get( 'range' ), v.text.strip(),
+                v.tail.strip(), v.get( 'name' ), v.get( 'duplicate' ) )
+                for v in f.findall( 'value' ) ]
             field = Field( f.get( 'name' ), lowBit, highBit, f.get( 'reset' ),
                     f.get( 'access' ), description, f.get( 'sdesc' ),
                     define, values )
             register.add_field( field )
 
-        register.check()
+        register.sort_fields()
+        return register, register.layout_problems()
+
+def parse_xml( path ):
+    e = xml.etree.ElementTree.parse( path ).getroot()
+    registers = parse_registers( e )
+    problems = []
+    for r in e.findall( 'register' ):
+        register, registerProblems = parse_register( r )
+        problems += registerProblems
+        problems += registers.identifiers.add( register )
+        registers.add_register( register )
+    assert not problems, "\n".join( problems )
+    return registers
+
+def stream_xml( path ):
+    """Parse path incrementally. Return a Registers, which doesn't have any
+    registers, and an iterator over the registers. Each Register is validated
+    as soon as its </register> has been read, and its element is then thrown
+    away, so memory use only grows with the number of identifiers (see
+    Identifiers), as long as the caller doesn't keep the registers.
+
+    Registers.description is only set once the first register has been
+    read."""
+    events = xml.etree.ElementTree.iterparse( path, events=( "start", "end" ) )
+    event, root = next( events )
+    registers = parse_registers( root )
+
+    def iterate():
+        for event, e in events:
+            if e.tag != 'register' or e not in root:
+                continue
+            if event == "start":
+                # By now all of the text before the first register has been
+                # read.
+                if root.text and not registers.description:
+                    registers.description = root.text.strip()
+                continue
+            register, problems = parse_register( e )
+            problems += registers.identifiers.add( register )
+            assert not problems, "\n".join( problems )
+            root.remove( e )
+            yield register
+        if root.text and not registers.description:
+            registers.description = root.text.strip()
+    return registers, iterate()
+
+# Bump this whenever the compiled format changes incompatibly.
+COMPILED_FORMAT = "riscv-debug-registers"
+COMPILED_VERSION = 1
+
+def constant_value( expression ):
+    """Return expression as an int if it is a constant, and None otherwise."""
+    if isinstance( expression, Linear ) and expression.is_constant():
+        return int( expression )
+    if isinstance( expression, int ):
+        return expression
+    return None
+
+def write_compiled( fd, registers ):
+    """Write the validated model as compact JSON that load_compiled() can read
+    back without ElementTree or sympy. Numeric offsets, lengths, masks and
+    addresses are included wherever they don't depend on XLEN etc., and fields
+    are listed in the order add_field() sorted them into."""
+    json.dump( compiled_model( registers ), fd, separators=( ",", ":" ) )
+
+def compiled_model( registers ):
+    """Return what write_compiled() writes, as a dictionary."""
+    result = {
+        "format": COMPILED_FORMAT,
+        "version": COMPILED_VERSION,
+        "name": registers.name,
+        "label": registers.label,
+        "prefix": registers.prefix,
+        "description": registers.description,
+        "skip_index": registers.skip_index,
+        "skip_access": registers.skip_access,
+        "skip_reset": registers.skip_reset,
+        "depth": registers.depth,
+        "registers": []
+    }
+    for r in registers.registers:
+        address = address_value( r.address )
+        register = {
+            "name": r.name,
+            "short": r.short,
+            "description": r.description,
+            "address": r.address,
+            "addressValue": address if isinstance( address, int ) else None,
+            "sdesc": r.sdesc,
+            "define": r.define,
+            "fields": []
+        }
+        for f in r.fields:
+            offset = f.lowBitValue
+            length = constant_value( f.length() )
+            if offset is None or length is None:
+                mask = None
+            else:
+                mask = ( ( 1 << length ) - 1 ) << offset
+            register[ "fields" ].append( {
+                "name": f.name,
+                "lowBit": f.lowBit,
+                "highBit": f.highBit,
+                "offset": offset,
+                "length": length,
+                "mask": mask,
+                "reset": f.reset,
+                "access": f.access,
+                "description": f.description,
+                "sdesc": f.sdesc,
+                "define": f.define,
+                "values": [ [ v.value, v.range, v.text, v.tail, v.name,
+                    v.duplicate ] for v in f.values ]
+            } )
+        result[ "registers" ].append( register )
+    return result
+
+def load_compiled( path ):
+    """Rebuild the Registers written by write_compiled() from path."""
+    with open( path ) as fd:
+        return compiled_registers( json.load( fd ), path )
+
+def compiled_bits( f ):
+    """Return the lowBitValue and highBitValue of the compiled field f, or
+    None if its offset or length is symbolic."""
+    if f[ "offset" ] is None or f[ "length" ] is None:
+        return None
+    return f[ "offset" ], f[ "offset" ] + f[ "length" ] - 1
+
+def compiled_registers( data, path ):
+    """Rebuild the Registers in data, as returned by compiled_model(). path
+    is only used in error messages."""
+    assert data.get( "format" ) == COMPILED_FORMAT, \
+            "%s is not a compiled register file" % path
+    assert data.get( "version" ) == COMPILED_VERSION, \
+            "%s has version %r, not %d" % ( path, data.get( "version" ),
+                    COMPILED_VERSION )
+    registers = Registers( data[ "name" ], data[ "label" ], data[ "prefix" ],
+            data[ "description" ], data[ "skip_index" ],
+            data[ "skip_access" ], data[ "skip_reset" ], data[ "depth" ] )
+    for r in data[ "registers" ]:
+        register = Register( r[ "name" ], r[ "short" ], r[ "description" ],
+                r[ "address" ], r[ "sdesc" ], r[ "define" ] )
+        # The fields were sorted and checked before they were written, and
+        # only fields with symbolic bits need their bits parsed.
+        register.fields = [ Field( f[ "name" ], f[ "lowBit" ], f[ "highBit" ],
+                f[ "reset" ], f[ "access" ], f[ "description" ], f[ "sdesc" ],
+                f[ "define" ], [ Value( *v ) for v in f[ "values" ] ],
+                compiled_bits( f ) )
+            for f in r[ "fields" ] ]
         registers.add_register( register )
     return registers
 
+def find_register( registers, name ):
+    """Return the register in registers called name (matching its short name,
+    full name or label, ignoring case)."""
+    name = name.lower()
+    for r in registers.registers:
+        if name in ( ( r.short or "" ).lower(), r.name.lower(), r.label ):
+            return r
+    raise KeyError( "No register %r in %s" % ( name, registers.name ) )
+
+def read_registers( path ):
+    """Return the Registers in path, which is either an XML register file or
+    the output of --compile."""
+    if path.endswith( ".json" ):
+        return load_compiled( path )
+    return parse_xml( path )
+
+# The attributes that diff_registers() compares.
+REGISTERS_ATTRIBUTES = ( "name", "label", "prefix", "description",
+        "skip_index", "skip_access", "skip_reset", "depth" )
+REGISTER_ATTRIBUTES = ( "name", "address", "sdesc", "description", "define" )
+FIELD_ATTRIBUTES = ( "bits", "access", "reset", "sdesc", "description",
+        "define" )
+VALUE_ATTRIBUTES = ( "value", "text", "tail", "duplicate" )
+# Attributes that are too long to show in a changelog.
+TEXT_ATTRIBUTES = frozenset( ( "description", "text", "tail" ) )
+
+class Change( object ):
+    """One difference found by diff_registers(). where is the key (see
+    keyed()) of the register, field and value that changed, as far as
+    applicable, so it is empty for the register file itself. what is the
+    attribute that changed, "added", "removed" or "order" (the order of the
+    registers, fields or values in where changed)."""
+    __slots__ = ( "where", "what", "old", "new" )
+
+    def __init__( self, where, what, old, new ):
+        self.where = where
+        self.what = what
+        self.old = old
+        self.new = new
+
+    def register( self ):
+        if self.where:
+            return self.where[0]
+        return None
+
+    def describe( self ):
+        """Return the change as text, leaving out the register."""
+        inner = self.where[1:]
+        subject = "=".join( inner )
+        if self.what in ( "added", "removed" ):
+            if not inner:
+                item = self.new or self.old
+                if item.address is None:
+                    return self.what
+                return "%s at %s" % ( self.what, item.address )
+            kind = ( "field", "value" )[ len( inner ) - 1 ]
+            return "%s %s %s" % ( self.what, kind, subject )
+        if self.what == "order":
+            kind = ( "registers", "fields", "values" )[ len( self.where ) ]
+            return " ".join( x for x in ( kind, "of " + subject if subject
+                else "", "reordered" ) if x )
+        if self.what in TEXT_ATTRIBUTES:
+            change = "description changed"
+        else:
+            change = "%s %s -> %s" % ( self.what, self.old, self.new )
+        if subject:
+            return "%s %s" % ( subject, change )
+        return change
+
+    def __str__( self ):
+        return "%s: %s" % ( self.register() or "(file)", self.describe() )
+
+def register_key( r ):
+    return r.short or r.name
+
+def keyed( items, key ):
+    """Return an OrderedDict mapping key( item ) to item for every item in
+    items. When several items have the same key (like the BYPASS registers in
+    jtag_registers.xml) #2, #3 etc. is appended to it."""
+    result = collections.OrderedDict()
+    for item in items:
+        k = key( item )
+        unique = k
+        n = 2
+        while unique in result:
+            unique = "%s#%d" % ( k, n )
+            n += 1
+        result[ unique ] = item
+    return result
+
+def attribute_value( item, attribute ):
+    if attribute == "bits":
+        if item.highBit == item.lowBit:
+            return item.lowBit
+        return "%s:%s" % ( item.highBit, item.lowBit )
+    if attribute == "value":
+        return item.range or item.value
+    return getattr( item, attribute )
+
+def diff_attributes( changes, where, old, new, attributes ):
+    for attribute in attributes:
+        a = attribute_value( old, attribute )
+        b = attribute_value( new, attribute )
+        if a != b:
+            changes.append( Change( where, attribute, a, b ) )
+
+def diff_items( changes, where, old, new, key, diff_item ):
+    """Append the Changes between the lists of items old and new, which are
+    matched by key, to changes. diff_item( changes, where, old, new ) is
+    called for every pair of matching items."""
+    oldItems = keyed( old, key )
+    newItems = keyed( new, key )
+    for k, item in oldItems.items():
+        if not k in newItems:
+            changes.append( Change( where + ( k, ), "removed", item, None ) )
+    for k, item in newItems.items():
+        if k in oldItems:
+            diff_item( changes, where + ( k, ), oldItems[ k ], item )
+        else:
+            changes.append( Change( where + ( k, ), "added", None, item ) )
+    oldOrder = [ k for k in oldItems if k in newItems ]
+    newOrder = [ k for k in newItems if k in oldItems ]
+    if oldOrder != newOrder:
+        changes.append( Change( where, "order", oldOrder, newOrder ) )
+
+def diff_value( changes, where, old, new ):
+    diff_attributes( changes, where, old, new, VALUE_ATTRIBUTES )
+
+def diff_field( changes, where, old, new ):
+    diff_attributes( changes, where, old, new, FIELD_ATTRIBUTES )
+    diff_items( changes, where, old.values, new.values, lambda v: v.name,
+            diff_value )
+
+def diff_register( changes, where, old, new ):
+    diff_attributes( changes, where, old, new, REGISTER_ATTRIBUTES )
+    diff_items( changes, where, old.fields, new.fields, lambda f: f.name,
+            diff_field )
+
+def diff_registers( old, new ):
+    """Return a list of Changes that turn the Registers old into new.
+    Registers are matched by their short name (or name), fields and values by
+    name."""
+    changes = []
+    diff_attributes( changes, (), old, new, REGISTERS_ATTRIBUTES )
+    diff_items( changes, (), old.registers, new.registers, register_key,
+            diff_register )
+    return changes
+
+def write_changelog( fd, changes, prefix="" ):
+    """Write one line, starting with prefix, for each register that changes
+    (as returned by diff_registers()) affect, listing what changed."""
+    described = collections.OrderedDict()
+    for change in changes:
+        descriptions = described.setdefault( change.register(), [] )
+        text = change.describe()
+        if not text in descriptions:
+            descriptions.append( text )
+    for register, descriptions in described.items():
+        fd.write( "%s%s: %s\n" % ( prefix, register or "(file)",
+            "; ".join( descriptions ) ) )
+
+# toLatexIdentifier() removes these characters (and \_), spells out these
+# numbers, and then spells out every digit that is left. The numbers are
+# replaced one after the other, so e.g. 164 becomes OneSixtyfour.
+LATEX_REMOVE = str.maketrans( "", "", "/ -_()" )
+LATEX_NUMBERS = (
+        ( '64', 'Sixtyfour' ),
+        ( '32', 'Thirtytwo' ),
+        ( '28', 'Twentyeight' ),
+        ( '16', 'Sixteen' ),
+        ( '15', 'Fifteen' ),
+        ( '11', 'Eleven' )
+        )
+LATEX_DIGITS = str.maketrans( dict( zip( "0123456789", ( "Zero", "One",
+    "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine" ) ) ) )
+
 def toLatexIdentifier( *args ):
-    replacements = (
-            ( '/', '' ),
-            ( '\\_', '' ),
-            ( ' ', '' ),
-            ( '-', '' ),
-            ( '_', '' ),
-            ( '(', '' ),
-            ( ')', '' ),
-            ( '64', 'Sixtyfour' ),
-            ( '32', 'Thirtytwo' ),
-            ( '28', 'Twentyeight' ),
-            ( '16', 'Sixteen' ),
-            ( '15', 'Fifteen' ),
-            ( '11', 'Eleven' ),
-            ( '9', 'Nine' ),
-            ( '8', 'Eight' ),
-            ( '7', 'Seven' ),
-            ( '6', 'Six' ),
-            ( '5', 'Five' ),
-            ( '4', 'Four' ),
-            ( '3', 'Three' ),
-            ( '2', 'Two' ),
-            ( '1', 'One' ),
-            ( '0', 'Zero' )
-            )
     text = ""
     for arg in args:
         arg = (arg or "").lower()
-        for frm, to in replacements:
-            arg = arg.replace( frm, to )
+        if "\\" in arg:
+            # The / goes first, so that \/_ also loses its \_.
+            arg = arg.replace( "/", "" ).replace( "\\_", "" )
+        arg = arg.translate( LATEX_REMOVE )
+        if not arg.isalpha():
+            for number, word in LATEX_NUMBERS:
+                arg = arg.replace( number, word )
+            arg = arg.translate( LATEX_DIGITS )
         if arg and text:
             arg = arg[0].upper() + arg[1:]
         text += arg
     return text
 
-def toCIdentifier( text ):
-    return re.sub( "[^\w]", "_", text )
+C_NOT_IDENTIFIER = re.compile( r"[^\w]" )
 
-def write_definitions( fd, registers ):
-    for r in registers.registers:
+def toCIdentifier( text ):
+    return C_NOT_IDENTIFIER.sub( "_", text )
+
+class Identifiers( object ):
+    """The LaTeX labels and macro names (see toLatexIdentifier()) and C names
+    (see toCIdentifier()) made from the names in one Registers, each mangled
+    only once. add() reports registers, fields and values that end up with
+    the same identifier, which would give duplicate LaTeX labels, or C
+    #defines that write_cheader() leaves out."""
+    def __init__( self, prefix ):
+        self.prefix = prefix
+        self.latexNames = {}
+        self.cNames = {}
+        # ( kind, identifier ) -> ( register, field, value )
+        self.owners = {}
+
+    def latex( self, *names ):
+        """Return toLatexIdentifier( prefix, *names )."""
+        identifier = self.latexNames.get( names )
+        if identifier is None:
+            identifier = toLatexIdentifier( self.prefix, *names )
+            self.latexNames[ names ] = identifier
+        return identifier
+
+    def c( self, text ):
+        """Return toCIdentifier( text )."""
+        identifier = self.cNames.get( text )
+        if identifier is None:
+            identifier = toCIdentifier( text )
+            self.cNames[ text ] = identifier
+        return identifier
+
+    def c_register( self, r ):
+        """Return the name of r in C #defines, e.g. DM_DMCONTROL."""
+        return self.prefix + self.c( r.short or r.label ).upper()
+
+    def c_field( self, r, f ):
+        """Return the name of f in r in C #defines, e.g.
+        DM_DMCONTROL_HARTSELLO."""
+        return "%s_%s" % ( self.c_register( r ), self.c( f.name ).upper() )
+
+    def c_value( self, r, f, v ):
+        """Return the name of v of f in r in C #defines, e.g.
+        DM_DMCONTROL_HASEL_SINGLE. Ranges add _LOW and _HIGH to it."""
+        return "%s_%s" % ( self.c_field( r, f ), self.c( v.name.upper() ) )
+
+    def add( self, r ):
+        """Remember the identifiers of r and its fields. Return a list of
+        problems, one for every identifier that already belongs to a
+        different register, field or value."""
         regid = r.short or r.label
+        identifiers = []
         if r.define:
-            macroName = toLatexIdentifier( registers.prefix, regid )
-            fd.write( "\\defregname{\\R%s}{\\hyperref[%s]{%s}}\n" % (
-                macroName, toLatexIdentifier( registers.prefix, r.label ), r.short or r.label ) )
+            owner = ( regid, None, None )
+            identifiers += [
+                    ( "\\R macro", self.latex( regid ), owner ),
+                    ( "label", self.latex( r.label ), owner ),
+                    ( "C name", self.c_register( r ), owner ) ]
         for f in r.fields:
+            owner = ( regid, f.name, None )
+            if f.define or f.description or f.values:
+                identifiers.append(( "label", self.latex( regid, f.name ),
+                    owner ))
             if f.define:
-                fd.write( "\\deffieldname{\\F%s}{\\hyperref[%s]{%s}}\n" % (
-                        toLatexIdentifier( registers.prefix, regid, f.name ),
-                        toLatexIdentifier( registers.prefix, regid, f.name ),
-                        f.name ) )
+                name = self.c_field( r, f )
+                identifiers += [
+                        ( "\\F macro", self.latex( regid, f.name ), owner ),
+                        ( "C name", name, owner ),
+                        ( "C name", name + "_OFFSET", owner ),
+                        ( "C name", name + "_LENGTH", owner ) ]
+                for v in f.values:
+                    owner = ( regid, f.name, v.name )
+                    identifiers += [ ( "C name", define, owner )
+                        for define in v.c_names( self.c_value( r, f, v ) ) ]
+        problems = []
+        for kind, identifier, owner in identifiers:
+            other = self.owners.setdefault( ( kind, identifier ), owner )
+            if other != owner:
+                problems.append( "%s and %s both have the %s %s" % (
+                    ".".join( n for n in other if n ),
+                    ".".join( n for n in owner if n ), kind, identifier ) )
+        return problems
+
+def write_definitions( fd, registers ):
+    for r in registers.registers:
+        write_register_definitions( fd, registers, r )
+
+def write_register_definitions( fd, registers, r ):
+    identifiers = registers.identifiers
+    regid = r.short or r.label
+    if r.define:
+        macroName = identifiers.latex( regid )
+        fd.write( "\\defregname{\\R%s}{\\hyperref[%s]{%s}}\n" % (
+            macroName, identifiers.latex( r.label ), r.short or r.label ) )
+    for f in r.fields:
+        if f.define:
+            fieldName = identifiers.latex( regid, f.name )
+            fd.write( "\\deffieldname{\\F%s}{\\hyperref[%s]{%s}}\n" % (
+                    fieldName, fieldName, f.name ) )
 
 class Macro:
-    def __init__(self, name, expressionText):
+    def __init__(self, name, expression):
         self.name = name
-        self.expression = sympy.simplify(expressionText)
-        self.atoms = self.expression.atoms(sympy.Symbol)
+        if isinstance(expression, str):
+            expression = bit_expression(expression)
+        if isinstance(expression, int):
+            expression = Linear(expression)
+        if isinstance(expression, Linear):
+            self.expression = expression
+            self.atoms = expression.atoms()
+        else:
+            self.expression = simplify(expression)
+            self.atoms = self.expression.atoms(import_sympy().Symbol)
 
     def prototype(self):
         if self.atoms:
@@ -279,7 +1172,19 @@ class Macro:
 
 def sympy_to_c(expression):
     """Implement our own string function, so we can replace 2** with 1<<."""
-    if isinstance(expression, sympy.Number):
+    if isinstance(expression, Linear):
+        if expression.is_constant():
+            return sympy_to_c(expression.constant)
+        if expression.coefficient == 1:
+            term = expression.symbol
+        else:
+            term = "(%s * %s)" % (sympy_to_c(expression.coefficient),
+                    expression.symbol)
+        if expression.constant == 0:
+            return term
+        return "(%s + %s)" % (term, sympy_to_c(expression.constant))
+    elif isinstance(expression, int) or \
+            isinstance(expression, import_sympy().Number):
         if (expression >= 2**32):
             return "0x%xULL" % expression
         elif (expression >= 2**31):
@@ -306,11 +1211,20 @@ def sympy_to_c(expression):
         return "(1ULL<<%s)" % sympy_to_c(exponent)
     raise Exception("Unsupported sympy object %r of type %r" % (expression, type(expression)))
 
-def write_cheader( fd, registers ):
+def c_definitions( registers ):
+    """Return the ( name, value ) pairs for write_cheader(), where name is
+    "comment" for comments. Also return a list of ( register, field, macro
+    prefix, mask macro name ) for every field that has a mask macro."""
     definitions = []
+    fields = []
     for r in registers.registers:
-        name = toCIdentifier( r.short or r.label ).upper()
-        prefname = registers.prefix + name
+        c_register_definitions( registers, r, definitions, fields )
+    return definitions, fields
+
+def c_register_definitions( registers, r, definitions, fields ):
+    """Append the c_definitions() of register r to definitions and fields."""
+    with profile_span( r.label, "register" ):
+        prefname = registers.identifiers.c_register( r )
         if r.define and not r.address is None:
             definitions.append((prefname, r.address))
         try:
@@ -324,7 +1238,7 @@ def write_cheader( fd, registers ):
             if f.define:
                 if f.description:
                     definitions.append(( "comment", f.description ))
-                prefix = "%s_%s" % ( prefname, toCIdentifier( f.name ).upper() )
+                prefix = registers.identifiers.c_field( r, f )
                 offset = Macro(
                     "%s_OFFSET" % prefix,
                     f.lowBit
@@ -335,31 +1249,324 @@ def write_cheader( fd, registers ):
                     f.length()
                 )
                 definitions.append(( length.prototype(), length.body() ))
-                # sympy doesn't support a bit shift (<<) operator, so here we
-                # use power (**) instead.
-                mask = Macro(
-                    prefix,
-                    ((2 ** sympy.simplify(f.length())) - 1) * (2 ** sympy.simplify(f.lowBit))
-                )
+                length = f.length()
+                lowBit = bit_expression(f.lowBit)
+                if isinstance(length, Linear) and length.is_constant() and \
+                        isinstance(lowBit, Linear) and lowBit.is_constant():
+                    mask = Macro(
+                        prefix,
+                        ((1 << int(length)) - 1) << int(lowBit)
+                    )
+                else:
+                    # sympy doesn't support a bit shift (<<) operator, so here
+                    # we use power (**) instead.
+                    mask = Macro(
+                        prefix,
+                        ((2 ** to_sympy(length)) - 1) * (2 ** to_sympy(lowBit))
+                    )
                 definitions.append(( mask.prototype(), mask.body() ))
+                fields.append(( r, f, prefix, mask.prototype() ))
 
                 for v in f.values:
-                    definitions += v.to_c_definitions(prefix)
-
+                    definitions += v.to_c_definitions(
+                            registers.identifiers.c_value( r, f, v ))
+
+def write_cheader( fd, registers, accessors=False ):
+    """Write C #defines for every register address and field. If accessors is
+    set, also write static inline functions to access each field (see
+    write_caccessors())."""
+    definitions, fields = c_definitions( registers )
     counted = collections.Counter(name for name, value in definitions)
     for name, value in definitions:
-        if name == "comment":
-            fd.write( "/*\n" )
-            for line in value.splitlines():
-                fd.write( (" * %s" % line.strip()).rstrip() + "\n" )
-            fd.write( " */\n" )
+        # Names that are defined more than once are left out entirely.
+        if name == "comment" or counted[name] == 1:
+            fd.write( c_define( name, value ) )
+    if accessors:
+        write_caccessors( fd, c_accessors( registers, fields, counted ) )
+
+def c_define( name, value ):
+    """Return the text for one of the ( name, value ) pairs returned by
+    c_definitions()."""
+    if name == "comment":
+        return "/*\n" + "".join( (" * %s" % line.strip()).rstrip() + "\n"
+                for line in value.splitlines() ) + " */\n"
+    if not isinstance(value, str):
+        value = sympy_to_c(value)
+    return "#define %-35s %s\n" % ( name, value )
+
+C_KEYWORDS = frozenset( """auto break case char const continue default do
+        double else enum extern float for goto if inline int long register
+        restrict return short signed sizeof static struct switch typedef union
+        unsigned void volatile while""".split() )
+
+class CAccessorField( object ):
+    """A field that gets get/set/insert functions. offset and length are
+    Linear, possibly in terms of a (lower case) function parameter."""
+    def __init__( self, field, macro, maskMacro, offset, length, member ):
+        self.field = field
+        self.macro = macro
+        self.maskMacro = maskMacro
+        self.offset = offset
+        self.length = length
+        self.function = macro.lower()
+        self.member = member
+
+    def parameters( self ):
+        return self.offset.atoms() | self.length.atoms()
+
+class CAccessorRegister( object ):
+    def __init__( self, register, name, type, fields ):
+        self.register = register
+        self.name = name
+        self.type = type
+        self.fields = fields
+        self.parameters = sorted( set().union(
+            *( f.parameters() for f in fields ) ) )
+
+def lower_symbol( expression ):
+    """Return the Linear expression with its symbol in lower case, which is how
+    it is passed to the generated accessor functions. (XLEN might well be a
+    macro in code that includes the header.)"""
+    return Linear( expression.constant, expression.coefficient,
+            expression.symbol and expression.symbol.lower() )
+
+def c_accessors( registers, fields, counted ):
+    """Return a CAccessorRegister for every register that has fields that can
+    have accessors. fields and counted come from c_definitions() and
+    write_cheader(). Fields whose macros are dropped as duplicates, or whose
+    position isn't Linear, don't get accessors."""
+    result = []
+    names = set()
+    byRegister = collections.OrderedDict()
+    for r, f, macro, maskMacro in fields:
+        byRegister.setdefault( r, [] ).append(( f, macro, maskMacro ))
+    for r, rfields in byRegister.items():
+        name = registers.identifiers.c_register( r ).lower()
+        if name in names:
             continue
-        if counted[name] == 1:
-            if not isinstance(value, str):
-                value = sympy_to_c(value)
-            fd.write( "#define %-35s %s\n" % ( name, value ) )
+        names.add( name )
+        highBits = [ bit_expression( f.highBit ) for f in r.fields ]
+        if all( isinstance( b, Linear ) and b.is_constant() for b in highBits ) \
+                and max( int( b ) for b in highBits ) < 32:
+            type = "uint32_t"
+        else:
+            type = "uint64_t"
+        members = set()
+        accessorFields = []
+        for f, macro, maskMacro in rfields:
+            offset = bit_expression( f.lowBit )
+            length = f.length()
+            if counted[ maskMacro ] != 1 or not isinstance( offset, Linear ) \
+                    or not isinstance( length, Linear ):
+                continue
+            member = registers.identifiers.c( f.name ).lower()
+            if member in C_KEYWORDS:
+                member += "_"
+            if member[ 0 ].isdigit():
+                member = "field" + member
+            if member in members:
+                continue
+            members.add( member )
+            accessorFields.append( CAccessorField( f, macro, maskMacro,
+                lower_symbol( offset ), lower_symbol( length ), member ) )
+        if accessorFields:
+            result.append( CAccessorRegister( r, name, type, accessorFields ) )
+    return result
+
+def c_literal( value, type ):
+    return "0x%x%s" % ( value, "U" if type == "uint32_t" else "ULL" )
+
+def write_caccessors( fd, accessors ):
+    """Write static inline functions for every field in accessors:
+        FIELD_get(reg) returns the value of the field in reg.
+        FIELD_insert(reg, value) returns reg with the field replaced by value.
+        FIELD_set(&reg, value) replaces the field in reg by value.
+    Fields with constant positions use constant shifts and masks. Fields whose
+    position depends on XLEN etc. take those as extra (lower case) parameters,
+    and only work up to 64 bits. Every register also gets a struct with a
+    member for each field, and REG_pack()/REG_unpack() functions to convert
+    between that struct and the raw register value."""
+    fd.write( "#ifndef RISCV_DEBUG_ACCESSORS\n" )
+    fd.write( "#define RISCV_DEBUG_ACCESSORS\n" )
+    fd.write( "#include <stdint.h>\n" )
+    fd.write( "static inline uint64_t riscv_debug_mask(unsigned length)\n" )
+    fd.write( "{\n" )
+    fd.write( "\treturn length >= 64 ? ~0ULL : (1ULL << length) - 1;\n" )
+    fd.write( "}\n" )
+    fd.write( "#endif\n" )
+    for a in accessors:
+        write_caccessor( fd, a )
+
+def write_caccessor( fd, a ):
+    """Write the functions and struct that write_caccessors() writes for the
+    CAccessorRegister a."""
+    t = a.type
+    for f in a.fields:
+        parameters = "".join( ", unsigned %s" % p
+                for p in sorted( f.parameters() ) )
+        arguments = "".join( ", %s" % p for p in sorted( f.parameters() ) )
+        if f.offset.is_constant():
+            shift = "%d" % int( f.offset )
+        else:
+            shift = sympy_to_c( f.offset )
+        if f.length.is_constant() and f.offset.is_constant():
+            fieldMask = c_literal( ( 1 << int( f.length ) ) - 1, t )
+            mask = c_literal( ( ( 1 << int( f.length ) ) - 1 ) <<
+                    int( f.offset ), t )
+        else:
+            if f.length.is_constant():
+                fieldMask = c_literal( ( 1 << int( f.length ) ) - 1, t )
+            else:
+                fieldMask = "riscv_debug_mask(%s)" % sympy_to_c( f.length )
+            mask = "(%s << %s)" % ( fieldMask, shift )
+        fd.write( "static inline %s %s_get(%s reg%s)\n" % (
+            t, f.function, t, parameters ) )
+        fd.write( "{\n" )
+        fd.write( "\treturn (reg >> %s) & %s;\n" % ( shift, fieldMask ) )
+        fd.write( "}\n" )
+        fd.write( "static inline %s %s_insert(%s reg, %s value%s)\n" % (
+            t, f.function, t, t, parameters ) )
+        fd.write( "{\n" )
+        fd.write( "\treturn (reg & ~%s) | ((value << %s) & %s);\n" % (
+            mask, shift, mask ) )
+        fd.write( "}\n" )
+        fd.write( "static inline void %s_set(%s *reg, %s value%s)\n" % (
+            f.function, t, t, parameters ) )
+        fd.write( "{\n" )
+        fd.write( "\t*reg = %s_insert(*reg, value%s);\n" % (
+            f.function, arguments ) )
+        fd.write( "}\n" )
+
+    parameters = "".join( ", unsigned %s" % p for p in a.parameters )
+    fd.write( "struct %s {\n" % a.name )
+    for f in a.fields:
+        fd.write( "\t%s %s;\n" % ( t, f.member ) )
+    fd.write( "};\n" )
+    fd.write( "static inline void %s_unpack(struct %s *fields, %s reg%s)\n" % (
+        a.name, a.name, t, parameters ) )
+    fd.write( "{\n" )
+    for f in a.fields:
+        fd.write( "\tfields->%s = %s_get(reg%s);\n" % ( f.member,
+            f.function, "".join( ", %s" % p
+                for p in sorted( f.parameters() ) ) ) )
+    fd.write( "}\n" )
+    fd.write( "static inline %s %s_pack(const struct %s *fields%s)\n" % (
+        t, a.name, a.name, parameters ) )
+    fd.write( "{\n" )
+    fd.write( "\t%s reg = 0;\n" % t )
+    for f in a.fields:
+        fd.write( "\treg = %s_insert(reg, fields->%s%s);\n" % ( f.function,
+            f.member, "".join( ", %s" % p
+                for p in sorted( f.parameters() ) ) ) )
+    fd.write( "\treturn reg;\n" )
+    fd.write( "}\n" )
+
+def write_accessor_test( fd, registers, header ):
+    """Write a C program that includes header (written by write_cheader()
+    with accessors) and checks every accessor function against the #defines
+    for the same field. Symbolic fields are checked at XLEN 32 and 64."""
+    definitions, fields = c_definitions( registers )
+    counted = collections.Counter( name for name, value in definitions )
+    accessors = c_accessors( registers, fields, counted )
+    patterns = ( 0, 0xffffffffffffffff, 0x5555555555555555,
+            0xaaaaaaaaaaaaaaaa, 0x0123456789abcdef, 0xfedcba9876543210 )
+
+    fd.write( "#include <stdio.h>\n" )
+    fd.write( "#include <stdint.h>\n" )
+    fd.write( "#include \"%s\"\n\n" % header )
+    fd.write( "static int failures;\n\n" )
+    fd.write( "static void check(int ok, const char *what, uint64_t reg)\n" )
+    fd.write( "{\n" )
+    fd.write( "\tif (!ok) {\n" )
+    fd.write( "\t\tprintf(\"FAIL: %s with 0x%llx\\n\", what, "
+            "(unsigned long long) reg);\n" )
+    fd.write( "\t\tfailures++;\n" )
+    fd.write( "\t}\n" )
+    fd.write( "}\n\n" )
+    fd.write( "int main(void)\n" )
+    fd.write( "{\n" )
+    fd.write( "\tunsigned i;\n" )
+    fd.write( "\tconst uint64_t patterns[] = {%s};\n" % ", ".join(
+        "0x%xULL" % p for p in patterns ) )
+    fd.write( "\tfor (i = 0; i < %d; i++) {\n" % len( patterns ) )
+    for a in accessors:
+        t = a.type
+        for xlen in ( XLENS[:2] if a.parameters else ( None, ) ):
+            values = symbol_values( xlen ) if xlen else {}
+            values = dict( ( k.lower(), v ) for k, v in values.items() )
+            fullMask = 0
+            fd.write( "\t\t{\n" )
+            fd.write( "\t\t\t%s reg = (%s) patterns[i];\n" % ( t, t ) )
+            fd.write( "\t\t\tstruct %s fields;\n" % a.name )
+            usable = True
+            for f in a.fields:
+                offset = evaluate( f.offset, values )
+                length = evaluate( f.length, values )
+                width = 32 if t == "uint32_t" else 64
+                # The #defines use 1<<length, so can't be checked with fields
+                # of the full width.
+                if length <= 0 or length >= 64 or offset + length > width:
+                    usable = False
+                    continue
+                fullMask |= ( ( 1 << length ) - 1 ) << offset
+                arguments = "".join( ", %d" % values[ p ]
+                        for p in sorted( f.parameters() ) )
+                maskName, _, maskArguments = f.maskMacro.partition( "(" )
+                maskArguments = [ p.strip() for p in
+                        maskArguments.rstrip( ")" ).split( "," ) if p.strip() ]
+                if maskArguments:
+                    macroArguments = "(%s)" % ", ".join( "%d" % values[ p.lower() ]
+                            for p in maskArguments )
+                else:
+                    macroArguments = ""
+                mask = "((%s) %s%s)" % ( t, maskName, macroArguments )
+                offsetMacro = "%s_OFFSET%s" % ( f.macro, macroArguments
+                        if f.offset.atoms() else "" )
+                what = "%s%s" % ( f.function, " XLEN=%d" % xlen if xlen else "" )
+                fd.write( "\t\t\tcheck(%s_get(reg%s) == ((reg & %s) >> %s), "
+                        "\"%s_get\", reg);\n" % ( f.function, arguments, mask,
+                            offsetMacro, what ) )
+                fd.write( "\t\t\tcheck(%s_insert(reg, (%s) ~reg%s) == "
+                        "((reg & ~%s) | ((~reg << %s) & %s)), \"%s_insert\", "
+                        "reg);\n" % ( f.function, t, arguments, mask,
+                            offsetMacro, mask, what ) )
+                fd.write( "\t\t\t{\n" )
+                fd.write( "\t\t\t\t%s copy = reg;\n" % t )
+                fd.write( "\t\t\t\t%s_set(&copy, (%s) ~reg%s);\n" % (
+                    f.function, t, arguments ) )
+                fd.write( "\t\t\t\tcheck(copy == %s_insert(reg, (%s) ~reg%s), "
+                        "\"%s_set\", reg);\n" % ( f.function, t, arguments,
+                            what ) )
+                fd.write( "\t\t\t}\n" )
+            if usable:
+                arguments = "".join( ", %d" % values[ p ] for p in a.parameters )
+                fd.write( "\t\t\t%s_unpack(&fields, reg%s);\n" % ( a.name,
+                    arguments ) )
+                fd.write( "\t\t\tcheck(%s_pack(&fields%s) == (reg & %s), "
+                        "\"%s_pack\", reg);\n" % ( a.name, arguments,
+                            c_literal( fullMask, t ), a.name ) )
+            fd.write( "\t\t\t(void) reg;\n" )
+            fd.write( "\t\t\t(void) fields;\n" )
+            fd.write( "\t\t}\n" )
+    fd.write( "\t}\n" )
+    fd.write( "\tif (failures)\n" )
+    fd.write( "\t\treturn 1;\n" )
+    fd.write( "\tprintf(\"%s: all accessors OK\\n\");\n" % header )
+    fd.write( "\treturn 0;\n" )
+    fd.write( "}\n" )
 
 def write_chisel( fd, registers ):
+    write_chisel_header( fd, registers )
+
+    for r in registers.registers:
+        write_chisel_address( fd, registers, r )
+
+    fd.write("}\n\n")
+
+    for r in registers.registers:
+        write_chisel_fields( fd, registers, r )
+
+def write_chisel_header( fd, registers ):
     fd.write("package freechips.rocketchip.devices.debug\n\n")
     fd.write("import chisel3._\n\n")
 
@@ -368,61 +1575,251 @@ def write_chisel( fd, registers ):
 
     fd.write("object " + registers.prefix + "RegAddrs {\n")
 
-    for r in registers.registers:
-        name = toCIdentifier( r.short or r.label ).upper()
-        prefname = registers.prefix + name
-        if (r.define and r.address):
-            if r.description:
-                fd.write ("  /* " + r.description + "\n  */\n")
-            fd.write ("  def " + prefname + " =  "+ r.address + "\n\n")
-
-    fd.write("}\n\n")
+def write_chisel_address( fd, registers, r ):
+    prefname = registers.identifiers.c_register( r )
+    if (r.define and r.address):
+        if r.description:
+            fd.write ("  /* " + r.description + "\n  */\n")
+        fd.write ("  def " + prefname + " =  "+ r.address + "\n\n")
+
+def write_chisel_fields( fd, registers, r ):
+    name = registers.identifiers.c( r.short or r.label ).upper()
+
+    if (r.fields and r.define) :
+        sorted_fields = sorted(r.fields, key = lambda x: int(x.lowBit), reverse = True)
+        topbit = max(31, int(sorted_fields[0].highBit))
+        reserved = 0
+        fd.write("class " + name + "Fields extends Bundle {\n\n")
+        for f in sorted_fields:
+
+            # These need try-catch blocks in the general case,
+            # but for DM1 Registers it's fine.
+
+            fieldlength = int(f.length())
+            lowbit = int(f.lowBit)
+
+            newtopbit = lowbit + fieldlength - 1
+
+            if (newtopbit != topbit):
+                reservedwidth = topbit - newtopbit
+                fd.write("  val reserved%d = UInt(%d.W)\n\n" % (reserved, reservedwidth))
+                reserved = reserved + 1
+            if not f.define:
+                reservedwidth = fieldlength
+                fd.write("  val reserved%d = UInt(%d.W)\n\n" % (reserved, reservedwidth))
+                reserved = reserved + 1
+            else:
+                if f.description:
+                    fd.write("  /* " + f.description + "\n  */\n")
 
-    for r in registers.registers:
-        name = toCIdentifier( r.short or r.label ).upper()
-
-        if (r.fields and r.define) :
-            sorted_fields = sorted(r.fields, key = lambda x: int(x.lowBit), reverse = True)
-            topbit = 31
-            reserved = 0
-            fd.write("class " + name + "Fields extends Bundle {\n\n")
-            for f in sorted_fields:
-
-                # These need try-catch blocks in the general case,
-                # but for DM1 Registers it's fine.
-
-                fieldlength = int(f.length())
-                lowbit = int(f.lowBit)
-
-                newtopbit = lowbit + fieldlength - 1
-
-                if (newtopbit != topbit):
-                    reservedwidth = topbit - newtopbit
-                    print(reserved)
-                    print(reservedwidth)
-                    fd.write("  val reserved%d = UInt(%d.W)\n\n" % (reserved, reservedwidth))
-                    reserved = reserved + 1
-                if not f.define:
-                    reservedwidth = fieldlength
-                    fd.write("  val reserved%d = UInt(%d.W)\n\n" % (reserved, reservedwidth))
-                    reserved = reserved + 1
+                fd.write("  val " + registers.identifiers.c(f.name) + " = ")
+                if (int(fieldlength) > 1):
+                    fd.write("UInt(%d.W)\n\n" % fieldlength)
                 else:
-                    if f.description:
-                        fd.write("  /* " + f.description + "\n  */\n")
+                    fd.write("Bool()\n\n")
 
-                    fd.write("  val " + toCIdentifier(f.name) + " = ")
-                    if (int(fieldlength) > 1):
-                        fd.write("UInt(%d.W)\n\n" % fieldlength)
-                    else:
-                        fd.write("Bool()\n\n")
+            topbit = int(lowbit) - 1
 
-                topbit = int(lowbit) - 1
+        lastlowbit = int(sorted_fields[-1].lowBit)
+        if (lastlowbit > 0 ):
+            fd.write("  val reserved" + reserved + "= UInt(" + lastlowbit + ".W)\n")
 
-            lastlowbit = int(sorted_fields[-1].lowBit)
-            if (lastlowbit > 0 ):
-                fd.write("  val reserved" + reserved + "= UInt(" + lastlowbit + ".W)\n")
+        fd.write("}\n\n")
 
-            fd.write("}\n\n")
+class TableEntry( object ):
+    """Metadata about one register, for the address lookup tables."""
+    def __init__( self, register ):
+        self.register = register
+        self.address = address_value( register.address )
+        self.fields = []
+        self.reset = 0
+        self.resetMask = 0
+        readable = writable = False
+        for f in register.fields:
+            offset = f.lowBitValue
+            length = constant_value( f.length() )
+            self.fields.append(( f, offset, length ))
+            access = f.access or ""
+            readable |= "R" in access or access in ( "WARL", "1" )
+            writable |= "W" in access
+            if offset is None or length is None:
+                continue
+            try:
+                reset = int( f.reset, 0 )
+            except ( TypeError, ValueError ):
+                continue
+            self.reset |= reset << offset
+            self.resetMask |= ( ( 1 << length ) - 1 ) << offset
+        self.access = ( "R" if readable else "" ) + \
+                ( "/" if readable and writable else "" ) + \
+                ( "W" if writable else "" )
+
+def register_table( registers ):
+    """Return a TableEntry for every register in registers with a numeric
+    address, sorted by address. Registers that share an address (like the
+    different types of tdata1) stay in the order they were described in, so
+    the first one is the generic one."""
+    entries = [ TableEntry( r ) for r in registers.registers ]
+    entries = [ e for e in entries if isinstance( e.address, int ) ]
+    entries.sort( key=lambda e: e.address )
+    return entries
+
+# Address ranges up to this size get a direct lookup array, instead of having
+# to be searched.
+TABLE_INDEX_LIMIT = 4096
+
+def table_name( registers ):
+    return toCIdentifier( registers.prefix +
+            toCIdentifier( registers.name ) ).lower()
+
+def c_string( text ):
+    if text is None:
+        return "NULL"
+    return '"%s"' % text.replace( "\\", "\\\\" ).replace( '"', '\\"' )
+
+def write_ctable( fd, registers ):
+    """Write a C header with a table of every register in registers, sorted by
+    address, and NAME_lookup() to find the entry for an address in O(1) (or
+    O(log n) for sparse address ranges). Registers that share an address are
+    next to each other in the table, and NAME_lookup() returns the first of
+    them."""
+    name = table_name( registers )
+    entries = register_table( registers )
+
+    fd.write( "#ifndef RISCV_DEBUG_REGISTER_INFO\n" )
+    fd.write( "#define RISCV_DEBUG_REGISTER_INFO\n" )
+    fd.write( "#include <stddef.h>\n" )
+    fd.write( "#include <stdint.h>\n" )
+    fd.write( "struct riscv_debug_field_info {\n" )
+    fd.write( "\tconst char *name;\n" )
+    fd.write( "\t/* Bit positions as in the spec, e.g. \"XLEN-1:XLEN-4\". */\n" )
+    fd.write( "\tconst char *bits;\n" )
+    fd.write( "\t/* -1 if the position depends on XLEN etc. */\n" )
+    fd.write( "\tint offset;\n" )
+    fd.write( "\tint length;\n" )
+    fd.write( "\tconst char *access;\n" )
+    fd.write( "\tconst char *reset;\n" )
+    fd.write( "};\n" )
+    fd.write( "struct riscv_debug_register_info {\n" )
+    fd.write( "\tunsigned address;\n" )
+    fd.write( "\tconst char *name;\n" )
+    fd.write( "\tconst char *short_name;\n" )
+    fd.write( "\t/* \"R\", \"W\" or \"R/W\". */\n" )
+    fd.write( "\tconst char *access;\n" )
+    fd.write( "\t/* Reset value of the bits that are set in reset_mask. */\n" )
+    fd.write( "\tuint64_t reset;\n" )
+    fd.write( "\tuint64_t reset_mask;\n" )
+    fd.write( "\tconst struct riscv_debug_field_info *fields;\n" )
+    fd.write( "\tunsigned field_count;\n" )
+    fd.write( "};\n" )
+    fd.write( "#endif\n" )
+
+    for i, e in enumerate( entries ):
+        if not e.fields:
+            continue
+        fd.write( "static const struct riscv_debug_field_info %s_fields_%d[] = {\n" % (
+            name, i ) )
+        for f, offset, length in e.fields:
+            fd.write( "\t{%s, %s, %d, %d, %s, %s},\n" % ( c_string( f.name ),
+                c_string( "%s:%s" % ( f.highBit, f.lowBit ) ),
+                -1 if offset is None else offset,
+                -1 if length is None else length,
+                c_string( f.access ), c_string( f.reset ) ) )
+        fd.write( "};\n" )
+
+    fd.write( "static const struct riscv_debug_register_info %s_table[] = {\n" %
+            name )
+    for i, e in enumerate( entries ):
+        r = e.register
+        fd.write( "\t{0x%x, %s, %s, %s, 0x%xULL, 0x%xULL, %s, %d},\n" % (
+            e.address, c_string( r.name ), c_string( r.short ),
+            c_string( e.access ), e.reset, e.resetMask,
+            "%s_fields_%d" % ( name, i ) if e.fields else "NULL",
+            len( e.fields ) ) )
+    fd.write( "};\n" )
+    fd.write( "#define %s_COUNT %d\n" % ( name.upper(), len( entries ) ) )
+
+    fd.write( "static inline const struct riscv_debug_register_info *"
+            "%s_lookup(unsigned address)\n" % name )
+    fd.write( "{\n" )
+    if not entries:
+        fd.write( "\t(void) address;\n" )
+        fd.write( "\treturn NULL;\n" )
+        fd.write( "}\n" )
+        return
+    low = entries[ 0 ].address
+    high = entries[ -1 ].address
+    if high - low < TABLE_INDEX_LIMIT:
+        index = [ 0 ] * ( high - low + 1 )
+        for i, e in reversed( list( enumerate( entries ) ) ):
+            index[ e.address - low ] = i + 1
+        indexType = "uint8_t" if len( entries ) < 256 else "uint16_t"
+        fd.write( "\t/* Index into the table plus one, or 0 for no register. */\n" )
+        fd.write( "\tstatic const %s index[%d] = {" % ( indexType, len( index ) ) )
+        for i, value in enumerate( index ):
+            if i % 16 == 0:
+                fd.write( "\n\t\t" )
+            fd.write( "%d," % value )
+        fd.write( "\n\t};\n" )
+        if low:
+            fd.write( "\tif (address < 0x%x)\n" % low )
+            fd.write( "\t\treturn NULL;\n" )
+        fd.write( "\tif (address > 0x%x || !index[address - 0x%x])\n" % (
+            high, low ) )
+        fd.write( "\t\treturn NULL;\n" )
+        fd.write( "\treturn &%s_table[index[address - 0x%x] - 1];\n" % (
+            name, low ) )
+    else:
+        fd.write( "\tunsigned low = 0, high = %d;\n" % len( entries ) )
+        fd.write( "\twhile (low < high) {\n" )
+        fd.write( "\t\tunsigned middle = (low + high) / 2;\n" )
+        fd.write( "\t\tif (%s_table[middle].address < address)\n" % name )
+        fd.write( "\t\t\tlow = middle + 1;\n" )
+        fd.write( "\t\telse\n" )
+        fd.write( "\t\t\thigh = middle;\n" )
+        fd.write( "\t}\n" )
+        fd.write( "\tif (low < %d && %s_table[low].address == address)\n" % (
+            len( entries ), name ) )
+        fd.write( "\t\treturn &%s_table[low];\n" % name )
+        fd.write( "\treturn NULL;\n" )
+    fd.write( "}\n" )
+
+def write_pytable( fd, registers ):
+    """Write a self-contained Python module with a tuple of every register in
+    registers sorted by address, and lookup()/lookup_all() to find registers
+    by address through a dict."""
+    entries = register_table( registers )
+    fd.write( '"""Registers in %s, by address.\n\n' % registers.name )
+    fd.write( 'This file was generated by registers.py. Do not edit."""\n\n' )
+    fd.write( "import collections\n\n" )
+    fd.write( "Field = collections.namedtuple( 'Field', 'name bits offset length "
+            "access reset' )\n" )
+    fd.write( "Register = collections.namedtuple( 'Register', 'address name short "
+            "access reset reset_mask fields' )\n\n" )
+    fd.write( "# Sorted by address. offset and length are None for fields whose "
+            "position\n# depends on XLEN etc.\n" )
+    fd.write( "REGISTERS = (\n" )
+    for e in entries:
+        r = e.register
+        fd.write( "    Register( 0x%x, %r, %r, %r, 0x%x, 0x%x, (\n" % ( e.address,
+            r.name, r.short, e.access, e.reset, e.resetMask ) )
+        for f, offset, length in e.fields:
+            fd.write( "        Field( %r, %r, %r, %r, %r, %r ),\n" % ( f.name,
+                "%s:%s" % ( f.highBit, f.lowBit ), offset, length, f.access,
+                f.reset ) )
+        fd.write( "    ) ),\n" )
+    fd.write( ")\n\n" )
+    fd.write( "BY_ADDRESS = {}\n" )
+    fd.write( "for _register in REGISTERS:\n" )
+    fd.write( "    BY_ADDRESS.setdefault( _register.address, [] ).append( _register )\n" )
+    fd.write( "BY_ADDRESS = dict( ( a, tuple( r ) ) for a, r in BY_ADDRESS.items() )\n\n" )
+    fd.write( "def lookup( address ):\n" )
+    fd.write( '    """Return the (first) Register at address, or None."""\n' )
+    fd.write( "    registers = BY_ADDRESS.get( address )\n" )
+    fd.write( "    return registers[ 0 ] if registers else None\n\n" )
+    fd.write( "def lookup_all( address ):\n" )
+    fd.write( '    """Return a tuple of every Register at address."""\n' )
+    fd.write( "    return BY_ADDRESS.get( address, () )\n" )
 
 def address_value( address ):
     if type( address ) == str:
@@ -432,214 +1829,1098 @@ def address_value( address ):
             return address
     return address
 
-def compare_address(a, b):
-    try:
-        return int(sympy.simplify("%s-(%s)" % (a, b)))
-    except TypeError:
-        return cmp(a, b)
+def address_key( address ):
+    """Sort key for register addresses: numeric addresses in numeric order,
+    then symbolic ones (like "virtual") by name, then registers without an
+    address."""
+    value = address_value( address )
+    if isinstance( value, int ):
+        return ( 0, value, "" )
+    if value is None:
+        return ( 2, 0, "" )
+    return ( 1, 0, str( value ) )
+
+class AddressMap( object ):
+    """Index of the addresses used by one or more register files that share an
+    address space (like core_registers.xml and hwbp_registers.xml, which both
+    describe CSRs). Addresses are sorted once, and consecutive ones are merged
+    into intervals, from which the free ranges follow."""
+    def __init__( self, files ):
+        # ( address, registers, register ) sorted by address. Registers at the
+        # same address stay in the order they were listed.
+        self.entries = []
+        # Registers with an address that isn't a number.
+        self.symbolic = []
+        for registers in files:
+            for r in registers.registers:
+                value = address_value( r.address )
+                if isinstance( value, int ):
+                    self.entries.append( ( value, registers, r ) )
+                elif value is not None:
+                    self.symbolic.append( ( value, registers, r ) )
+        self.entries.sort( key=lambda e: e[0] )
+        self.addresses = [ e[0] for e in self.entries ]
+
+        # Sorted, disjoint [ low, high ] intervals of used addresses.
+        self.intervals = []
+        for address in self.addresses:
+            if self.intervals and address <= self.intervals[-1][1] + 1:
+                self.intervals[-1][1] = max( self.intervals[-1][1], address )
+            else:
+                self.intervals.append( [ address, address ] )
+
+    def lookup( self, address ):
+        """Return [ ( registers, register ) ] of everything at address."""
+        start = bisect.bisect_left( self.addresses, address )
+        end = bisect.bisect_right( self.addresses, address, start )
+        return [ ( registers, r ) for a, registers, r in
+                self.entries[ start:end ] ]
+
+    def used( self ):
+        """Return [ ( low, high ) ] of every range of used addresses."""
+        return [ tuple( i ) for i in self.intervals ]
+
+    def shared( self ):
+        """Return [ ( address, [ ( registers, register ) ] ) ] of every
+        address that more than one register uses."""
+        result = []
+        for address, group in itertools.groupby( self.entries,
+                key=lambda e: e[0] ):
+            group = [ ( registers, r ) for a, registers, r in group ]
+            if len( group ) > 1:
+                result.append( ( address, group ) )
+        return result
+
+    def conflicts( self ):
+        """Return the shared() addresses that are used by more than one
+        register file. Registers in the same file that share an address (like
+        the tdata1 types) do so on purpose."""
+        return [ ( address, group ) for address, group in self.shared()
+                if len( set( id( registers ) for registers, r in group ) ) > 1 ]
+
+    def free( self, low=0, high=None ):
+        """Return [ ( low, high ) ] of every range of unused addresses between
+        low and high (inclusive), which defaults to the highest used
+        address."""
+        if high is None:
+            high = self.intervals[-1][1] if self.intervals else low - 1
+        result = []
+        start = bisect.bisect_left( self.intervals, [ low, low ] )
+        if start and self.intervals[ start - 1 ][1] >= low:
+            low = self.intervals[ start - 1 ][1] + 1
+        for usedLow, usedHigh in self.intervals[ start: ]:
+            if usedLow > high:
+                break
+            if usedLow > low:
+                result.append( ( low, usedLow - 1 ) )
+            low = max( low, usedHigh + 1 )
+        if low <= high:
+            result.append( ( low, high ) )
+        return result
 
-def print_latex_index( registers ):
-    print(registers.description)
+def address_spaces( files ):
+    """Group files (Registers) into address spaces. Files with the same
+    prefix (like CSR_ for the core and trigger registers) or the same name
+    (like the Debug Module Debug Bus Registers, in dm_registers.xml with DM_
+    and in serial.xml with DMI_) describe the same address space. Return
+    [ ( files, AddressMap ) ] in the order the spaces are first seen."""
+    groups = []
+    for registers in files:
+        matching = [ i for i, group in enumerate( groups ) if any(
+            registers.prefix == other.prefix or registers.name == other.name
+            for other in group ) ]
+        if not matching:
+            groups.append( [ registers ] )
+            continue
+        # A file can join two spaces that were separate until now.
+        first = groups[ matching[0] ]
+        for i in reversed( matching[1:] ):
+            first.extend( groups.pop( i ) )
+        first.append( registers )
+    return [ ( group, AddressMap( group ) ) for group in groups ]
+
+def format_range( low, high ):
+    if low == high:
+        return "0x%x" % low
+    return "0x%x-0x%x" % ( low, high )
+
+def write_address_map( fd, files, limit=None, overlays=() ):
+    """Write the address map of every address space in files to fd. Return
+    the number of addresses that are used by more than one file.
+
+    overlays are files (also in files) that describe registers which may
+    take the place of those in another file, like the serial ports in
+    serial.xml, which are a proposal that reuses Debug Module addresses.
+    Where one of them shares an address with a single other file, it is
+    listed as an overlay rather than a conflict."""
+    overlayIds = set( id( registers ) for registers in overlays )
+    conflicts = 0
+    for group, addressMap in address_spaces( files ):
+        prefixes = collections.OrderedDict.fromkeys(
+                registers.prefix or "no prefix" for registers in group )
+        names = collections.OrderedDict.fromkeys(
+                registers.name for registers in group )
+        fd.write( "%s (%s):\n" % ( ", ".join( prefixes ),
+            ", ".join( names ) ) )
+        fd.write( "  used: %s\n" % ( " ".join( format_range( low, high )
+            for low, high in addressMap.used() ) or "none" ) )
+        for address, group in addressMap.shared():
+            names = ", ".join( r.short or r.name for registers, r in group )
+            owners = set( id( registers ) for registers, r in group )
+            if len( owners - overlayIds ) > 1 or \
+                    len( owners & overlayIds ) > 1:
+                fd.write( "  conflict at 0x%x: %s\n" % ( address, names ) )
+                conflicts += 1
+            elif len( owners ) > 1:
+                fd.write( "  overlay at 0x%x: %s\n" % ( address, names ) )
+            else:
+                fd.write( "  shared at 0x%x: %s\n" % ( address, names ) )
+        high = None
+        if limit is not None:
+            high = limit - 1
+        free = addressMap.free( 0, high )
+        if free:
+            fd.write( "  free: %s\n" % " ".join( format_range( low, high )
+                for low, high in free ) )
+        for address, registers, r in addressMap.symbolic:
+            fd.write( "  symbolic: %s at %s\n" % ( r.short or r.name,
+                address ) )
+    return conflicts
+
+def print_latex_index( fd, registers ):
+    write_latex_index( fd, registers,
+            [ latex_index_row( registers, r ) for r in registers.registers ],
+            any(r.sdesc for r in registers.registers) )
+
+def latex_index_row( registers, r ):
+    """Return the address of r, and its row in the index table."""
+    if r.short and (r.fields or r.description):
+        page = "\\pageref{%s}" % registers.identifiers.latex(r.short)
+    else:
+        page = ""
+    if r.short:
+        name = "%s ({\\tt %s})" % (r.name, r.short)
+    else:
+        name = r.name
+    if r.sdesc:
+        return r.address, "%s & %s & %s & %s \\\\" % ( r.address, name, r.sdesc, page )
+    else:
+        return r.address, "%s & %s & %s \\\\" % ( r.address, name, page )
+
+def write_latex_index( fd, registers, rows, sdesc ):
+    """Write the index table, given the latex_index_row() of every register
+    and whether any of them has an sdesc."""
+    print(registers.description, file=fd)
 
     columns = [
         ("Address", "r"),
         ("Name", "l")]
-    if any(r.sdesc for r in registers.registers):
+    if sdesc:
         columns.append(("Description", "l"))
     columns.append(("Page", "l"))
 
     # Force this table HERE so that it doesn't get moved into the next section,
     # which will be the description of a register.
-    print("   \\begin{longtable}{|%s|}" % "|".join(b for a, b in columns))
+    print("   \\begin{longtable}{|%s|}" % "|".join(b for a, b in columns), file=fd)
     print("      \\caption{%s \\label{%s}}\\\\" %
-            (registers.name, toLatexIdentifier(registers.prefix, registers.label)))
-    print("      \\hline")
-    print("      %s \\\\" % (" & ".join(a for a, b in columns)))
-    print("      \\hline")
-    print("      \\endhead")
+            (registers.name, registers.identifiers.latex(registers.label)), file=fd)
+    print("      \\hline", file=fd)
+    print("      %s \\\\" % (" & ".join(a for a, b in columns)), file=fd)
+    print("      \\hline", file=fd)
+    print("      \\endhead", file=fd)
 
     print("      \\multicolumn{%d}{r}{\\textit{Continued on next page}} \\\\" %
-            len(columns))
-    print("      \\endfoot")
-    print("      \\endlastfoot")
-    for r in sorted( registers.registers,
-            key=cmp_to_key(lambda a, b: compare_address(a.address, b.address))):
-        if r.short and (r.fields or r.description):
-            page = "\\pageref{%s}" % toLatexIdentifier(registers.prefix, r.short)
-        else:
-            page = ""
-        if r.short:
-            name = "%s ({\\tt %s})" % (r.name, r.short)
+            len(columns), file=fd)
+    print("      \\endfoot", file=fd)
+    print("      \\endlastfoot", file=fd)
+    for address, row in sorted( rows, key=lambda row: address_key( row[0] ) ):
+        print(row, file=fd)
+    print("         \hline", file=fd)
+    print("   \end{longtable}", file=fd)
+
+def print_latex_custom( fd, registers ):
+    for r in registers.registers:
+        print_latex_custom_register( fd, registers, r )
+
+def print_latex_custom_register( fd, registers, r ):
+    if not r.fields and not r.description:
+        return
+
+    sub = "sub" * registers.depth
+    if r.short:
+        if r.address:
+            print("\\%ssection{%s ({\\tt %s}, at %s)}" % ( sub, r.name,
+                    r.short, r.address ), file=fd)
         else:
-            name = r.name
-        if r.sdesc:
-            print("%s & %s & %s & %s \\\\" % ( r.address, name, r.sdesc, page ))
+            print("\\%ssection{%s ({\\tt %s})}" % ( sub, r.name, r.short ), file=fd)
+        print("\index{%s}" % r.short, file=fd)
+    else:
+        if r.address:
+            print("\\%ssection{%s (at %s)}" % ( sub, r.name, r.address ), file=fd)
         else:
-            print("%s & %s & %s \\\\" % ( r.address, name, page ))
-    print("         \hline")
-    print("   \end{longtable}")
+            print("\\%ssection{%s}" % ( sub, r.name ), file=fd)
+        print("\index{%s}" % r.name, file=fd)
+    if r.label and r.define:
+        print("\\label{%s}" % registers.identifiers.latex(r.label), file=fd)
+    print(r.description, file=fd)
+    print(file=fd)
+
+    if r.fields:
+        if registers.prefix == "CSR_":
+            if int(r.address, 0) >= 0xc00:
+                print("This CSR is read-only.", file=fd)
+            elif all(f.access in ('R', '0') for f in r.fields):
+                print("Writing this read/write CSR has no effect.", file=fd)
+            else:
+                print("This CSR is read/write.", file=fd)
+        elif all(f.access in ('R', '0') for f in r.fields):
+            print("This entire register is read-only.", file=fd)
+
+        print("\\begin{center}", file=fd)
+
+        totalWidth = sum( ( 3 + f.columnWidth() ) for f in r.fields )
+        split = int( math.ceil( totalWidth / 80. ) )
+        fieldsPerSplit = int( math.ceil( float( len( r.fields ) ) / split ) )
+        subRegisterFields = []
+        for s in range( split ):
+            subRegisterFields.append( r.fields[ s*fieldsPerSplit : (s+1)*fieldsPerSplit ] )
+
+        for registerFields in subRegisterFields:
+            tabularCols = ""
+            for f in registerFields:
+                fieldLength = str( f.length() )
+                lowLen = float( len( f.lowBit ) )
+                highLen = float( len( f.highBit ) )
+                tabularCols += "p{%.1f ex}" % ( f.columnWidth() * highLen / ( lowLen + highLen ) )
+                tabularCols += "p{%.1f ex}" % ( f.columnWidth() * lowLen / ( lowLen + highLen ) )
+            print("\\begin{tabular}{%s}" % tabularCols, file=fd)
+
+            first = True
+            for f in registerFields:
+                if not first:
+                    print("&", file=fd)
+                first = False
+                if f.highBit == f.lowBit:
+                    print("\\multicolumn{2}{c}{\\scriptsize %s}" % f.highBit, file=fd)
+                else:
+                    print("{\\scriptsize %s} &" % f.highBit, file=fd)
+                    print("\\multicolumn{1}{r}{\\scriptsize %s}" % f.lowBit, file=fd)
+
+            # The actual field names
+            print("\\\\", file=fd)
+            print("         \hline", file=fd)
+            first = True
+            for f in registerFields:
+                if first:
+                    cols = "|c|"
+                else:
+                    cols = "c|"
+                    print("&", file=fd)
+                first = False
+                print("\\multicolumn{2}{%s}{$|%s|$}" % ( cols, f.name ), file=fd)
+            print("\\\\", file=fd)
+            print("         \hline", file=fd)
+
+            # Size of each field in bits
+            print(" & ".join( "\\multicolumn{2}{c}{\\scriptsize %s}" % f.length() for f in registerFields ), file=fd)
+            print("\\\\", file=fd)
+
+            print("   \\end{tabular}", file=fd)
+
+        print("\\end{center}", file=fd)
+
+    columns = [("l", "Field", lambda f: f.name)]
+    columns += [("p{0.5\\textwidth}", "Description", lambda f: f.latex_description())]
+    if not registers.skip_access:
+        columns += [("c", "Access", lambda f: f.access)]
+    if not registers.skip_reset:
+        columns += [("l", "Reset", lambda f: f.reset)]
+
+    if any( f.description for f in r.fields ):
+        print("\\tabletail{\\hline \\multicolumn{%d}{|r|}" % len(columns), file=fd)
+        print("   {{Continued on next page}} \\\\ \\hline}", file=fd)
+        print("   \\begin{longtable}{|%s|}" % "|".join(c[0] for c in columns), file=fd)
+
+        print("   \\hline", file=fd)
+        print("   %s\\\\" % " & ".join(c[1] for c in columns), file=fd)
+        print("   \\hline", file=fd)
+        print("   \\endhead", file=fd)
+
+        print("   \\multicolumn{%d}{r}{\\textit{Continued on next page}} \\\\" % \
+                len(columns), file=fd)
+        print("   \\endfoot", file=fd)
+        print("   \\endlastfoot", file=fd)
 
-def print_latex_custom( registers ):
-    sub = "sub" * registers.depth
+        for f in r.fields:
+            if f.description or f.values:
+                print("\\label{%s}" % registers.identifiers.latex(r.short or r.label, f.name), file=fd)
+                print("\\index{%s}" % f.name, file=fd)
+                print("   |%s| &" % str(columns[0][2](f)), end=' ', file=fd)
+                print("%s\\\\" % " & ".join(str(c[2](f)) for c in columns[1:]), file=fd)
+                print("   \\hline", file=fd)
+
+        print("   \\end{longtable}", file=fd)
+    print(file=fd)
+
+def latex_symbols( registers ):
+    """Return a list of ( kind, name, register, field, target ) for every
+    LaTeX macro (kind "macro", without the backslash) and label ("label")
+    that write_definitions(), print_latex_index() and print_latex_custom()
+    define for registers, and every label they refer to ("reference").
+    target is the label that a macro links to. register and field are None
+    where they don't apply."""
+    identifiers = registers.identifiers
+    symbols = []
+    if not registers.skip_index:
+        symbols.append(( "label", identifiers.latex( registers.label ), None,
+            None, None ))
     for r in registers.registers:
+        regid = r.short or r.label
+        if r.define:
+            symbols.append(( "macro", "R" + identifiers.latex( regid ), r,
+                None, identifiers.latex( r.label ) ))
+        for f in r.fields:
+            if f.define:
+                name = identifiers.latex( regid, f.name )
+                symbols.append(( "macro", "F" + name, r, f, name ))
+
         if not r.fields and not r.description:
             continue
-
-        if r.short:
-            if r.address:
-                print("\\%ssection{%s ({\\tt %s}, at %s)}" % ( sub, r.name,
-                        r.short, r.address ))
-            else:
-                print("\\%ssection{%s ({\\tt %s})}" % ( sub, r.name, r.short ))
-            print("\index{%s}" % r.short)
-        else:
-            if r.address:
-                print("\\%ssection{%s (at %s)}" % ( sub, r.name, r.address ))
-            else:
-                print("\\%ssection{%s}" % ( sub, r.name ))
-            print("\index{%s}" % r.name)
+        if r.short and not registers.skip_index:
+            symbols.append(( "reference", identifiers.latex( r.short ), r,
+                None, None ))
         if r.label and r.define:
-            print("\\label{%s}" % toLatexIdentifier(registers.prefix, r.label))
-        print(r.description)
-        print()
-
-        if r.fields:
-            if registers.prefix == "CSR_":
-                if int(r.address, 0) >= 0xc00:
-                    print("This CSR is read-only.")
-                elif all(f.access in ('R', '0') for f in r.fields):
-                    print("Writing this read/write CSR has no effect.")
-                else:
-                    print("This CSR is read/write.")
-            elif all(f.access in ('R', '0') for f in r.fields):
-                print("This entire register is read-only.")
-
-            print("\\begin{center}")
-
-            totalWidth = sum( ( 3 + f.columnWidth() ) for f in r.fields )
-            split = int( math.ceil( totalWidth / 80. ) )
-            fieldsPerSplit = int( math.ceil( float( len( r.fields ) ) / split ) )
-            subRegisterFields = []
-            for s in range( split ):
-                subRegisterFields.append( r.fields[ s*fieldsPerSplit : (s+1)*fieldsPerSplit ] )
-
-            for registerFields in subRegisterFields:
-                tabularCols = ""
-                for f in registerFields:
-                    fieldLength = str( f.length() )
-                    lowLen = float( len( f.lowBit ) )
-                    highLen = float( len( f.highBit ) )
-                    tabularCols += "p{%.1f ex}" % ( f.columnWidth() * highLen / ( lowLen + highLen ) )
-                    tabularCols += "p{%.1f ex}" % ( f.columnWidth() * lowLen / ( lowLen + highLen ) )
-                print("\\begin{tabular}{%s}" % tabularCols)
-
-                first = True
-                for f in registerFields:
-                    if not first:
-                        print("&")
-                    first = False
-                    if f.highBit == f.lowBit:
-                        print("\\multicolumn{2}{c}{\\scriptsize %s}" % f.highBit)
-                    else:
-                        print("{\\scriptsize %s} &" % f.highBit)
-                        print("\\multicolumn{1}{r}{\\scriptsize %s}" % f.lowBit)
-
-                # The actual field names
-                print("\\\\")
-                print("         \hline")
-                first = True
-                for f in registerFields:
-                    if first:
-                        cols = "|c|"
-                    else:
-                        cols = "c|"
-                        print("&")
-                    first = False
-                    print("\\multicolumn{2}{%s}{$|%s|$}" % ( cols, f.name ))
-                print("\\\\")
-                print("         \hline")
-
-                # Size of each field in bits
-                print(" & ".join( "\\multicolumn{2}{c}{\\scriptsize %s}" % f.length() for f in registerFields ))
-                print("\\\\")
-
-                print("   \\end{tabular}")
-
-            print("\\end{center}")
-
-        columns = [("l", "Field", lambda f: f.name)]
-        columns += [("p{0.5\\textwidth}", "Description", lambda f: f.latex_description())]
-        if not registers.skip_access:
-            columns += [("c", "Access", lambda f: f.access)]
-        if not registers.skip_reset:
-            columns += [("l", "Reset", lambda f: f.reset)]
-
+            symbols.append(( "label", identifiers.latex( r.label ), r, None,
+                None ))
         if any( f.description for f in r.fields ):
-            print("\\tabletail{\\hline \\multicolumn{%d}{|r|}" % len(columns))
-            print("   {{Continued on next page}} \\\\ \\hline}")
-            print("   \\begin{longtable}{|%s|}" % "|".join(c[0] for c in columns))
-
-            print("   \\hline")
-            print("   %s\\\\" % " & ".join(c[1] for c in columns))
-            print("   \\hline")
-            print("   \\endhead")
-
-            print("   \\multicolumn{%d}{r}{\\textit{Continued on next page}} \\\\" % \
-                    len(columns))
-            print("   \\endfoot")
-            print("   \\endlastfoot")
-
             for f in r.fields:
                 if f.description or f.values:
-                    print("\\label{%s}" % toLatexIdentifier(registers.prefix, r.short or r.label, f.name))
-                    print("\\index{%s}" % f.name)
-                    print("   |%s| &" % str(columns[0][2](f)), end=' ')
-                    print("%s\\\\" % " & ".join(str(c[2](f)) for c in columns[1:]))
-                    print("   \\hline")
+                    symbols.append(( "label", identifiers.latex( regid,
+                        f.name ), r, f, None ))
+    return symbols
 
-            print("   \\end{longtable}")
-        print()
-
-def print_latex_register( registers ):
-    print("%\\usepackage{register}")
+def print_latex_register( fd, registers ):
+    print("%\\usepackage{register}", file=fd)
     sub = "sub" * registers.depth
     for r in registers.registers:
         if not r.fields and not r.description:
             continue
 
         if r.short:
-            print("\\%ssection{%s (%s)}" % ( sub, r.name, r.short ))
+            print("\\%ssection{%s (%s)}" % ( sub, r.name, r.short ), file=fd)
         else:
-            print("\\%ssection{%s}" % ( sub, r.name ))
-        print(r.description)
+            print("\\%ssection{%s}" % ( sub, r.name ), file=fd)
+        print(r.description, file=fd)
 
         if not r.fields:
             continue
-        print("\\begin{register}{H}{%s}{%s}" % ( r.name, r.address ))
-        print("   \\label{reg:%s}{}" % r.label)
+        print("\\begin{register}{H}{%s}{%s}" % ( r.name, r.address ), file=fd)
+        print("   \\label{reg:%s}{}" % r.label, file=fd)
         for f in r.fields:
             length = f.length()
             if length is None:
                 # If we don't know the length, draw it as 10 bits.
                 length = 10
             print("   \\regfield{%s}{%d}{%s}{{%s}}" % (
-                    f.name, length, f.lowBit, f.reset ))
+                    f.name, length, f.lowBit, f.reset ), file=fd)
 
-        print("   \\begin{regdesc}")
-        print("      \\begin{reglist}")
+        print("   \\begin{regdesc}", file=fd)
+        print("      \\begin{reglist}", file=fd)
         for f in r.fields:
             if f.description:
                 print("      \\item[%s] (%s) %s" % ( f.name, f.access,
-                        f.description ))
-        print("      \\end{reglist}")
-        print("   \\end{regdesc}")
+                        f.description ), file=fd)
+        print("      \\end{reglist}", file=fd)
+        print("   \\end{regdesc}", file=fd)
+
+        print("\\end{register}", file=fd)
+        print(file=fd)
 
-        print("\\end{register}")
-        print()
+def debug_defines_header():
+    """Return the comment that starts debug_defines.h."""
+    import subprocess
+    try:
+        revision = subprocess.run(
+                [ "git", "log", "-1", "--format=format:%h" ],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True ).stdout
+    except OSError:
+        revision = ""
+    return "".join( line + "\n" for line in (
+        "/*",
+        " * This file is auto-generated by running 'make debug_defines.h' in",
+        " * https://github.com/riscv/riscv-debug-spec/ (%s)" % revision,
+        " * License: Creative Commons Attribution 4.0 International Public License (CC BY 4.0)",
+        " */",
+        "" ) )
+
+class Output( object ):
+    """Sink for one generated artifact. Backends write() to it (directly or
+    through print( ..., file=fd )) and the text is only written out, in one
+    go, by save() or by whoever called getvalue()."""
+    def __init__( self ):
+        self.parts = []
+
+    def write( self, text ):
+        self.parts.append( text )
+
+    def getvalue( self ):
+        return "".join( self.parts )
+
+    def save( self, path ):
+        return write_if_changed( path, self.getvalue() )
+
+def write_if_changed( path, text ):
+    """Write text to path, unless path already contains exactly that. This
+    keeps the mtime of unchanged outputs, so make doesn't rebuild everything
+    that depends on them.
+
+    The text is written to a temporary file which is then renamed over path,
+    so path never contains a partial output."""
+    try:
+        with open( path ) as fd:
+            if fd.read() == text:
+                return False
+    except OSError:
+        pass
+    temporary = "%s.%d.tmp" % ( path, os.getpid() )
+    try:
+        with open( temporary, "w" ) as fd:
+            fd.write( text )
+        os.replace( temporary, path )
+    except BaseException:
+        if os.path.exists( temporary ):
+            os.remove( temporary )
+        raise
+    return True
+
+class FileOutput( object ):
+    """Like Output, but the text goes straight to a temporary file next to
+    path instead of being kept in memory. save() renames it over path, unless
+    path already contains exactly the same thing."""
+    def __init__( self, path ):
+        self.path = path
+        self.temporary = "%s.%d.tmp" % ( path, os.getpid() )
+        self.fd = open( self.temporary, "w" )
+
+    def write( self, text ):
+        self.fd.write( text )
+
+    def save( self ):
+        import filecmp
+        self.fd.close()
+        if os.path.exists( self.path ) and \
+                filecmp.cmp( self.temporary, self.path, shallow=False ):
+            os.remove( self.temporary )
+            return False
+        os.replace( self.temporary, self.path )
+        return True
+
+    def discard( self ):
+        self.fd.close()
+        os.remove( self.temporary )
+
+class Spool( object ):
+    """Text that is written in pieces and then read back once, which is kept
+    in a temporary file once it gets big."""
+    def __init__( self ):
+        import tempfile
+        self.fd = tempfile.SpooledTemporaryFile( 1 << 20, mode="w+" )
+
+    def write( self, text ):
+        self.fd.write( text )
+
+    def copy( self, fd ):
+        self.fd.seek( 0 )
+        while True:
+            text = self.fd.read( 1 << 16 )
+            if not text:
+                break
+            fd.write( text )
+
+    def lines( self ):
+        self.fd.seek( 0 )
+        return iter( self.fd )
+
+def stream_file( path, definitions=None, cheader=None, chisel=None,
+        latex=None, custom=False ):
+    """Read path with stream_xml(), and write the same outputs that
+    write_definitions(), write_cheader() (without accessors) and
+    write_chisel() would to the files named definitions, cheader and chisel,
+    and print_latex_index()/print_latex_custom() (if custom is set) to the
+    file object latex. Each register is handled as soon as it has been
+    parsed and then forgotten. The parts of the outputs that can only be
+    written once every register has been seen are kept in Spools."""
+    registers, iterator = stream_xml( path )
+    files = []
+    if definitions:
+        definitionsFd = FileOutput( definitions )
+        files.append( definitionsFd )
+    if cheader:
+        cheaderFd = FileOutput( cheader )
+        files.append( cheaderFd )
+        # Names that are defined more than once are left out of the header,
+        # so every definition is spooled until the end.
+        cheaderSpool = Spool()
+        counted = collections.Counter()
+    if chisel:
+        chiselFd = FileOutput( chisel )
+        files.append( chiselFd )
+        chiselSpool = Spool()
+        write_chisel_header( chiselFd, registers )
+    if latex:
+        rows = []
+        sdesc = False
+        customSpool = Spool()
+
+    try:
+        for r in iterator:
+            if definitions:
+                write_register_definitions( definitionsFd, registers, r )
+            if cheader:
+                pairs = []
+                c_register_definitions( registers, r, pairs, [] )
+                for name, value in pairs:
+                    counted[ name ] += 1
+                    cheaderSpool.write( json.dumps(
+                        [ name, c_define( name, value ) ] ) + "\n" )
+            if chisel:
+                write_chisel_address( chiselFd, registers, r )
+                write_chisel_fields( chiselSpool, registers, r )
+            if latex:
+                rows.append( latex_index_row( registers, r ) )
+                sdesc = sdesc or bool( r.sdesc )
+                if custom:
+                    print_latex_custom_register( customSpool, registers, r )
+
+        if cheader:
+            for line in cheaderSpool.lines():
+                name, text = json.loads( line )
+                if name == "comment" or counted[ name ] == 1:
+                    cheaderFd.write( text )
+        if chisel:
+            chiselFd.write( "}\n\n" )
+            chiselSpool.copy( chiselFd )
+    except BaseException:
+        for fd in files:
+            fd.discard()
+        raise
+    for fd in files:
+        fd.save()
+
+    if latex:
+        if not registers.skip_index:
+            write_latex_index( latex, registers, rows, sdesc )
+        customSpool.copy( latex )
+
+def render_file( registers, withChisel, accessors=False ):
+    """Return a dictionary mapping file name suffix (e.g. ".tex") to the
+    contents of that output for registers, exactly as the per-file invocations
+    in the Makefile would produce them."""
+    outputs = {}
+
+    with profile_span( "write_definitions" ):
+        fd = Output()
+        write_definitions( fd, registers )
+        outputs[ ".tex.inc" ] = fd.getvalue()
+
+    with profile_span( "write_cheader" ):
+        fd = Output()
+        write_cheader( fd, registers, accessors )
+        outputs[ ".h" ] = fd.getvalue()
+
+    if withChisel:
+        with profile_span( "write_chisel" ):
+            fd = Output()
+            write_chisel( fd, registers )
+            outputs[ ".scala" ] = fd.getvalue()
+
+    with profile_span( "write_latex" ):
+        fd = Output()
+        if not registers.skip_index:
+            print_latex_index( fd, registers )
+        print_latex_custom( fd, registers )
+        outputs[ ".tex" ] = fd.getvalue()
+
+    return outputs
+
+def capture( function, *args ):
+    """Return what function( fd, *args ) writes to fd."""
+    fd = Output()
+    function( fd, *args )
+    return fd.getvalue()
+
+def c_register_text( registers, r, defined ):
+    """Return the names that c_register_definitions() returns for r, and the
+    text that write_cheader() writes for them, given the set of names that
+    are defined in the header (the others are defined more than once)."""
+    definitions = []
+    c_register_definitions( registers, r, definitions, [] )
+    return [ name for name, value in definitions ], "".join(
+            c_define( name, value ) for name, value in definitions
+            if name == "comment" or name in defined )
+
+def c_accessor_text( registers, r, defined ):
+    """Return the accessors that write_cheader( accessors=True ) writes for
+    r, given the same defined as c_register_text()."""
+    fields = []
+    c_register_definitions( registers, r, [], fields )
+    return "".join( capture( write_caccessor, a ) for a in
+            c_accessors( registers, fields, collections.Counter( defined ) ) )
+
+def splice( text, replacements ):
+    """Return text with each ( old, new ) of replacements replaced, where
+    every old occurs in text exactly once, after the previous one. Return None
+    if one of them can't be found, or is found more than once (like the text
+    of a register that is listed twice)."""
+    result = []
+    position = 0
+    for old, new in replacements:
+        if old == new:
+            continue
+        found = text.find( old, position ) if old else -1
+        if found < 0 or text.count( old ) != 1:
+            return None
+        result.append( text[ position:found ] )
+        result.append( new )
+        position = found + len( old )
+    result.append( text[ position: ] )
+    return "".join( result )
+
+C_DEFINE_NAME = re.compile( r"^#define (\S+)", re.M )
+
+def render_incremental( old, new, previous, withChisel, accessors=False ):
+    """Return what render_file( new, withChisel, accessors ) would, given
+    previous, which render_file() returned for old. Only the registers that
+    changed between old and new are rendered again, and their parts of the
+    outputs are spliced into previous.
+
+    Return None if that isn't possible, and everything has to be rendered:
+    when registers were added, removed or reordered, when the file's own
+    attributes changed, when a register's C names changed (the header leaves
+    out names that are defined twice anywhere in the file), when a changed
+    register's accessors have the same name as another register's (only the
+    first one gets them), or when a part can't be found in previous."""
+    changes = diff_registers( old, new )
+    changed = set()
+    for change in changes:
+        if len( change.where ) == 0 or ( len( change.where ) == 1 and
+                change.what in ( "added", "removed" ) ):
+            return None
+        changed.add( change.register() )
+    oldRegisters = keyed( old.registers, register_key )
+    newRegisters = keyed( new.registers, register_key )
+    pairs = [ ( oldRegisters[ k ], r ) for k, r in newRegisters.items()
+            if k in changed ]
+
+    with profile_span( "render_incremental" ):
+        defined = set( C_DEFINE_NAME.findall( previous[ ".h" ] ) )
+        header = []
+        for a, b in pairs:
+            oldNames, oldText = c_register_text( old, a, defined )
+            newNames, newText = c_register_text( new, b, defined )
+            # Only how often each name is defined matters, not the order.
+            if sorted( oldNames ) != sorted( newNames ):
+                return None
+            header.append( ( oldText, newText ) )
+        if accessors:
+            # The accessors come after all the #defines.
+            for registers, r in [ ( old, a ) for a, b in pairs ] + \
+                    [ ( new, b ) for a, b in pairs ]:
+                name = registers.identifiers.c_register( r )
+                if [ registers.identifiers.c_register( other )
+                        for other in registers.registers ].count( name ) > 1:
+                    return None
+            header += [ ( c_accessor_text( old, a, defined ),
+                c_accessor_text( new, b, defined ) ) for a, b in pairs ]
+
+        def index( registers ):
+            if registers.skip_index:
+                return ""
+            return capture( print_latex_index, registers )
+        latex = [ ( index( old ), index( new ) ) ]
+        latex += [ ( capture( print_latex_custom_register, old, a ),
+            capture( print_latex_custom_register, new, b ) )
+            for a, b in pairs ]
+
+        definitions = [ ( capture( write_register_definitions, old, a ),
+            capture( write_register_definitions, new, b ) )
+            for a, b in pairs ]
+
+        outputs = {
+            ".tex.inc": splice( previous[ ".tex.inc" ], definitions ),
+            ".h": splice( previous[ ".h" ], header )
+        }
+        if withChisel:
+            # The addresses of all the registers come before their fields.
+            chisel = [ ( capture( write_chisel_address, old, a ),
+                capture( write_chisel_address, new, b ) ) for a, b in pairs ]
+            chisel += [ ( capture( write_chisel_fields, old, a ),
+                capture( write_chisel_fields, new, b ) ) for a, b in pairs ]
+            outputs[ ".scala" ] = splice( previous[ ".scala" ], chisel )
+        outputs[ ".tex" ] = splice( previous[ ".tex" ], latex )
+    if None in outputs.values():
+        return None
+    return outputs
+
+@lru_cache( maxsize=None )
+def generator_version():
+    """Return a hash of this script, so that cached outputs become invalid
+    whenever the generator changes."""
+    with open( os.path.abspath( __file__ ), "rb" ) as fd:
+        return hashlib.sha256( fd.read() ).hexdigest()
+
+class OutputCache( object ):
+    """Generated outputs stored on disk, keyed by a hash of the XML contents,
+    the generator version and the options that affect the output."""
+    def __init__( self, directory ):
+        self.directory = directory
+
+    def key( self, content, options ):
+        h = hashlib.sha256()
+        h.update( generator_version().encode() )
+        h.update( json.dumps( options, sort_keys=True ).encode() )
+        h.update( content )
+        return h.hexdigest()
+
+    def path( self, key ):
+        return os.path.join( self.directory, key + ".json" )
+
+    def get( self, key ):
+        try:
+            with open( self.path( key ) ) as fd:
+                return json.load( fd )
+        except ( OSError, ValueError ):
+            return None
+
+    def put( self, key, outputs ):
+        os.makedirs( self.directory, exist_ok=True )
+        temporary = "%s.%d" % ( self.path( key ), os.getpid() )
+        with open( temporary, "w" ) as fd:
+            json.dump( outputs, fd )
+        os.replace( temporary, self.path( key ) )
+
+SNAPSHOT_SUFFIX = ".model.json"
+
+def text_digest( text ):
+    return hashlib.sha256( text.encode() ).hexdigest()
+
+def write_snapshot( base, registers, outputs, options ):
+    """Save registers to BASE.model.json, with the options and a digest of
+    each of the outputs that were rendered from them, for load_snapshot()."""
+    data = compiled_model( registers )
+    data[ "options" ] = options
+    data[ "outputs" ] = dict( ( suffix, text_digest( text ) )
+            for suffix, text in outputs.items() )
+    write_if_changed( base + SNAPSHOT_SUFFIX,
+            json.dumps( data, separators=( ",", ":" ) ) )
+
+def load_snapshot( base, options ):
+    """Return the Registers and the outputs saved by write_snapshot() for
+    base, or None if there is no snapshot, it was made with other options, or
+    any of the outputs has been changed since."""
+    path = base + SNAPSHOT_SUFFIX
+    try:
+        with open( path ) as fd:
+            data = json.load( fd )
+        if data.get( "options" ) != options:
+            return None
+        outputs = {}
+        for suffix, digest in data[ "outputs" ].items():
+            with open( base + suffix ) as fd:
+                outputs[ suffix ] = fd.read()
+            if text_digest( outputs[ suffix ] ) != digest:
+                return None
+        return compiled_registers( data, path ), outputs
+    except ( OSError, ValueError, KeyError, AssertionError ):
+        return None
+
+def generate_file( path, directory, chisel, cacheDirectory=None,
+        accessors=False, incremental=False, previous=None ):
+    """Write NAME.tex, NAME.tex.inc and NAME.h for the XML file at path to
+    directory. NAME.scala is also written if NAME is in chisel. NAME.h has
+    accessor functions if accessors is set. Outputs that are already up to
+    date aren't touched.
+
+    If cacheDirectory is set, outputs are taken from that OutputCache when
+    possible, without parsing path at all.
+
+    If incremental is set, the model is saved as NAME.model.json in
+    directory, and the next time only the registers that changed since are
+    rendered (see render_incremental()). previous does the same in memory: it
+    is a dictionary mapping path to the registers and outputs generated for
+    it last time.
+
+    Return the time spent in parse_xml, the contents of the C header, and a
+    list of the outputs that were actually written."""
+    name = os.path.splitext( os.path.basename( path ) )[0]
+    base = os.path.join( directory, name )
+    withChisel = name in chisel
+    options = { "chisel": withChisel, "accessors": accessors }
+
+    with open( path, "rb" ) as fd:
+        content = fd.read()
+
+    outputs = None
+    if cacheDirectory:
+        cache = OutputCache( cacheDirectory )
+        key = cache.key( content, options )
+        outputs = cache.get( key )
+
+    parseTime = 0
+    if outputs is None:
+        last = None
+        if previous is not None:
+            last = previous.get( path )
+        elif incremental:
+            last = load_snapshot( base, options )
+        try:
+            with profile_span( name, "file" ):
+                start = time.perf_counter()
+                with profile_span( "parse_xml" ):
+                    registers = parse_xml( io.BytesIO( content ) )
+                parseTime = time.perf_counter() - start
+                if last:
+                    outputs = render_incremental( last[0], registers,
+                            last[1], withChisel, accessors )
+                if outputs is None:
+                    outputs = render_file( registers, withChisel, accessors )
+        except AssertionError as e:
+            # When running in a worker process the traceback is lost, so make
+            # sure the message says which file is broken.
+            raise AssertionError( "%s: %s" % ( path, e ) ) from e
+        if cacheDirectory:
+            cache.put( key, outputs )
+        if previous is not None:
+            previous[ path ] = ( registers, outputs )
+        elif incremental:
+            write_snapshot( base, registers, outputs, options )
+
+    written = [ base + suffix for suffix, text in outputs.items()
+            if write_if_changed( base + suffix, text ) ]
+
+    return parseTime, outputs[ ".h" ], written
+
+def write_batch( paths, directory, chisel, jobs=1, cacheDirectory=None,
+        accessors=False, incremental=False ):
+    """Call generate_file() for each of paths, using a pool of jobs processes
+    if jobs is more than 1. Then combine all the C headers, in the order of
+    paths, into debug_defines.h.
+
+    Return the total time spent in parse_xml."""
+    count = len( paths )
+    if jobs > 1:
+        # Import sympy once here rather than once in every worker, in case the
+        # workers are forked.
+        import_sympy()
+        import concurrent.futures
+        jobs = min( jobs, count )
+        with concurrent.futures.ProcessPoolExecutor( jobs ) as executor:
+            results = list( executor.map( generate_file, paths,
+                [ directory ] * count, [ chisel ] * count,
+                [ cacheDirectory ] * count, [ accessors ] * count,
+                [ incremental ] * count ) )
+    else:
+        results = [ generate_file( path, directory, chisel, cacheDirectory,
+            accessors, incremental ) for path in paths ]
+
+    write_if_changed( os.path.join( directory, "debug_defines.h" ),
+            debug_defines_header() +
+            "".join( header for parseTime, header, written in results ) )
+    return sum( parseTime for parseTime, header, written in results )
+
+def watch_batch( paths, directory, chisel, accessors=False, interval=0.25 ):
+    """Do what write_batch() does, and then keep doing it whenever one of
+    paths changes, until interrupted. Everything stays in memory between
+    changes (sympy, simplified expressions, the C headers of the other files,
+    the model and outputs of every file), so only the XML file that changed
+    is parsed again, only the registers that changed in it are rendered
+    again, and only the outputs whose contents changed are written. The
+    register changes are printed as a changelog."""
+    headers = collections.OrderedDict( ( path, "" ) for path in paths )
+    contents = {}
+    stamps = {}
+    previous = {}
+    while True:
+        changed = []
+        for path in paths:
+            try:
+                stat = os.stat( path )
+            except OSError:
+                # Probably in the middle of being saved.
+                continue
+            stamp = ( stat.st_mtime_ns, stat.st_size )
+            if stamps.get( path ) == stamp:
+                continue
+            stamps[ path ] = stamp
+            with open( path, "rb" ) as fd:
+                content = fd.read()
+            if contents.get( path ) != content:
+                contents[ path ] = content
+                changed.append( path )
+
+        if changed:
+            start = time.perf_counter()
+            written = []
+            for path in changed:
+                last = previous.get( path )
+                try:
+                    parseTime, headers[ path ], files = generate_file( path,
+                            directory, chisel, accessors=accessors,
+                            previous=previous )
+                except AssertionError as e:
+                    # generate_file() starts the message with the path, and
+                    # leaves previous[ path ] alone. The outputs on disk stay
+                    # as they are, and the next edit is compared to the last
+                    # model that worked.
+                    sys.stderr.write( "%s\n" % e )
+                    continue
+                except Exception as e:
+                    # Like above, e.g. for a ParseError from a file that is
+                    # only half saved, or a SympifyError from bits that are
+                    # being edited. These don't mention the path.
+                    sys.stderr.write( "%s: %s: %s\n" % ( path,
+                        type( e ).__name__, e ) )
+                    continue
+                written += files
+                if last:
+                    write_changelog( sys.stderr, diff_registers( last[0],
+                        previous[ path ][0] ), "%s: " % path )
+            path = os.path.join( directory, "debug_defines.h" )
+            if write_if_changed( path, debug_defines_header() +
+                    "".join( headers.values() ) ):
+                written.append( path )
+            sys.stderr.write( "%s: wrote %s in %.0f ms\n" % (
+                ", ".join( os.path.basename( p ) for p in changed ),
+                ", ".join( os.path.basename( p ) for p in written ) or
+                "nothing", ( time.perf_counter() - start ) * 1000 ) )
+        time.sleep( interval )
+
+class Profiler( ProfileHook ):
+    """ProfileHook that collects what --profile reports: the time of each
+    stage, the time of each register within the stages, and the calls to
+    simplify(). If memory is set, the peak memory of each stage is measured
+    with tracemalloc, which makes everything (especially importing sympy) a
+    lot slower. Otherwise only the peak RSS of the process is reported."""
+    def __init__( self, memory=False ):
+        self.tracemalloc = None
+        if memory:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            tracemalloc.start()
+        self.origin = time.perf_counter()
+        self.stack = []
+        # ( name, category, start, seconds, args ) of every span, and of every
+        # simplify() call that actually ran sympy.
+        self.events = []
+        # Stage name -> [ seconds, peak bytes ].
+        self.stages = collections.OrderedDict()
+        self.registers = collections.Counter()
+        # Caller -> [ calls, sympy calls, seconds ].
+        self.simplifyCalls = collections.defaultdict( lambda: [ 0, 0, 0.0 ] )
+        self.peak = 0
+
+    def stop( self ):
+        if self.tracemalloc:
+            self.peak = max( self.peak,
+                    self.tracemalloc.get_traced_memory()[1] )
+            self.tracemalloc.stop()
+        else:
+            try:
+                import resource
+            except ImportError:
+                return
+            # ru_maxrss is in KiB on Linux.
+            self.peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss * \
+                    1024
+
+    def begin( self, name, category ):
+        memory = None
+        if self.tracemalloc and category == "stage" and not any(
+                c == "stage" for n, c, s, m in self.stack ):
+            self.peak = max( self.peak,
+                    self.tracemalloc.get_traced_memory()[1] )
+            self.tracemalloc.reset_peak()
+            memory = self.tracemalloc.get_traced_memory()[0]
+        self.stack.append(( name, category, time.perf_counter(), memory ))
+
+    def end( self, name, category ):
+        name, category, start, memory = self.stack.pop()
+        seconds = time.perf_counter() - start
+        self.events.append(( name, category, start, seconds, None ))
+        if category == "stage":
+            stage = self.stages.setdefault( name, [ 0.0, 0 ] )
+            stage[0] += seconds
+            if memory is not None:
+                peak = self.tracemalloc.get_traced_memory()[1]
+                stage[1] = max( stage[1], peak - memory )
+        elif category == "register":
+            self.registers[ name ] += seconds
+
+    def simplified( self, caller, expression, seconds, cached ):
+        calls = self.simplifyCalls[ caller ]
+        calls[0] += 1
+        calls[2] += seconds
+        if not cached:
+            calls[1] += 1
+            self.events.append(( str( expression ), "simplify",
+                time.perf_counter() - seconds, seconds, { "caller": caller } ))
+
+    def report( self, fd ):
+        if self.tracemalloc:
+            fd.write( "%-28s %10s %10s\n" % ( "stage", "ms", "peak KiB" ) )
+        else:
+            fd.write( "%-28s %10s\n" % ( "stage", "ms" ) )
+        for name, ( seconds, peak ) in self.stages.items():
+            fd.write( "%-28s %10.1f" % ( name, seconds * 1000 ) )
+            if self.tracemalloc:
+                fd.write( " %10.1f" % ( peak / 1024 ) )
+            fd.write( "\n" )
+        if sympyImportTime is not None:
+            fd.write( "%-28s %10.1f\n" % ( "(sympy import)",
+                sympyImportTime * 1000 ) )
+        fd.write( "%-28s %10.1f\n" % ( "peak memory KiB" if self.tracemalloc
+            else "peak RSS KiB", self.peak / 1024 ) )
+
+        if self.simplifyCalls:
+            fd.write( "\n%-28s %10s %10s %10s\n" % ( "simplify() caller",
+                "calls", "sympy", "ms" ) )
+        for caller, ( calls, misses, seconds ) in sorted(
+                self.simplifyCalls.items(), key=lambda i: -i[1][2] ):
+            fd.write( "%-28s %10d %10d %10.1f\n" % ( caller, calls, misses,
+                seconds * 1000 ) )
+
+        fd.write( "\n%-28s %10s\n" % ( "slowest registers", "ms" ) )
+        for name, seconds in self.registers.most_common( 10 ):
+            fd.write( "%-28s %10.1f\n" % ( name, seconds * 1000 ) )
+
+        expressions = sorted( ( e for e in self.events if e[1] == "simplify" ),
+                key=lambda e: -e[3] )[ :10 ]
+        if expressions:
+            fd.write( "\n%-28s %10s\n" % ( "slowest expressions", "ms" ) )
+            for name, category, start, seconds, args in expressions:
+                fd.write( "%-28s %10.1f  (%s)\n" % ( name, seconds * 1000,
+                    args[ "caller" ] ) )
+
+    def write_trace( self, fd ):
+        """Write the events in Chrome's trace event format."""
+        events = []
+        for name, category, start, seconds, args in sorted( self.events,
+                key=lambda e: ( e[2], -e[3] ) ):
+            event = { "name": name, "cat": category, "ph": "X",
+                    "ts": ( start - self.origin ) * 1e6, "dur": seconds * 1e6,
+                    "pid": os.getpid(), "tid": 1 }
+            if args:
+                event[ "args" ] = args
+            events.append( event )
+        json.dump( { "traceEvents": events, "displayTimeUnit": "ms" }, fd )
+        fd.write( "\n" )
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument( 'path' )
+    parser.add_argument( 'path', nargs='+',
+            help='XML register file. Only --batch and --address-map accept '
+            'more than one.' )
     parser.add_argument( '--register', action='store_true',
             help='Use the LaTeX register module. No support for symbolic bit '
             'start/end positions.' )
@@ -649,23 +2930,228 @@ def main():
             help='Write register style definitions to the named file.' )
     parser.add_argument( '--cheader',
             help='Write C #defines to the named file.' )
+    parser.add_argument( '--accessors', action='store_true',
+            help='Also write static inline accessor functions for every field '
+            'to C headers.' )
+    parser.add_argument( '--accessor-test',
+            help='Write a C program to the named file, that checks the '
+            'accessors in the --cheader file against its #defines.' )
     parser.add_argument( '--chisel',
             help='Write Scala Classes to the named file.' )
+    parser.add_argument( '--ctable',
+            help='Write a C address to register lookup table to the named '
+            'file.' )
+    parser.add_argument( '--pytable',
+            help='Write a Python address to register lookup table to the '
+            'named file.' )
+    parser.add_argument( '--compile',
+            help='Write the validated register model to the named file, which '
+            'can be used in place of the XML (with a .json extension).' )
+    parser.add_argument( '--batch', metavar='DIR',
+            help='Write NAME.tex, NAME.tex.inc and NAME.h for every path, and '
+            'a combined debug_defines.h, to DIR.' )
+    parser.add_argument( '--batch-chisel', metavar='NAME', action='append',
+            default=[],
+            help='In batch mode, also write NAME.scala for xml/NAME.xml.' )
+    parser.add_argument( '--jobs', '-j', type=int, default=1, metavar='N',
+            help='In batch mode, process up to N register files in parallel.' )
+    parser.add_argument( '--cache', metavar='DIR',
+            help='In batch mode, reuse outputs cached in DIR for XML files '
+            'that have been generated before with the same options.' )
+    parser.add_argument( '--incremental', action='store_true',
+            help='In batch mode, save the model of every path as '
+            'NAME.model.json in DIR, and the next time only render the '
+            'registers that changed since then.' )
+    parser.add_argument( '--diff', metavar='OLD',
+            help='Print the registers, fields and values that changed between '
+            'OLD (an older version of path) and path.' )
+    parser.add_argument( '--xlen', type=int, action='append', choices=XLENS,
+            help='Write the outputs for this XLEN (and DXLEN), with every bit '
+            'position resolved to a number. May be given more than once, in '
+            'which case output file names must contain {xlen}, and no LaTeX '
+            'is written to stdout.' )
+    parser.add_argument( '--stream', action='store_true',
+            help='Parse the XML file incrementally, only keeping one register '
+            'in memory at a time. Only supports --definitions, --cheader '
+            '(without --accessors), --chisel and --custom.' )
+    parser.add_argument( '--watch', action='store_true',
+            help='In batch mode, keep running and regenerate the outputs of '
+            'every XML file that changes.' )
+    parser.add_argument( '--address-map', action='store_true',
+            help='Print the addresses used by every path, with paths that '
+            'have the same prefix or name in one address space, and the free '
+            'ranges between them. Exits with status 1 if two paths use the '
+            'same address.' )
+    parser.add_argument( '--address-overlay', action='append', default=[],
+            metavar='PATH',
+            help='With --address-map, also add the XML file PATH, whose '
+            'registers may take the place of others at the same address '
+            '(like the proposed serial ports in serial.xml). Its overlaps '
+            'are listed, but are not an error. May be given more than once.' )
+    parser.add_argument( '--address-limit', type=lambda x: int( x, 0 ),
+            metavar='N',
+            help='With --address-map, list free ranges up to N-1 instead of '
+            'up to the highest used address.' )
+    parser.add_argument( '--startup-report', action='store_true',
+            help='Print import, parse and generation times to stderr.' )
+    parser.add_argument( '--profile', action='store_true',
+            help='Print the time and peak memory of every stage, the calls to '
+            'sympy.simplify() by caller, and the slowest registers and '
+            'expressions to stderr. Implies --jobs 1.' )
+    parser.add_argument( '--profile-memory', action='store_true',
+            help='Also measure the peak memory of every stage, which is slow. '
+            'Implies --profile.' )
+    parser.add_argument( '--profile-trace', metavar='FILE',
+            help='Write a Chrome trace (which speedscope and Perfetto also '
+            'read) of every stage, register and sympy.simplify() call to the '
+            'named file. Implies --profile.' )
     parsed = parser.parse_args()
 
-    registers = parse_xml( parsed.path )
-    if parsed.definitions:
-        write_definitions( open( parsed.definitions, "w" ), registers )
-    if parsed.cheader:
-        write_cheader( open( parsed.cheader, "w" ), registers )
-    if parsed.chisel:
-        write_chisel( open( parsed.chisel, "w" ), registers )
-    if not registers.skip_index:
-        print_latex_index( registers )
-    if parsed.register:
-        assert(0)
-        print_latex_register( registers )
-    if parsed.custom:
-        print_latex_custom( registers )
-
-sys.exit( main() )
+    if parsed.profile or parsed.profile_memory or parsed.profile_trace:
+        profiler = Profiler( parsed.profile_memory )
+        profileHooks.append( profiler )
+        try:
+            return generate( parser, parsed )
+        finally:
+            profileHooks.remove( profiler )
+            profiler.stop()
+            profiler.report( sys.stderr )
+            if parsed.profile_trace:
+                fd = Output()
+                profiler.write_trace( fd )
+                fd.save( parsed.profile_trace )
+    return generate( parser, parsed )
+
+def generate( parser, parsed ):
+    """Do what the command line in parsed asks for."""
+    mainTime = time.perf_counter()
+    if parsed.watch:
+        if not parsed.batch:
+            parser.error( "--watch needs --batch" )
+        try:
+            watch_batch( parsed.path, parsed.batch, parsed.batch_chisel,
+                    parsed.accessors )
+        except KeyboardInterrupt:
+            pass
+        return
+    if parsed.address_map:
+        files = [ read_registers( path ) for path in parsed.path ]
+        overlays = [ read_registers( path )
+                for path in parsed.address_overlay ]
+        if write_address_map( sys.stdout, files + overlays,
+                parsed.address_limit, overlays ):
+            return 1
+        return
+    if parsed.batch:
+        jobs = parsed.jobs
+        if profileHooks:
+            # Hooks only see what happens in this process.
+            jobs = 1
+        parseTime = mainTime + write_batch( parsed.path, parsed.batch,
+                parsed.batch_chisel, jobs, parsed.cache,
+                parsed.accessors, parsed.incremental )
+        if parsed.startup_report:
+            print_startup_report( mainTime, parseTime, time.perf_counter() )
+        return
+
+    if len( parsed.path ) != 1:
+        parser.error( "only --batch and --address-map accept more than one "
+                "path" )
+    if parsed.diff:
+        write_changelog( sys.stdout, diff_registers(
+            read_registers( parsed.diff ), read_registers( parsed.path[0] ) ),
+            "%s: " % parsed.path[0] )
+        return
+    if parsed.stream:
+        if parsed.xlen:
+            parser.error( "--stream doesn't support --xlen" )
+        if parsed.accessors or parsed.accessor_test or parsed.compile or \
+                parsed.ctable or parsed.pytable or parsed.register:
+            parser.error( "--stream only supports --definitions, --cheader, "
+                    "--chisel and --custom" )
+        with profile_span( "stream_file" ):
+            stream_file( parsed.path[0], parsed.definitions, parsed.cheader,
+                    parsed.chisel, sys.stdout, parsed.custom )
+        if parsed.startup_report:
+            endTime = time.perf_counter()
+            print_startup_report( mainTime, endTime, endTime )
+        return
+    if parsed.accessor_test and not parsed.cheader:
+        parser.error( "--accessor-test needs --cheader" )
+    outputs = ( parsed.compile, parsed.definitions, parsed.cheader,
+            parsed.accessor_test, parsed.ctable, parsed.pytable, parsed.chisel )
+    if parsed.xlen and len( parsed.xlen ) > 1 and any( path and
+            not "{xlen}" in path for path in outputs ):
+        parser.error( "with more than one --xlen, output file names must "
+                "contain {xlen}" )
+    with profile_span( "parse_xml" ):
+        registers = read_registers( parsed.path[0] )
+        instances = [ ( None, registers ) ]
+        if parsed.xlen:
+            instances = [ ( xlen, registers.instantiate( symbol_values( xlen ) ) )
+                    for xlen in parsed.xlen ]
+    parseTime = time.perf_counter()
+    for xlen, registers in instances:
+        write_outputs( parsed, registers, xlen )
+    if len( instances ) > 1:
+        if parsed.startup_report:
+            print_startup_report( mainTime, parseTime, time.perf_counter() )
+        return
+    with profile_span( "write_latex" ):
+        latex = Output()
+        if not registers.skip_index:
+            print_latex_index( latex, registers )
+        if parsed.register:
+            assert(0)
+            print_latex_register( latex, registers )
+        if parsed.custom:
+            print_latex_custom( latex, registers )
+        sys.stdout.write( latex.getvalue() )
+
+    if parsed.startup_report:
+        print_startup_report( mainTime, parseTime, time.perf_counter() )
+
+def write_outputs( parsed, registers, xlen ):
+    """Write every output file asked for on the command line in parsed, for
+    registers. If xlen is set, {xlen} in the file names is replaced with
+    it."""
+    def expand( path ):
+        if xlen is None:
+            return path
+        return path.replace( "{xlen}", str( xlen ) )
+
+    for path, stage, writer in (
+            ( parsed.compile, "write_compiled", write_compiled ),
+            ( parsed.definitions, "write_definitions", write_definitions ),
+            ( parsed.cheader, "write_cheader", lambda fd, registers:
+                write_cheader( fd, registers, parsed.accessors ) ),
+            ( parsed.accessor_test, "write_accessor_test",
+                lambda fd, registers: write_accessor_test( fd, registers,
+                    os.path.basename( expand( parsed.cheader ) ) ) ),
+            ( parsed.ctable, "write_ctable", write_ctable ),
+            ( parsed.pytable, "write_pytable", write_pytable ),
+            ( parsed.chisel, "write_chisel", write_chisel ) ):
+        if path:
+            with profile_span( stage ):
+                fd = Output()
+                writer( fd, registers )
+                fd.save( expand( path ) )
+
+def print_startup_report( mainTime, parseTime, endTime ):
+    """Print where the time of this invocation went to stderr. sympy import
+    time is included in whichever stage first needed it."""
+    rows = [
+        ( "module import", mainTime - startTime ),
+        ( "parse_xml", parseTime - mainTime ),
+        ( "output", endTime - parseTime ),
+        ( "total", endTime - startTime ) ]
+    for name, seconds in rows:
+        sys.stderr.write( "%-16s %8.1f ms\n" % ( name, seconds * 1000 ) )
+    if sympyImportTime is None:
+        sys.stderr.write( "%-16s %11s\n" % ( "sympy import", "not needed" ) )
+    else:
+        sys.stderr.write( "%-16s %8.1f ms\n" % ( "sympy import",
+            sympyImportTime * 1000 ) )
+
+if __name__ == "__main__":
+    sys.exit( main() )
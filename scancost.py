@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+
+"""Estimate what it costs a debugger to read or write a block of memory over a
+JTAG DTM, for each way the Debug Module offers: System Bus Access (sbcs and
+sbdata0), the Access Memory abstract command with autoexecdata, and a Program
+Buffer loop. Every strategy is built as the actual sequence of DMI operations,
+using the addresses and field positions in xml/dm_registers.xml and
+xml/abstract_commands.xml, and is costed in DMI scans, shifted bits, TCK cycles
+and time using the widths of dtmcs and dmi in xml/jtag_registers.xml."""
+
+import sys
+import os
+import math
+import argparse
+
+from registers import read_registers, find_register
+
+# GPRs used by the Program Buffer loop, and the regno of x0 in Access Register.
+S0 = 8
+S1 = 9
+GPR_REGNO = 0x1000
+
+# cmdtype of the abstract commands in abstract_commands.xml.
+CMDTYPES = { "Access Register": 0, "Quick Access": 1, "Access Memory": 2 }
+
+def encode( register, **values ):
+    """Return the value of register with each of the named fields set (an int,
+    or the name of one of the field's Values), and every other field 0."""
+    result = 0
+    for name, value in values.items():
+        name = name.replace( "_", "-" )
+        field = [ f for f in register.fields if f.name == name ]
+        assert len( field ) == 1, "%s has no field %s" % ( register, name )
+        field = field[0]
+        if isinstance( value, str ):
+            value = int( [ v.value for v in field.values
+                if v.name == value ][0], 0 )
+        low = field.lowBitValue
+        width = field.highBitValue + 1 - low
+        assert 0 <= value < ( 1 << width ), \
+                "%s doesn't fit in %s of %s" % ( value, name, register )
+        result |= value << low
+    return result
+
+def register_width( register ):
+    return max( f.highBitValue for f in register.fields ) + 1
+
+def log2( value ):
+    assert value > 0 and value & ( value - 1 ) == 0, \
+            "%d isn't a power of 2" % value
+    return value.bit_length() - 1
+
+class Config( object ):
+    """The parts of the Debug Module and DTM configuration that matter for the
+    cost of memory accesses. Most of them are read by a debugger from dtmcs,
+    abstractcs, dmstatus and sbcs."""
+    def __init__( self, xlen=32, abits=7, idle=1, progbufsize=2,
+            impebreak=False, datacount=1, sbasize=32, sbaccess=( 32, ),
+            sbautoincrement=True, accessMemory=False, aampostincrement=False,
+            autoexec=True, commandIdle=0, busIdle=0 ):
+        self.xlen = xlen
+        self.abits = abits
+        # dtmcs.idle: Run-Test/Idle cycles after every DMI scan.
+        self.idle = idle
+        self.progbufsize = progbufsize
+        self.impebreak = impebreak
+        self.datacount = datacount
+        self.sbasize = sbasize
+        # Access widths (in bits) that the system bus supports.
+        self.sbaccess = tuple( sbaccess )
+        self.sbautoincrement = sbautoincrement
+        self.accessMemory = accessMemory
+        self.aampostincrement = aampostincrement
+        # Whether abstractauto is implemented.
+        self.autoexec = autoexec
+        # Extra Run-Test/Idle cycles for an abstract command or a system bus
+        # access to complete, so that the next scan doesn't see busy.
+        self.commandIdle = commandIdle
+        self.busIdle = busIdle
+
+class DebugModule( object ):
+    """The register descriptions that the strategies are built from."""
+    def __init__( self, dm, commands, jtag, config ):
+        self.dm = dm
+        self.config = config
+        self.commands = dict( ( r.name, r ) for r in commands.registers )
+
+        # The IR has to be wide enough for every JTAG DTM register.
+        self.irLength = max( int( r.address, 0 ) for r in jtag.registers
+                ).bit_length()
+        self.dmi = find_register( jtag, "dmi" ).instantiate(
+                { "abits": config.abits } )
+        self.dmiWidth = register_width( self.dmi )
+        # The configuration has to be something dtmcs can describe.
+        encode( find_register( jtag, "dtmcs" ), abits=config.abits,
+                idle=config.idle )
+
+    def register( self, name ):
+        return find_register( self.dm, name )
+
+    def address( self, name ):
+        return int( self.register( name ).address, 0 )
+
+    def data_words( self, bits ):
+        """Return the number of 32-bit DMI data words in bits."""
+        return max( 1, bits // 32 )
+
+class Sequence( object ):
+    """A sequence of DMI operations, and what it costs to scan them."""
+    def __init__( self, module ):
+        self.module = module
+        # ( op, register name, data, extra idle cycles )
+        self.operations = []
+        # Width of every IR scan.
+        self.irScans = []
+
+    def select_dmi( self ):
+        self.irScans.append( self.module.irLength )
+
+    def read( self, name, idle=0 ):
+        self.operations.append( ( "read", name, 0, idle ) )
+
+    def write( self, name, data=0, idle=0, **fields ):
+        if fields:
+            data = encode( self.module.register( name ), **fields )
+        self.operations.append( ( "write", name, data, idle ) )
+
+    def nop( self ):
+        self.operations.append( ( "nop", None, 0, 0 ) )
+
+    def finish( self, status ):
+        """Read status to see whether anything failed, and do one more scan
+        to get the result of the last operation."""
+        self.read( status )
+        self.nop()
+
+    def scans( self ):
+        return len( self.operations )
+
+    def bits( self ):
+        return len( self.operations ) * self.module.dmiWidth + \
+                sum( self.irScans )
+
+    def cycles( self ):
+        """Return the number of TCK cycles, starting and ending in
+        Run-Test/Idle. A DR scan goes through Select-DR-Scan, Capture-DR,
+        Shift-DR, Exit1-DR and Update-DR, which is 5 cycles on top of the
+        shifted bits. An IR scan also goes through Select-IR-Scan."""
+        config = self.module.config
+        cycles = sum( self.module.dmiWidth + 5 + config.idle + idle
+                for op, name, data, idle in self.operations )
+        return cycles + sum( bits + 6 for bits in self.irScans )
+
+    def dmi_scans( self ):
+        """Return the value scanned into dmi for every operation."""
+        module = self.module
+        return [ encode( module.dmi, op=op,
+                    address=module.address( name ) if name else 0, data=data )
+                for op, name, data, idle in self.operations ]
+
+def system_bus( module, address, size, width, write ):
+    """Access memory through sbaddress and sbdata, letting the DM increment
+    the address and start the next read when sbdata0 is read."""
+    config = module.config
+    if not config.sbasize:
+        raise ValueError( "there is no System Bus Access (sbasize is 0)" )
+    if not width * 8 in config.sbaccess:
+        raise ValueError( "%d-bit system bus accesses aren't supported" %
+                ( width * 8 ) )
+    count = math.ceil( size / width )
+    dataWords = module.data_words( width * 8 )
+    addressWords = math.ceil( config.sbasize / 32 )
+    autoincrement = config.sbautoincrement
+
+    sequence = Sequence( module )
+    sequence.select_dmi()
+    sbcs = dict( sbaccess="%dbit" % ( width * 8 ),
+            sbautoincrement=int( autoincrement ) )
+    if not write:
+        sbcs.update( sbreadonaddr=1, sbreadondata=int( autoincrement ) )
+    sequence.write( "sbcs", **sbcs )
+
+    def set_address( value ):
+        # Writing sbaddress0 starts a read, so it has to be written last.
+        for i in reversed( range( addressWords ) ):
+            sequence.write( "sbaddress%d" % i, ( value >> ( 32 * i ) ) &
+                    0xffffffff, idle=0 if write or i else config.busIdle )
+
+    set_address( address )
+    for i in range( count ):
+        if i and not autoincrement:
+            set_address( address + i * width )
+        if not write and autoincrement and count > 1 and i == count - 1:
+            # Don't let reading the last word start another bus read.
+            sbcs[ "sbreadondata" ] = 0
+            sequence.write( "sbcs", **sbcs )
+        # sbdata0 starts the access, so it's accessed last.
+        for w in reversed( range( dataWords ) ):
+            idle = config.busIdle if w == 0 else 0
+            if write:
+                sequence.write( "sbdata%d" % w, idle=idle )
+            else:
+                sequence.read( "sbdata%d" % w, idle=idle )
+    sequence.finish( "sbcs" )
+    return sequence
+
+def access_register( module, regno, write=False, transfer=True,
+        postexec=False ):
+    """Return the value of command for an Access Register command."""
+    return encode( module.commands[ "Access Register" ],
+            cmdtype=CMDTYPES[ "Access Register" ],
+            aarsize="%dbit" % module.config.xlen, transfer=int( transfer ),
+            write=int( write ), postexec=int( postexec ), regno=regno )
+
+def argument_words( module ):
+    """Return the number of data registers in each abstract command
+    argument."""
+    return module.data_words( module.config.xlen )
+
+def transfer_data( sequence, words, write, idle ):
+    """Access data0 through data( words - 1 ). data0 is accessed last, since
+    that is what autoexecdata triggers on."""
+    for w in reversed( range( words ) ):
+        if write:
+            sequence.write( "data%d" % w, idle=idle if w == 0 else 0 )
+        else:
+            sequence.read( "data%d" % w, idle=idle if w == 0 else 0 )
+
+def burst( sequence, count, dataWords, write, command ):
+    """Execute command count times, transferring one element through data0
+    each time. With abstractauto, accessing data0 executes the next command,
+    which saves a scan per element."""
+    config = sequence.module.config
+    if write:
+        transfer_data( sequence, dataWords, True, 0 )
+        sequence.write( "command", command, idle=config.commandIdle )
+        remaining = count - 1
+    else:
+        sequence.write( "command", command, idle=config.commandIdle )
+        remaining = count
+    if config.autoexec and count > 1:
+        sequence.write( "abstractauto", autoexecdata=1 )
+        for i in range( remaining ):
+            if not write and i == remaining - 1:
+                # Don't let reading the last element execute the command
+                # again.
+                sequence.write( "abstractauto" )
+            transfer_data( sequence, dataWords, write, config.commandIdle )
+        if write:
+            sequence.write( "abstractauto" )
+    else:
+        for i in range( remaining ):
+            if write:
+                transfer_data( sequence, dataWords, True, 0 )
+                sequence.write( "command", command, idle=config.commandIdle )
+            else:
+                transfer_data( sequence, dataWords, False, 0 )
+                if i < remaining - 1:
+                    sequence.write( "command", command,
+                            idle=config.commandIdle )
+
+def abstract_memory( module, address, size, width, write ):
+    """Access memory with the Access Memory abstract command, which takes the
+    address in arg1 and the data in arg0."""
+    config = module.config
+    if not config.accessMemory:
+        raise ValueError( "the Access Memory command isn't supported" )
+    if width * 8 > config.xlen:
+        raise ValueError( "%d-bit accesses need a larger XLEN" %
+                ( width * 8 ) )
+    argWords = argument_words( module )
+    if config.datacount < 2 * argWords:
+        raise ValueError( "needs datacount of at least %d" % ( 2 * argWords ) )
+    count = math.ceil( size / width )
+    dataWords = module.data_words( width * 8 )
+    postincrement = config.aampostincrement
+    command = encode( module.commands[ "Access Memory" ],
+            cmdtype=CMDTYPES[ "Access Memory" ],
+            aamsize="%dbit" % ( width * 8 ), write=int( write ),
+            aampostincrement=int( postincrement ) )
+
+    sequence = Sequence( module )
+    sequence.select_dmi()
+
+    def set_address( value ):
+        for w in range( argWords ):
+            sequence.write( "data%d" % ( argWords + w ),
+                    ( value >> ( 32 * w ) ) & 0xffffffff )
+
+    set_address( address )
+    if postincrement:
+        burst( sequence, count, dataWords, write, command )
+    else:
+        for i in range( count ):
+            if i:
+                set_address( address + i * width )
+            if write:
+                transfer_data( sequence, dataWords, True, 0 )
+            sequence.write( "command", command, idle=config.commandIdle )
+            if not write:
+                transfer_data( sequence, dataWords, False, 0 )
+    sequence.finish( "abstractcs" )
+    return sequence
+
+def instruction( opcode, rd=0, funct3=0, rs1=0, rs2=None, imm=0 ):
+    """Return an I-type instruction, or an S-type one if rs2 is given."""
+    if rs2 is None:
+        return ( imm << 20 ) | ( rs1 << 15 ) | ( funct3 << 12 ) | \
+                ( rd << 7 ) | opcode
+    return ( ( imm >> 5 ) << 25 ) | ( rs2 << 20 ) | ( rs1 << 15 ) | \
+            ( funct3 << 12 ) | ( ( imm & 0x1f ) << 7 ) | opcode
+
+EBREAK = 0x00100073
+
+def program( width, write ):
+    """Return the Program Buffer loop that loads (or stores) s1 at s0, and
+    increments s0."""
+    funct3 = log2( width )
+    if write:
+        access = instruction( 0x23, funct3=funct3, rs1=S0, rs2=S1 )
+    else:
+        access = instruction( 0x03, rd=S1, funct3=funct3, rs1=S0 )
+    increment = instruction( 0x13, rd=S0, rs1=S0, imm=width )
+    return [ access, increment ]
+
+def program_buffer( module, address, size, width, write ):
+    """Access memory by executing a load or store from the Program Buffer
+    after every Access Register command that transfers s1 through data0. s0
+    and s1 are saved first and restored afterwards."""
+    config = module.config
+    instructions = program( width, write )
+    if not config.impebreak:
+        instructions.append( EBREAK )
+    if config.progbufsize < len( instructions ):
+        raise ValueError( "needs a progbufsize of at least %d" %
+                len( instructions ) )
+    if width * 8 > config.xlen:
+        raise ValueError( "%d-bit accesses need a larger XLEN" %
+                ( width * 8 ) )
+    argWords = argument_words( module )
+    if config.datacount < argWords:
+        raise ValueError( "needs datacount of at least %d" % argWords )
+    count = math.ceil( size / width )
+
+    sequence = Sequence( module )
+    sequence.select_dmi()
+    for i, value in enumerate( instructions ):
+        sequence.write( "progbuf%d" % i, value )
+    for register in ( S0, S1 ):
+        sequence.write( "command", access_register( module,
+            GPR_REGNO + register ), idle=config.commandIdle )
+        transfer_data( sequence, argWords, False, 0 )
+    for w in range( argWords ):
+        sequence.write( "data%d" % w, ( address >> ( 32 * w ) ) & 0xffffffff )
+    sequence.write( "command", access_register( module, GPR_REGNO + S0,
+        write=True ), idle=config.commandIdle )
+
+    if write:
+        command = access_register( module, GPR_REGNO + S1, write=True,
+                postexec=True )
+        burst( sequence, count, argWords, True, command )
+    else:
+        # Execute the program once to load the first element into s1. After
+        # that, every command transfers s1 to data0 and loads the next one.
+        sequence.write( "command", access_register( module, GPR_REGNO + S1,
+            transfer=False, postexec=True ), idle=config.commandIdle )
+        command = access_register( module, GPR_REGNO + S1, postexec=True )
+        burst( sequence, count, argWords, False, command )
+
+    for register in ( S0, S1 ):
+        transfer_data( sequence, argWords, True, 0 )
+        sequence.write( "command", access_register( module,
+            GPR_REGNO + register, write=True ), idle=config.commandIdle )
+    sequence.finish( "abstractcs" )
+    return sequence
+
+STRATEGIES = (
+    ( "sba", system_bus ),
+    ( "abstract", abstract_memory ),
+    ( "progbuf", program_buffer ) )
+
+def estimate( module, address, size, width, write ):
+    """Return [ ( name, sequence or None, reason ) ] for every strategy."""
+    result = []
+    for name, strategy in STRATEGIES:
+        try:
+            result.append( ( name, strategy( module, address, size, width,
+                write ), None ) )
+        except ValueError as e:
+            result.append( ( name, None, str( e ) ) )
+    return result
+
+def parse_frequency( text ):
+    """Parse a frequency like 10000000, 10M or 500k, in Hz."""
+    scale = { "k": 1e3, "M": 1e6, "G": 1e9 }
+    text = text.rstrip( "Hz" )
+    if text and text[-1] in scale:
+        return float( text[:-1] ) * scale[ text[-1] ]
+    return float( text )
+
+def format_time( seconds ):
+    for unit, scale in ( ( "s", 1 ), ( "ms", 1e-3 ), ( "us", 1e-6 ) ):
+        if seconds >= scale:
+            return "%.3f %s" % ( seconds / scale, unit )
+    return "%.3f us" % ( seconds / 1e-6 )
+
+def report( fd, results, size, tck ):
+    fd.write( "%-10s %10s %12s %12s %12s %12s\n" % ( "strategy", "scans",
+        "bits", "TCK cycles", "time", "KiB/s" ) )
+    possible = [ ( s.cycles(), name ) for name, s, reason in results if s ]
+    fastest = min( possible )[1] if possible else None
+    for name, sequence, reason in results:
+        if sequence is None:
+            fd.write( "%-10s unsupported: %s\n" % ( name, reason ) )
+            continue
+        seconds = sequence.cycles() / tck
+        fd.write( "%-10s %10d %12d %12d %12s %12.1f%s\n" % ( name,
+            sequence.scans(), sequence.bits(), sequence.cycles(),
+            format_time( seconds ), size / 1024 / seconds,
+            "  fastest" if name == fastest else "" ) )
+
+def write_operations( fd, module, name, sequence ):
+    fd.write( "%s:\n" % name )
+    for ( op, register, data, idle ), scan in zip( sequence.operations,
+            sequence.dmi_scans() ):
+        fd.write( "  %-5s %-12s 0x%08x  dmi=0x%x%s\n" % ( op, register or "",
+            data, scan, "  idle %d" % idle if idle else "" ) )
+
+XML_DIRECTORY = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+        "xml" )
+
+def add_config_arguments( parser ):
+    """Add arguments for every setting in Config, and for the XML files, to
+    parser."""
+    parser.add_argument( '--xlen', type=int, default=32,
+            choices=( 32, 64, 128 ) )
+    parser.add_argument( '--abits', type=int, default=7,
+            help='dtmcs.abits' )
+    parser.add_argument( '--idle', type=int, default=1,
+            help='dtmcs.idle: Run-Test/Idle cycles after every scan.' )
+    parser.add_argument( '--progbufsize', type=int, default=2,
+            help='abstractcs.progbufsize' )
+    parser.add_argument( '--impebreak', action='store_true',
+            help='dmstatus.impebreak is set.' )
+    parser.add_argument( '--datacount', type=int, default=1,
+            help='abstractcs.datacount' )
+    parser.add_argument( '--sbasize', type=int, default=32,
+            help='sbcs.sbasize, 0 if there is no System Bus Access.' )
+    parser.add_argument( '--sbaccess', type=int, action='append',
+            help='Supported system bus access width in bits. May be given '
+            'more than once. Defaults to 32.' )
+    parser.add_argument( '--no-sbautoincrement', action='store_true',
+            help="The system bus doesn't support sbautoincrement." )
+    parser.add_argument( '--access-memory', action='store_true',
+            help='The Access Memory abstract command is supported.' )
+    parser.add_argument( '--aampostincrement', action='store_true',
+            help='Access Memory supports aampostincrement.' )
+    parser.add_argument( '--no-autoexec', action='store_true',
+            help="abstractauto isn't implemented." )
+    parser.add_argument( '--command-idle', type=int, default=0,
+            help='Extra Run-Test/Idle cycles for an abstract command to '
+            'complete.' )
+    parser.add_argument( '--bus-idle', type=int, default=0,
+            help='Extra Run-Test/Idle cycles for a system bus access to '
+            'complete.' )
+    parser.add_argument( '--dm', default=os.path.join( XML_DIRECTORY,
+        "dm_registers.xml" ) )
+    parser.add_argument( '--commands', default=os.path.join( XML_DIRECTORY,
+        "abstract_commands.xml" ) )
+    parser.add_argument( '--jtag', default=os.path.join( XML_DIRECTORY,
+        "jtag_registers.xml" ) )
+
+def config_from_arguments( parsed ):
+    """Return the Config described by the arguments add_config_arguments()
+    added."""
+    return Config( xlen=parsed.xlen, abits=parsed.abits, idle=parsed.idle,
+            progbufsize=parsed.progbufsize, impebreak=parsed.impebreak,
+            datacount=parsed.datacount, sbasize=parsed.sbasize,
+            sbaccess=parsed.sbaccess or ( 32, ),
+            sbautoincrement=not parsed.no_sbautoincrement,
+            accessMemory=parsed.access_memory,
+            aampostincrement=parsed.aampostincrement,
+            autoexec=not parsed.no_autoexec,
+            commandIdle=parsed.command_idle, busIdle=parsed.bus_idle )
+
+def read_xml( parsed ):
+    """Return the dm, abstract command and JTAG DTM Registers named by the
+    arguments add_config_arguments() added."""
+    return ( read_registers( parsed.dm ), read_registers( parsed.commands ),
+            read_registers( parsed.jtag ) )
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( '--size', type=lambda x: int( x, 0 ), default=4096,
+            help='Number of bytes to access.' )
+    parser.add_argument( '--width', type=int, default=4,
+            choices=( 1, 2, 4, 8, 16 ),
+            help='Size of each access in bytes.' )
+    parser.add_argument( '--address', type=lambda x: int( x, 0 ),
+            default=0x80000000, help='Address of the first byte.' )
+    parser.add_argument( '--write', action='store_true',
+            help='Write memory instead of reading it.' )
+    parser.add_argument( '--tck', type=parse_frequency, default=10e6,
+            help='TCK frequency, e.g. 10M.' )
+    parser.add_argument( '--operations', action='store_true',
+            help='Also print every DMI operation of every strategy.' )
+    add_config_arguments( parser )
+    parsed = parser.parse_args()
+
+    config = config_from_arguments( parsed )
+    module = DebugModule( *read_xml( parsed ), config=config )
+
+    results = estimate( module, parsed.address, parsed.size, parsed.width,
+            parsed.write )
+    sys.stdout.write( "%s %d bytes, %d at a time, at %g Hz TCK (dmi is %d "
+            "bits)\n" % ( "Writing" if parsed.write else "Reading",
+                parsed.size, parsed.width, parsed.tck, module.dmiWidth ) )
+    report( sys.stdout, results, parsed.size, parsed.tck )
+    if parsed.operations:
+        for name, sequence, reason in results:
+            if sequence:
+                write_operations( sys.stdout, module, name, sequence )
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tools are scripts in the top directory, not an installed package.
+sys.path.insert( 0, os.path.dirname( os.path.dirname(
+    os.path.abspath( __file__ ) ) ) )
@@ -0,0 +1,108 @@
+"""Round trips through encode.py and decode.py."""
+
+import io
+import os
+
+import pytest
+
+numpy = pytest.importorskip( "numpy" )
+
+import registers
+import decode
+import encode
+
+XML = os.path.join( os.path.dirname( os.path.dirname(
+    os.path.abspath( __file__ ) ) ), "xml" )
+
+def find( name, register ):
+    return decode.find_register(
+            registers.read_registers( os.path.join( XML, name ) ), register )
+
+REGISTERS = [
+    ( "dm_registers.xml", "dmstatus", None ),
+    ( "dm_registers.xml", "dmcontrol", None ),
+    ( "dm_registers.xml", "sbcs", None ),
+    ( "core_registers.xml", "dcsr", None ),
+    ( "hwbp_registers.xml", "mcontrol", 32 ),
+    ( "hwbp_registers.xml", "mcontrol", 64 ),
+    ( "hwbp_registers.xml", "mcontrol6", 32 ),
+    ( "hwbp_registers.xml", "mcontrol6", 64 ),
+]
+
+@pytest.mark.parametrize( "name, register, xlen", REGISTERS )
+def test_fields_round_trip( name, register, xlen ):
+    r = find( name, register )
+    encoder = encode.Encoder( r, xlen )
+    decoder = decode.Decoder( r, xlen )
+    rng = numpy.random.default_rng( 1 )
+    fields = dict( ( f.name, rng.integers( 0, f.maximum, 100, endpoint=True,
+        dtype=numpy.uint64 ) ) for f in encoder.fields.values() )
+    decoded = decoder.decode( encoder.encode( fields ), names=True )
+    for name, column in fields.items():
+        assert ( decoded[ name ] == column ).all(), name
+    assert ( encoder.encode( decoded ) == encoder.encode( fields ) ).all()
+
+@pytest.mark.parametrize( "name, register, xlen", REGISTERS )
+def test_hex_capture_round_trip( tmp_path, name, register, xlen ):
+    r = find( name, register )
+    encoder = encode.Encoder( r, xlen )
+    decoder = decode.Decoder( r, xlen )
+    rng = numpy.random.default_rng( 2 )
+    raw = rng.integers( 0, ( 1 << decoder.width ) - 1, 1000, endpoint=True,
+            dtype=numpy.uint64 )
+    # Mix upper and lower case, 0x prefixes and different whitespace.
+    text = "".join( ( "0x%x " if i % 3 else "%X\n\t" ) % value
+            for i, value in enumerate( raw.tolist() ) )
+    path = tmp_path / "capture.hex"
+    path.write_text( text )
+    captured = decode.read_capture( str( path ), "hex", decoder.width )
+    assert ( captured == raw ).all()
+
+    # Bits that no field covers (or only reserved 0 fields) are lost.
+    mask = sum( f.maximum << f.offset for f in encoder.fields.values() )
+    decoded = decoder.decode( captured )
+    assert ( encoder.encode( decoded ) == raw & numpy.uint64( mask ) ).all()
+
+def test_binary_capture( tmp_path ):
+    raw = numpy.array( [ 0, 1, 0x12345678, 0xffffffff ], dtype=numpy.uint32 )
+    path = tmp_path / "capture.bin"
+    raw.astype( "<u4" ).tofile( str( path ) )
+    assert decode.read_capture( str( path ), "bin", 32 ).tolist() == \
+            raw.tolist()
+
+@pytest.mark.parametrize( "text", [ b"0x", b"12 x3", b"1g", b"1" * 17 ] )
+def test_bad_hex( text ):
+    with pytest.raises( ValueError ):
+        decode.parse_hex( text )
+
+def test_value_names():
+    r = find( "dm_registers.xml", "abstractcs" )
+    encoder = encode.Encoder( r )
+    decoder = decode.Decoder( r )
+    raw = encoder.encode( cmderr=[ "none", "busy", "exception" ], datacount=2 )
+    decoded = decoder.decode( raw, names=True )
+    assert decoded[ "cmderr_name" ].tolist() == [ "none", "busy", "exception" ]
+    assert ( encoder.encode( decoded ) == raw ).all()
+
+def test_write_columns():
+    r = find( "dm_registers.xml", "abstractcs" )
+    decoded = decode.Decoder( r ).decode( encode.Encoder( r ).encode(
+        cmderr=[ 0, 1, 7 ], progbufsize=[ 16, 0, 2 ] ), names=True )
+    fd = io.BytesIO()
+    decode.write_columns( fd, decoded, rows=2 )
+    lines = fd.getvalue().decode().splitlines()
+    names = decoded.dtype.names
+    assert lines[0] == " ".join( names )
+    assert lines[1:] == [ " ".join( str( row[ name ] ) for name in names )
+            for row in decoded ]
+
+def test_dmi_scan():
+    jtag = registers.read_registers( os.path.join( XML,
+        "jtag_registers.xml" ) )
+    dmi = encode.dmi_encoder( jtag, abits=7 )
+    raw = dmi.encode( op="write", address=0x17, data=[ 0, 0x12345678 ] )
+    assert raw.tolist() == [ ( 0x17 << 34 ) | 2,
+            ( 0x17 << 34 ) | ( 0x12345678 << 2 ) | 2 ]
+    assert dmi.width == 41
+    assert dmi.pack( raw )[ :6 ] == ( ( 0x17 << 34 ) | 2 ).to_bytes( 6,
+            "little" )
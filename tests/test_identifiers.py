@@ -0,0 +1,70 @@
+"""Tests of Identifiers."""
+
+import io
+
+import pytest
+
+import registers
+
+def parse( fields, stream=False ):
+    content = ( """<registers name="Test" prefix="T_">
+        <register name="R" short="r" address="0x10">%s</register>
+        </registers>""" % fields ).encode()
+    if stream:
+        r, iterator = registers.stream_xml( io.BytesIO( content ) )
+        return list( iterator )
+    return registers.parse_xml( io.BytesIO( content ) )
+
+def test_names():
+    model = parse( """
+        <field name="hart sel" bits="31:1" access="R/W" reset="0" />
+        <field name="go" bits="0" access="R/W" reset="0">
+            <value v="0" name="stop">Stop.</value>
+            <value v="1" name="go">Go.</value>
+        </field>""" )
+    r = model.registers[0]
+    identifiers = model.identifiers
+    assert identifiers.c_register( r ) == "T_R"
+    assert identifiers.c_field( r, r.fields[0] ) == "T_R_HART_SEL"
+    assert identifiers.c_value( r, r.fields[1], r.fields[1].values[0] ) == \
+            "T_R_GO_STOP"
+    assert identifiers.latex( "r", "hart sel" ) == "tRHartsel"
+    # Mangling is memoized.
+    assert identifiers.latex( "r", "hart sel" ) is \
+            identifiers.latex( "r", "hart sel" )
+
+# Each of these has two things with the same C name.
+COLLISIONS = [
+    ( """<field name="a b" bits="31:1" access="R" reset="0" />
+        <field name="a-b" bits="0" access="R" reset="0" />""",
+        "r.a b and r.a-b both have the C name T_R_A_B" ),
+    ( """<field name="mode" bits="31:1" access="R/W" reset="0">
+            <value v="1" name="on">On.</value>
+        </field>
+        <field name="mode_on" bits="0" access="R" reset="0" />""",
+        "r.mode.on and r.mode_on both have the C name T_R_MODE_ON" ),
+    ( """<field name="x" bits="31:0" access="R/W" reset="0">
+            <value v="0" name="length">Length.</value>
+        </field>""",
+        "r.x and r.x.length both have the C name T_R_X_LENGTH" ),
+]
+
+@pytest.mark.parametrize( "fields, problem", COLLISIONS )
+@pytest.mark.parametrize( "stream", [ False, True ] )
+def test_collision( fields, problem, stream ):
+    with pytest.raises( AssertionError ) as e:
+        parse( fields, stream )
+    assert problem in str( e.value ).splitlines()
+
+def test_latex_collision():
+    # Both mangle to the \F macro tRAb.
+    with pytest.raises( AssertionError, match=r"\\F macro tRAb" ):
+        parse( """<field name="a b" bits="31:1" access="R" reset="0" />
+            <field name="ab" bits="0" access="R" reset="0" />""" )
+
+def test_duplicate_values():
+    # A value that is listed twice on purpose isn't a collision.
+    parse( """<field name="mode" bits="31:0" access="R/W" reset="0">
+            <value v="0" name="off">Off.</value>
+            <value v="0" name="off" duplicate="1">Still off.</value>
+        </field>""" )
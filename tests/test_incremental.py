@@ -0,0 +1,147 @@
+"""Tests of diff_registers() and incremental rendering."""
+
+import io
+import os
+import sys
+
+import pytest
+
+import registers
+
+XML = os.path.join( os.path.dirname( os.path.dirname(
+    os.path.abspath( __file__ ) ) ), "xml" )
+
+def read( name ):
+    with open( os.path.join( XML, name ), "rb" ) as fd:
+        return fd.read()
+
+def parse( content ):
+    return registers.parse_xml( io.BytesIO( content ) )
+
+def edit( content, old, new ):
+    assert content.count( old ) == 1, old
+    return content.replace( old, new )
+
+OLD = b"""<registers name="Test" prefix="T_">
+    <register name="Control" short="control" address="0x10">
+        Controls things.
+        <field name="mode" bits="31:30" access="R/W" reset="0">
+            <value v="0" name="off">Off.</value>
+            <value v="1" name="on">On.</value>
+        </field>
+        <field name="count" bits="29:0" access="R" reset="0" />
+    </register>
+    <register name="Status" short="status" address="0x11">
+        <field name="busy" bits="31" access="R" reset="0" />
+        <field name="0" bits="30:0" access="R" reset="0" />
+    </register>
+</registers>
+"""
+
+def test_diff_registers():
+    new = edit( OLD, b"Controls things.", b"Controls everything." )
+    new = edit( new, b'bits="31:30" access="R/W"',
+            b'bits="31:30" access="WARL"' )
+    new = edit( new, b'<value v="1" name="on">On.</value>',
+            b'<value v="1" name="on">On.</value>\n'
+            b'            <value v="2" name="auto">Auto.</value>' )
+    new = edit( new, b'address="0x11"', b'address="0x12"' )
+    changes = registers.diff_registers( parse( OLD ), parse( new ) )
+    fd = io.StringIO()
+    registers.write_changelog( fd, changes, "test.xml: " )
+    assert fd.getvalue() == \
+            "test.xml: control: description changed; " \
+            "mode access R/W -> WARL; added value mode=auto\n" \
+            "test.xml: status: address 0x11 -> 0x12\n"
+
+def test_diff_added_and_reordered():
+    new = edit( OLD, b'<field name="busy" bits="31" access="R" reset="0" />',
+            b'<field name="busy" bits="31" access="R" reset="0" />\n'
+            b'        <field name="done" bits="30" access="R" reset="0" />' )
+    new = edit( new, b'<field name="0" bits="30:0"',
+            b'<field name="0" bits="29:0"' )
+    changes = registers.diff_registers( parse( OLD ), parse( new ) )
+    assert [ str( c ) for c in changes ] == [
+            "status: added field done", "status: 0 bits 30:0 -> 29:0" ]
+    assert registers.diff_registers( parse( OLD ), parse( OLD ) ) == []
+
+    start = OLD.index( b"    <register" )
+    middle = OLD.index( b"    <register", start + 1 )
+    end = OLD.index( b"</registers>" )
+    swapped = OLD[ :start ] + OLD[ middle:end ] + OLD[ start:middle ] + \
+            OLD[ end: ]
+    changes = registers.diff_registers( parse( OLD ), parse( swapped ) )
+    assert [ str( c ) for c in changes ] == [ "(file): registers reordered" ]
+
+# Edits of dm_registers.xml that only change registers which are already
+# there, so that render_incremental() can handle them.
+EDITS = [
+    [ ( b"This register controls the overall Debug Module",
+        b"This register controls the whole Debug Module" ) ],
+    [ ( b'<field name="allresumeack" bits="17" access="R" reset="-"',
+        b'<field name="allresumeack" bits="17" access="R" reset="0"' ) ],
+    [ ( b'<register name="Abstract Data 0" short="data0" address="0x04">',
+        b'<register name="Abstract Data 0" short="data0" address="0x04" '
+        b'sdesc="Data">' ) ],
+    # Changes the accessors and the Scala bundle of dmcontrol.
+    [ ( b'<field name="haltreq" bits="31"',
+            b'<field name="haltreq" bits="30"' ),
+        ( b'<field name="resumereq" bits="30"',
+            b'<field name="resumereq" bits="31"' ) ],
+]
+
+def edited( content, edits ):
+    for old, new in edits:
+        content = edit( content, old, new )
+    return content
+
+@pytest.mark.parametrize( "edits", EDITS )
+@pytest.mark.parametrize( "chisel, accessors", [ ( False, False ),
+    ( True, False ), ( False, True ), ( True, True ) ] )
+def test_incremental_matches_full( edits, chisel, accessors ):
+    content = read( "dm_registers.xml" )
+    before = parse( content )
+    after = parse( edited( content, edits ) )
+    previous = registers.render_file( before, chisel, accessors )
+    outputs = registers.render_incremental( before, after, previous, chisel,
+            accessors )
+    assert outputs is not None
+    assert outputs == registers.render_file( after, chisel, accessors )
+
+def test_incremental_gives_up():
+    # A new value adds a #define, which could collide with one elsewhere.
+    before = parse( OLD )
+    after = parse( edit( OLD, b'<value v="1" name="on">On.</value>',
+            b'<value v="1" name="on">On.</value>\n'
+            b'<value v="2" name="auto">Auto.</value>' ) )
+    previous = registers.render_file( before, False )
+    assert registers.render_incremental( before, after, previous,
+            False ) is None
+
+def test_make_registers_is_incremental( tmp_path, monkeypatch ):
+    # Run registers.py the way 'make registers' does, edit one register in
+    # dm_registers.xml, and run it again.
+    path = tmp_path / "dm_registers.xml"
+    content = read( "dm_registers.xml" )
+    path.write_bytes( content )
+    out = tmp_path / "out"
+    out.mkdir()
+    argv = [ "registers.py", "--batch", str( out ), "--cache",
+            str( tmp_path / "cache" ), "--incremental", "--batch-chisel",
+            "dm_registers", str( path ) ]
+    monkeypatch.setattr( sys, "argv", argv )
+    registers.main()
+
+    rendered = []
+    render_file = registers.render_file
+    def spy( *args, **kwargs ):
+        rendered.append( args )
+        return render_file( *args, **kwargs )
+    monkeypatch.setattr( registers, "render_file", spy )
+    path.write_bytes( edited( content, EDITS[0] ) )
+    registers.main()
+    assert rendered == []
+
+    full = render_file( parse( edited( content, EDITS[0] ) ), True )
+    for suffix, text in full.items():
+        assert ( out / ( "dm_registers" + suffix ) ).read_text() == text
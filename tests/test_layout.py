@@ -0,0 +1,95 @@
+"""Tests of Register.layout_problems() and check_layout()."""
+
+import xml.etree.ElementTree
+
+import pytest
+
+import registers
+
+def parse( text ):
+    """Return the Register and its layout problems for a <register>."""
+    return registers.parse_register( xml.etree.ElementTree.fromstring( text ) )
+
+def test_good_layout():
+    r, problems = parse( """<register name="Good" short="good" address="0x10">
+        <field name="a" bits="31:8" access="R" reset="0" />
+        <field name="b" bits="7:1" access="R" reset="0" />
+        <field name="c" bits="0" access="R" reset="0" />
+        </register>""" )
+    assert problems == []
+    r.check()
+
+def test_overlap():
+    r, problems = parse( """<register name="Overlap" short="overlap">
+        <field name="a" bits="7:4" access="R" reset="0" />
+        <field name="b" bits="4:0" access="R" reset="0" />
+        </register>""" )
+    assert problems == [ "Overlap: b (bits 4:0) overlaps a" ]
+
+def test_gap():
+    r, problems = parse( """<register name="Gap" short="gap">
+        <field name="a" bits="7:5" access="R" reset="0" />
+        <field name="b" bits="2:0" access="R" reset="0" />
+        </register>""" )
+    assert problems == [ "Gap: nothing defines bits 4:3 between a and b" ]
+
+def test_gap_at_bottom():
+    r, problems = parse( """<register name="Bottom" short="bottom">
+        <field name="a" bits="7:2" access="R" reset="0" />
+        </register>""" )
+    assert problems == [ "Bottom: nothing defines bits 1:0 below a" ]
+
+def test_symbolic_overlap_at_one_xlen():
+    # b only overlaps a when XLEN is 32. At the other XLENs there is a gap.
+    r, problems = parse( """<register name="Symbolic" short="symbolic">
+        <field name="a" bits="XLEN-1:XLEN-10" access="R" reset="0" />
+        <field name="b" bits="22:0" access="R" reset="0" />
+        </register>""" )
+    assert problems == [
+            "Symbolic: b (bits 22:0) overlaps a at XLEN=32",
+            "Symbolic: nothing defines bits 53:23 between a and b at XLEN=64",
+            "Symbolic: nothing defines bits 117:23 between a and b at "
+            "XLEN=128" ]
+
+def test_symbolic_layout():
+    r, problems = parse( """<register name="Wide" short="wide">
+        <field name="a" bits="XLEN-1:8" access="R" reset="0" />
+        <field name="b" bits="7:0" access="R" reset="0" />
+        </register>""" )
+    assert problems == []
+    assert [ ( f.name, high, low ) for f, high, low in
+            r.evaluated_layout( registers.symbol_values( 64 ) ) ] == \
+            [ ( "a", 63, 8 ), ( "b", 7, 0 ) ]
+
+MCONTROL = """<register name="Match Control" short="mcontrol">
+    <field name="type" bits="XLEN-1:XLEN-4" access="R" reset="2" />
+    <field name="dmode" bits="XLEN-5" access="WARL" reset="0" />
+    <field name="maskmax" bits="XLEN-6:XLEN-11" access="R" reset="0" />
+    <field name="0" bits="XLEN-12:23" access="R" reset="0" />
+    <field name="sizehi" bits="22:21" access="WARL" reset="0" />
+    <field name="rest" bits="%s" access="WARL" reset="0" />
+    </register>"""
+
+def test_fields_that_cant_exist():
+    # At XLEN=32, the reserved field would be -1 bits wide, and maskmax
+    # already takes the bits of sizehi.
+    r, problems = parse( MCONTROL % "20:0" )
+    assert problems == []
+    assert [ f.name for f, high, low in
+            r.evaluated_layout( registers.symbol_values( 32 ) ) ] == \
+            [ "type", "dmode", "maskmax", "rest" ]
+    instance = r.instantiate( registers.symbol_values( 32 ) )
+    assert [ f.name for f in instance.fields ] == \
+            [ "type", "dmode", "maskmax", "rest" ]
+    instance = r.instantiate( registers.symbol_values( 64 ) )
+    assert [ f.name for f in instance.fields ] == \
+            [ "type", "dmode", "maskmax", "0", "sizehi", "rest" ]
+
+def test_partial_overlap_fails_loudly():
+    # rest reaches into maskmax at XLEN=32, which isn't just a field that
+    # can't exist.
+    r, problems = parse( MCONTROL % "22:0" )
+    assert "Match Control: rest (bits 22:0) overlaps maskmax at XLEN=32" in \
+            problems
+    with pytest.raises( AssertionError, match="rest" ):
+        r.instantiate( registers.symbol_values( 32 ) )
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+"""Check the \\R (register) and \\F (field) macros, and the labels, used in the
+spec against everything that is defined, without running LaTeX. The macros
+and labels that registers.py generates from the XML files, and the ones that
+are defined by hand in the .tex files, go into one symbol table. Then every
+.tex file and the text in every XML file is scanned once, and undefined,
+colliding and (optionally) unused identifiers are reported."""
+
+import sys
+import re
+import argparse
+import collections
+
+from registers import read_registers, latex_symbols
+
+# Everything we care about in one regular expression, so that each file is
+# only scanned once. \defregname{\Rfoo} has to come before the plain macro, so
+# that the macro being defined isn't also counted as a use.
+TOKEN = re.compile( r"""
+    \\def(?:reg|field)name\{\\(?P<definition>[A-Za-z]+)\}
+  | \\label\{(?P<label>[^}]*)\}
+  | \\(?:ref|pageref)\{(?P<reference>[^}]*)\}
+  | \\hyperref\[(?P<hyperref>[^\]]*)\]
+  | \\(?P<macro>[RF][a-z][A-Za-z]*)
+""", re.VERBOSE )
+
+# A % that isn't escaped starts a comment in LaTeX.
+COMMENT = re.compile( r"(?<!\\)%.*" )
+
+class Location( object ):
+    __slots__ = ( "path", "line", "what" )
+
+    def __init__( self, path, line=None, what=None ):
+        self.path = path
+        self.line = line
+        self.what = what
+
+    def __str__( self ):
+        text = self.path
+        if self.line:
+            text += ":%d" % self.line
+        if self.what:
+            text += " (%s)" % self.what
+        return text
+
+class Index( object ):
+    """Where every macro and label is defined, and where it is used."""
+    def __init__( self ):
+        self.macros = collections.defaultdict( list )
+        self.labels = collections.defaultdict( list )
+        self.macroUses = collections.defaultdict( list )
+        self.labelUses = collections.defaultdict( list )
+        # Generated macro -> the label it links to.
+        self.targets = {}
+
+    def add_xml( self, path ):
+        """Add the macros and labels generated for the XML file at path, and
+        scan its text."""
+        registers = read_registers( path )
+        for kind, name, r, f, target in latex_symbols( registers ):
+            what = " ".join( str( x ) for x in ( r, f ) if x )
+            location = Location( path, what=what or registers.name )
+            if kind == "macro":
+                self.macros[ name ].append( location )
+                self.targets[ name ] = target
+            elif kind == "label":
+                self.labels[ name ].append( location )
+            else:
+                self.labelUses[ name ].append( location )
+        self.scan( path, latex=False )
+
+    def scan( self, path, latex=True ):
+        """Add the definitions and uses in the file at path."""
+        with open( path ) as fd:
+            for number, line in enumerate( fd, 1 ):
+                if latex:
+                    line = COMMENT.sub( "", line )
+                if not "\\" in line:
+                    continue
+                for match in TOKEN.finditer( line ):
+                    kind = match.lastgroup
+                    name = match.group( kind )
+                    location = Location( path, number )
+                    if kind == "definition":
+                        self.macros[ name ].append( location )
+                    elif kind == "label":
+                        self.labels[ name ].append( location )
+                    elif kind == "macro":
+                        self.macroUses[ name ].append( location )
+                    else:
+                        self.labelUses[ name ].append( location )
+
+    def undefined( self ):
+        """Return [ ( kind, name, uses ) ] of everything that is used but not
+        defined. A generated macro that is used counts as a use of the label
+        it links to."""
+        labelUses = collections.defaultdict( list, self.labelUses )
+        for name, target in self.targets.items():
+            if name in self.macroUses:
+                labelUses[ target ] = labelUses[ target ] + [
+                        Location( use.path, use.line, "\\" + name )
+                        for use in self.macroUses[ name ] ]
+        result = []
+        for kind, uses, definitions in (
+                ( "macro", self.macroUses, self.macros ),
+                ( "label", labelUses, self.labels ) ):
+            for name in sorted( uses ):
+                if not name in definitions:
+                    result.append(( kind, name, uses[ name ] ))
+        return result
+
+    def colliding( self ):
+        """Return [ ( kind, name, definitions ) ] of everything that is
+        defined more than once. Registers that are deliberately listed more
+        than once under the same name (like BYPASS in the JTAG DTM) define
+        the same macros each time, which is fine."""
+        result = []
+        for kind, definitions in ( ( "macro", self.macros ),
+                ( "label", self.labels ) ):
+            for name in sorted( definitions ):
+                distinct = set( ( l.path, l.line or l.what )
+                        for l in definitions[ name ] )
+                if len( distinct ) > 1:
+                    result.append(( kind, name, definitions[ name ] ))
+        return result
+
+    def unused( self ):
+        """Return [ ( kind, name, definitions ) ] of every macro that is
+        defined but never used. Generated field macros are left out, since
+        most fields are never mentioned outside their own register."""
+        return [ ( "macro", name, self.macros[ name ] )
+                for name in sorted( self.macros )
+                if not name in self.macroUses and
+                not ( name in self.targets and name.startswith( "F" ) ) ]
+
+def read_baseline( path ):
+    """Return the set of known problems listed in the file at path, as
+    ( problem, kind, name ). Each line is like "undefined label sizelo" or
+    "colliding label dm". Everything after a # is a comment."""
+    result = set()
+    with open( path ) as fd:
+        for number, line in enumerate( fd, 1 ):
+            words = line.split( "#" )[0].split()
+            if not words:
+                continue
+            assert len( words ) == 3 and \
+                    words[0] in ( "undefined", "colliding" ), \
+                    "%s:%d: can't parse %r" % ( path, number, line.strip() )
+            result.add( tuple( words ) )
+    return result
+
+def report( fd, title, problems ):
+    if not problems:
+        return
+    fd.write( "%s:\n" % title )
+    for kind, name, locations in problems:
+        fd.write( "  %s %s\n" % ( kind, name ) )
+        for location in locations:
+            fd.write( "    %s\n" % location )
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'xml', nargs='+', help='XML register files.' )
+    parser.add_argument( '--tex', nargs='+', default=[],
+            help='LaTeX files to scan.' )
+    parser.add_argument( '--unused', action='store_true',
+            help='Also report macros that are never used.' )
+    parser.add_argument( '--baseline',
+            help='File listing known problems, which are not reported.' )
+    parsed = parser.parse_args()
+
+    index = Index()
+    for path in parsed.xml:
+        index.add_xml( path )
+    for path in parsed.tex:
+        index.scan( path )
+
+    undefined = index.undefined()
+    colliding = index.colliding()
+    if parsed.baseline:
+        known = read_baseline( parsed.baseline )
+        found = set( [ ( "undefined", kind, name )
+                for kind, name, locations in undefined ] +
+            [ ( "colliding", kind, name )
+                for kind, name, locations in colliding ] )
+        undefined = [ ( kind, name, locations )
+                for kind, name, locations in undefined
+                if not ( "undefined", kind, name ) in known ]
+        colliding = [ ( kind, name, locations )
+                for kind, name, locations in colliding
+                if not ( "colliding", kind, name ) in known ]
+        fixed = sorted( known - found )
+        if fixed:
+            sys.stdout.write( "Fixed, remove from %s:\n" % parsed.baseline )
+            for problem in fixed:
+                sys.stdout.write( "  %s\n" % " ".join( problem ) )
+    report( sys.stdout, "Undefined", undefined )
+    report( sys.stdout, "Defined more than once", colliding )
+    if parsed.unused:
+        report( sys.stdout, "Unused", index.unused() )
+    if undefined or colliding:
+        return 1
+
+if __name__ == "__main__":
+    sys.exit( main() )